@@ -5,6 +5,8 @@ import { Link, useNavigate } from 'react-router-dom';
 
 function PatientListPage() {
     const [patients, setPatients] = useState([]);
+    const [page, setPage] = useState(1);
+    const [pagination, setPagination] = useState(null);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState('');
     const { isAuthenticated, user } = useAuth();
@@ -18,8 +20,9 @@ function PatientListPage() {
         setLoading(true);
         setError('');
         try {
-            const response = await axios.get('/patients');
-            setPatients(response.data);
+            const response = await axios.get('/patients', { params: { page } });
+            setPatients(response.data.data);
+            setPagination(response.data.pagination);
         } catch (err) {
             setError('Failed to fetch patients. Please try again later.');
             console.error('Error fetching patients:', err.response?.data || err.message);
@@ -29,7 +32,7 @@ function PatientListPage() {
         } finally {
             setLoading(false);
         }
-    }, [isAuthenticated]);
+    }, [isAuthenticated, page]);
 
     useEffect(() => {
         fetchPatients();
@@ -98,6 +101,14 @@ function PatientListPage() {
                     </tbody>
                 </table>
             )}
+
+            {pagination && pagination.pages > 1 && (
+                <div style={{ marginTop: '15px' }}>
+                    <button onClick={() => setPage(page - 1)} disabled={!pagination.has_prev} style={actionButtonStyle}>Previous</button>
+                    <span style={{ marginRight: '10px' }}>Page {pagination.page} of {pagination.pages}</span>
+                    <button onClick={() => setPage(page + 1)} disabled={!pagination.has_next} style={actionButtonStyle}>Next</button>
+                </div>
+            )}
         </div>
     );
 }
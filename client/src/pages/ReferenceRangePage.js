@@ -66,7 +66,8 @@ function ReferenceRangePage() {
             parameter: newParameter,
             normal_min: parseFloat(newNormalMinValue), // Changed to normal_min
             normal_max: parseFloat(newNormalMaxValue), // Changed to normal_max
-            units: newUnits
+            units: newUnits,
+            reflag: true // Re-flag stored results against the new range
         };
 
         try {
@@ -3,11 +3,15 @@ from .config import Config
 from .extensions import db, migrate, jwt
 from .models import *  # Ensures models are imported during migration
 from .routes import register_routes
+from .json_provider import json_provider_class
+from .services.http_cache import compress_response
+from .services import ingest
 from flask_cors import CORS
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.json = json_provider_class()(app)
 
     # Initialize extensions
     db.init_app(app)
@@ -25,6 +29,11 @@ def create_app():
 
     # Register blueprints/routes
     register_routes(app)
+    app.after_request(compress_response)
+
+    # Otherwise the worker starts with the first queued result
+    if app.config.get("INGEST_MODE") == "async" and app.config.get("INGEST_WORKER_AUTOSTART"):
+        ingest.worker.ensure_started(app)
 
     # Root endpoint - health check
     @app.route("/")
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -6,4 +7,85 @@ load_dotenv()
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
\ No newline at end of file
+    JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+
+    # Seconds between cross-worker reference range version checks
+    REFERENCE_RANGE_VERSION_CHECK_SECONDS = float(os.getenv("REFERENCE_RANGE_VERSION_CHECK_SECONDS", "5"))
+
+    # Upper bound on results accepted by POST /api/tests/batch
+    MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "5000"))
+    # Upper bound on parameters accepted by POST /api/panels
+    MAX_PANEL_SIZE = int(os.getenv("MAX_PANEL_SIZE", "200"))
+
+    # Password hashing runs on a process pool; 0 workers hashes on the request thread
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max((os.cpu_count() or 2) // 2, 1))))
+    # Hash/verify calls allowed in flight before login and register return 503
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+    PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_TIMEOUT_SECONDS", "10"))
+
+    # Per-worker cache of users behind JWT identities, and of users listing pages
+    PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+    PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+    USER_LIST_CACHE_SIZE = int(os.getenv("USER_LIST_CACHE_SIZE", "64"))
+    # Seconds between cross-worker checks for user changes
+    PRINCIPAL_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("PRINCIPAL_CACHE_VERSION_CHECK_SECONDS", "5"))
+
+    # Per-worker cache of rendered responses for read endpoints, keyed by ETag
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("true", "1")
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+    # JSON bodies at least this large are gzip/brotli encoded
+    COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+    # Flagged-result stream: "postgres" (LISTEN/NOTIFY across workers), "memory" or "auto"
+    EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "auto")
+    # Events buffered per SSE client before the oldest are dropped
+    EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+    EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+    # Open SSE streams per worker; each holds a thread, so run gunicorn with
+    # -k gthread (--threads above this) or -k gevent, never the sync worker
+    EVENTS_MAX_STREAMS = int(os.getenv("EVENTS_MAX_STREAMS", "50"))
+
+    # GET /api/sync: rows per table per page, how far back a caught-up cursor
+    # re-reads to catch late commits, and how long deletions are remembered
+    SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+    SYNC_OVERLAP_SECONDS = float(os.getenv("SYNC_OVERLAP_SECONDS", "5"))
+    SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "30"))
+
+    # Parquet snapshots stop at rows untouched for this long, and each
+    # incremental run re-reads this far behind the last cutoff so rows of
+    # transactions that committed late are not skipped (keep it above the
+    # longest write transaction)
+    SNAPSHOT_SETTLE_SECONDS = float(os.getenv("SNAPSHOT_SETTLE_SECONDS", "5"))
+    SNAPSHOT_OVERLAP_SECONDS = float(os.getenv("SNAPSHOT_OVERLAP_SECONDS", "300"))
+
+    # Patient/parameter search: "postgres" (pg_trgm indexes), "memory" (per-worker tries) or "auto"
+    SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+
+    # "async" makes POST /api/tests queue results in the ingest outbox (also per
+    # request with "Prefer: respond-async"); a worker writes them in batches
+    INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+    INGEST_MAX_DELAY_SECONDS = float(os.getenv("INGEST_MAX_DELAY_SECONDS", "0.5"))
+    # Backlog at which POST /api/tests answers 503 instead of queueing
+    INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "50000"))
+    INGEST_MAX_WAIT_SECONDS = float(os.getenv("INGEST_MAX_WAIT_SECONDS", "10"))
+    # How long processed items (and their idempotency keys) are kept
+    INGEST_RETENTION_HOURS = int(os.getenv("INGEST_RETENTION_HOURS", "24"))
+    # With INGEST_MODE "async", also start the worker with the app, so items left
+    # pending by a restart are written without waiting for the next enqueue.
+    # Off by default: enable it in the processes meant to drain the outbox
+    # (scripts and CLI commands creating an app otherwise start one too)
+    INGEST_WORKER_AUTOSTART = os.getenv("INGEST_WORKER_AUTOSTART", "false").lower() in ("true", "1")
+
+    # Largest results file accepted by POST /api/imports
+    MAX_IMPORT_BYTES = int(os.getenv("MAX_IMPORT_BYTES", str(4 * 1024 ** 3)))
+
+    # Rendered lab reports, keyed by a hash of their content. Batches render
+    # on REPORT_WORKERS processes (0 renders in-process); PDF needs weasyprint
+    REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "labtracker-reports"))
+    REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", str(max((os.cpu_count() or 2) // 2, 1))))
+
+    # GET /api/analytics/parameters: longest window, and per-worker results cached
+    ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", "732"))
+    ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "128"))
@@ -0,0 +1,47 @@
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """
+    Flask's provider, but dates and datetimes are written as ISO 8601
+    (what the routes used to produce with isoformat()) instead of HTTP dates.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+class OrjsonProvider(IsoJSONProvider):
+    """
+    JSON provider backed by orjson, which serializes dicts, datetimes,
+    dates and NumPy arrays natively in C. Anything else goes through
+    IsoJSONProvider.default. Keys are not sorted.
+    """
+
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.options | orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype,
+        )
+
+def json_provider_class():
+    """
+    Returns OrjsonProvider when orjson is installed, else IsoJSONProvider.
+    """
+    return OrjsonProvider if orjson is not None else IsoJSONProvider
@@ -2,4 +2,10 @@ from .user import User
 from .patient import Patient
 from .lab_test import LabTest
 from .test_reference_range import TestReferenceRange
-
+from .table_version import TableVersion
+from .dashboard_counter import DashboardCounter
+from .lab_panel import LabPanel
+from .tombstone import Tombstone
+from .ingest_item import IngestItem
+from .lab_test_rollup import LabTestRollup
+from .rollup_window import RollupWindow
@@ -0,0 +1,34 @@
+from ..extensions import db
+from datetime import datetime
+
+class DashboardCounter(db.Model):
+    __tablename__ = "dashboard_counters"
+
+    # One row per creator and day; a NULL day holds the creator's all-days
+    # totals and a NULL created_by holds patients without a creator.
+    # Totals across creators are summed at read time, so no single row is
+    # updated by every write.
+    id = db.Column(db.Integer, primary_key=True)
+    created_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    day = db.Column(db.Date, nullable=True)
+    patient_count = db.Column(db.Integer, nullable=False, default=0)
+    test_count = db.Column(db.Integer, nullable=False, default=0)
+    abnormal_count = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped by every write to the row; dashboard ETags are derived from the
+    # rows they read rather than from one global table version
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # NULLs are distinct in unique indexes, so fold them to sentinels;
+        # counters.record_many upserts against this index
+        db.Index(
+            "uq_dashboard_counters_scope",
+            db.func.coalesce(created_by, db.literal_column("0")),
+            db.func.coalesce(day, db.literal_column("'1970-01-01'")),
+            unique=True,
+        ),
+    )
+
+    def __repr__(self):
+        return f"<DashboardCounter created_by={self.created_by} day={self.day}>"
@@ -0,0 +1,33 @@
+from ..extensions import db
+from sqlalchemy.dialects.postgresql import JSON
+from datetime import datetime
+
+class IngestItem(db.Model):
+    __tablename__ = "ingest_outbox"
+    __table_args__ = (
+        # Client-supplied Idempotency-Key, unique per submitter
+        db.UniqueConstraint("submitted_by", "idempotency_key", name="uq_ingest_outbox_submitted_by_key"),
+        # The worker only ever scans pending rows, oldest first
+        db.Index(
+            "ix_ingest_outbox_pending_id", "id",
+            postgresql_where=db.text("state = 'pending'"),
+            sqlite_where=db.text("state = 'pending'"),
+        ),
+        db.Index("ix_ingest_outbox_processed_at", "processed_at"),
+    )
+
+    # One lab result accepted by POST /api/tests in async mode and waiting
+    # to be written by the ingest worker. state is 'pending', 'done' or
+    # 'rejected'; done rows point at the lab test they became.
+    id = db.Column(db.Integer, primary_key=True)
+    submitted_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    idempotency_key = db.Column(db.String(128), nullable=True)
+    payload = db.Column(JSON, nullable=False)
+    state = db.Column(db.String(10), nullable=False, default="pending")
+    error = db.Column(db.String(255), nullable=True)
+    lab_test_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<IngestItem {self.id} {self.state}>"
@@ -0,0 +1,19 @@
+from ..extensions import db
+from datetime import datetime
+
+class LabPanel(db.Model):
+    __tablename__ = "lab_panels"
+
+    # One submission of a multi-parameter test (e.g. a CBC); its results are
+    # the lab_tests rows that point back here through panel_id.
+    id = db.Column(db.Integer, primary_key=True)
+    accession = db.Column(db.String(64), nullable=False, unique=True)
+    test_type = db.Column(db.String(100), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey("patients.id"), nullable=False, index=True)
+    submitted_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    date_conducted = db.Column(db.DateTime, default=datetime.utcnow)
+
+    lab_tests = db.relationship("LabTest", backref="panel", lazy=True, order_by="LabTest.id")
+
+    def __repr__(self):
+        return f"<LabPanel {self.accession}>"
@@ -4,14 +4,43 @@ from datetime import datetime
 
 class LabTest(db.Model):
     __tablename__ = "lab_tests"
+    __table_args__ = (
+        db.Index("ix_lab_tests_patient_id_date_conducted", "patient_id", "date_conducted"),
+        db.Index("ix_lab_tests_date_conducted", "date_conducted"),
+        db.Index("ix_lab_tests_parameter_id", "parameter", "id"),
+        # Change feed scans for /api/sync
+        db.Index("ix_lab_tests_updated_at_id", "updated_at", "id"),
+        # Range scans such as "hemoglobin < 8 in the last week"
+        db.Index("ix_lab_tests_parameter_value_numeric", "parameter", "value_numeric"),
+        db.Index("ix_lab_tests_parameter_date_value", "parameter", "date_conducted", "value_numeric"),
+        # Per-patient trends: index-only scan of one parameter's series
+        db.Index(
+            "ix_lab_tests_patient_parameter_date", "patient_id", "parameter", "date_conducted",
+            postgresql_include=["value_numeric"],
+        ),
+        # Partial index: only abnormal rows, for dashboard counts and flagged listings
+        db.Index(
+            "ix_lab_tests_flagged_id", "id",
+            postgresql_where=db.text("flagged IS TRUE"),
+            sqlite_where=db.text("flagged IS TRUE"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     parameter = db.Column(db.String(100), nullable=False, default="Pending")
     result_values = db.Column(JSON, nullable=False)
+    # Typed copies of result_values["value"] / ["unit"] so they can be indexed
+    value_numeric = db.Column(db.Float, nullable=True)
+    unit = db.Column(db.String(50), nullable=True)
     date_conducted = db.Column(db.DateTime, default=datetime.utcnow)
     flagged = db.Column(db.Boolean, default=False)
+    # 'Low', 'High', 'Normal' or 'Unknown' as of the last (re-)flagging
+    status = db.Column(db.String(10), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     patient_id = db.Column(db.Integer, db.ForeignKey("patients.id"), nullable=False)
+    # Set when the result was submitted as part of a panel
+    panel_id = db.Column(db.Integer, db.ForeignKey("lab_panels.id"), nullable=True, index=True)
 
     # Optional: for bidirectional relationship if needed in Patient
     # patient = db.relationship("Patient", back_populates="lab_tests")
\ No newline at end of file
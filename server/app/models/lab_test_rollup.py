@@ -0,0 +1,27 @@
+from ..extensions import db
+
+class LabTestRollup(db.Model):
+    __tablename__ = "lab_test_rollups"
+    __table_args__ = (
+        db.Index("ix_lab_test_rollups_bucket", "granularity", "bucket_start", "parameter"),
+    )
+
+    # Aggregates of one parameter's results over one closed day or week.
+    # NULL created_by is the all-creators row, as in dashboard_counters.
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)
+    bucket_start = db.Column(db.Date, nullable=False)
+    parameter = db.Column(db.String(100), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    test_count = db.Column(db.Integer, nullable=False, default=0)
+    numeric_count = db.Column(db.Integer, nullable=False, default=0)
+    abnormal_count = db.Column(db.Integer, nullable=False, default=0)
+    value_sum = db.Column(db.Float, nullable=True)
+    value_min = db.Column(db.Float, nullable=True)
+    value_max = db.Column(db.Float, nullable=True)
+    p50 = db.Column(db.Float, nullable=True)
+    p90 = db.Column(db.Float, nullable=True)
+    p95 = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f"<LabTestRollup {self.granularity} {self.bucket_start} {self.parameter}>"
@@ -1,12 +1,24 @@
 from ..extensions import db
+from datetime import datetime
 
 class Patient(db.Model):
     __tablename__ = "patients"
+    __table_args__ = (
+        # Change feed scans for /api/sync
+        db.Index("ix_patients_updated_at_id", "updated_at", "id"),
+        # Patient search: trigram index serves ILIKE '%...%' on Postgres
+        db.Index(
+            "ix_patients_name_trgm", "name",
+            postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+        db.Index("ix_patients_dob", "dob"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     dob = db.Column(db.Date, nullable=False)
     gender = db.Column(db.String(10), nullable=False)
-    created_by = db.Column(db.Integer, db.ForeignKey("users.id"))
+    created_by = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     lab_tests = db.relationship("LabTest", backref="patient", lazy=True)
\ No newline at end of file
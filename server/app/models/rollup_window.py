@@ -0,0 +1,18 @@
+from ..extensions import db
+
+class RollupWindow(db.Model):
+    __tablename__ = "lab_test_rollup_windows"
+    __table_args__ = (
+        db.UniqueConstraint("granularity", "bucket_start", name="uq_lab_test_rollup_windows_bucket"),
+    )
+
+    # One row per closed day or week whose rollups are stored (even if it had
+    # no results). Results added, changed or deleted after computed_at make
+    # the window stale.
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)
+    bucket_start = db.Column(db.Date, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<RollupWindow {self.granularity} {self.bucket_start}>"
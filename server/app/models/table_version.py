@@ -0,0 +1,13 @@
+from ..extensions import db
+from datetime import datetime
+
+class TableVersion(db.Model):
+    __tablename__ = "table_versions"
+
+    # One row per tracked table; bumped in the same transaction as the write
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<TableVersion {self.table_name}={self.version}>"
@@ -1,14 +1,40 @@
 from ..extensions import db
+from datetime import datetime
 
 class TestReferenceRange(db.Model):
     __tablename__ = "test_reference_ranges"
 
     id = db.Column(db.Integer, primary_key=True)
     test_type = db.Column(db.String(100), nullable=True)
-    parameter = db.Column(db.String(100), nullable=False)
+    parameter = db.Column(db.String(100), nullable=False, index=True)
     normal_min = db.Column(db.Float, nullable=False)
     normal_max = db.Column(db.Float, nullable=False)
     units = db.Column(db.String(50), nullable=False)
+    # Demographic band; NULL sex means any sex, NULL ages are unbounded.
+    # Ages are in years and the band covers age_min <= age < age_max.
+    sex = db.Column(db.String(10), nullable=True)
+    age_min = db.Column(db.Float, nullable=True)
+    age_max = db.Column(db.Float, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # NULLs are distinct in unique constraints, and ranges created through
+        # the API have no test_type, so fold NULLs to sentinels
+        db.Index(
+            "uq_test_reference_ranges_band",
+            db.func.coalesce(test_type, db.literal_column("''")),
+            parameter,
+            db.func.coalesce(sex, db.literal_column("''")),
+            db.func.coalesce(age_min, db.literal_column("-1")),
+            unique=True,
+        ),
+        # Change feed scans for /api/sync
+        db.Index("ix_test_reference_ranges_updated_at_id", "updated_at", "id"),
+        db.Index(
+            "ix_test_reference_ranges_parameter_trgm", "parameter",
+            postgresql_using="gin", postgresql_ops={"parameter": "gin_trgm_ops"},
+        ),
+    )
 
 
     def __repr__(self):
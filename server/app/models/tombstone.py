@@ -0,0 +1,20 @@
+from ..extensions import db
+from datetime import datetime
+
+class Tombstone(db.Model):
+    __tablename__ = "tombstones"
+    __table_args__ = (
+        db.Index("ix_tombstones_deleted_at_id", "deleted_at", "id"),
+    )
+
+    # One row per deleted patient, lab test or reference range, so /api/sync
+    # can tell clients to drop their copy. owner_id is the patient creator;
+    # NULL means every user sees the deletion (reference ranges).
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    owner_id = db.Column(db.Integer, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Tombstone {self.table_name}:{self.row_id}>"
@@ -4,6 +4,13 @@ from .lab_test_routes import lab_test_bp
 from .reference_range_routes import reference_bp
 from .dashboard_routes import dashboard_bp
 from .user_routes import user_bp
+from .metrics_routes import metrics_bp
+from .panel_routes import panel_bp
+from .events_routes import events_bp
+from .sync_routes import sync_bp
+from .import_routes import import_bp
+from .report_routes import report_bp
+from .analytics_routes import analytics_bp
 def register_routes(app):
     """Register all blueprint routes with the Flask app."""
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -12,6 +19,13 @@ def register_routes(app):
     app.register_blueprint(reference_bp, url_prefix='/api/reference_ranges')
     app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
     app.register_blueprint(user_bp, url_prefix='/api/users')
+    app.register_blueprint(metrics_bp, url_prefix='/api/metrics')
+    app.register_blueprint(panel_bp, url_prefix='/api/panels')
+    app.register_blueprint(events_bp, url_prefix='/api/events')
+    app.register_blueprint(sync_bp, url_prefix='/api/sync')
+    app.register_blueprint(import_bp, url_prefix='/api/imports')
+    app.register_blueprint(report_bp, url_prefix='/api/reports')
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
     # Health check route
     @app.route('/health')
     def health_check():
@@ -0,0 +1,42 @@
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required
+from datetime import date, timedelta
+from ..services import analytics
+
+analytics_bp = Blueprint("analytics", __name__)
+
+DEFAULT_DAYS = 30
+DEFAULT_MAX_DAYS = 732
+
+# GET: Per-parameter distributions (count, mean, percentiles, abnormal rate) by day or week, optionally by creator
+@analytics_bp.route("/parameters", methods=["GET"])
+@jwt_required()
+def get_parameter_stats():
+    granularity = request.args.get("granularity", "day")
+    if granularity not in analytics.GRANULARITIES:
+        return jsonify({"msg": f"granularity must be one of: {', '.join(analytics.GRANULARITIES)}"}), 400
+    group_by = request.args.get("group_by")
+    if group_by not in (None, "", "creator"):
+        return jsonify({"msg": "group_by must be creator"}), 400
+    try:
+        date_to = date.fromisoformat(request.args["date_to"]) if request.args.get("date_to") else date.today()
+        date_from = (date.fromisoformat(request.args["date_from"]) if request.args.get("date_from")
+                     else date_to - timedelta(days=DEFAULT_DAYS - 1))
+    except ValueError:
+        return jsonify({"msg": "date_from and date_to must be ISO dates (YYYY-MM-DD)"}), 400
+    if date_from > date_to:
+        return jsonify({"msg": "date_from must not be after date_to"}), 400
+    max_days = current_app.config.get("ANALYTICS_MAX_DAYS", DEFAULT_MAX_DAYS)
+    if (date_to - date_from).days + 1 > max_days:
+        return jsonify({"msg": f"Window too long (max {max_days} days)"}), 400
+
+    parameters = [p.strip() for p in request.args.get("parameter", "").split(",") if p.strip()]
+    created_by = request.args.get("created_by", type=int)
+    try:
+        return jsonify(analytics.parameter_stats(
+            granularity, date_from, date_to,
+            parameters=parameters or None, created_by=created_by, by_creator=group_by == "creator",
+        )), 200
+    except Exception as e:
+        print(f"Analytics error: {str(e)}")
+        return jsonify({"error": "Failed to compute parameter statistics"}), 500
@@ -1,11 +1,13 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token
 from datetime import timedelta
 import logging
 
 from ..extensions import db
 from ..models.user import User
+from ..services.passwords import hasher, HashPoolBusy
+from ..services.principals import invalidate_users
+from .user_routes import ROLES
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -13,6 +15,13 @@ auth_bp = Blueprint("auth", __name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+HASH_RETRY_AFTER_SECONDS = "2"
+
+def _busy():
+    response = jsonify({"msg": "Server busy, please retry shortly"})
+    response.headers["Retry-After"] = HASH_RETRY_AFTER_SECONDS
+    return response, 503
+
 # Register User
 @auth_bp.route("/register", methods=["POST"])
 def register():
@@ -27,8 +36,18 @@ def register():
     if User.query.filter_by(email=data["email"]).first():
         return jsonify({"msg": "Email already registered"}), 400
 
-    hashed_password = generate_password_hash(data["password"])
-    role = data.get("role", "user")
+    role = data.get("role") or "user"
+    if role not in ROLES:
+        return jsonify({"msg": f"role must be one of: {', '.join(ROLES)}"}), 400
+    # Only the first admin of a fresh install signs up as one; after that
+    # admins grant the role through PUT /api/users/<id>/role
+    if role == "admin" and User.query.filter_by(role="admin").first():
+        return jsonify({"msg": "Only an admin can grant the admin role"}), 403
+
+    try:
+        hashed_password = hasher.hash(data["password"])
+    except HashPoolBusy:
+        return _busy()
 
     new_user = User(
         name=data["name"],
@@ -37,6 +56,7 @@ def register():
         role=role,
     )
     db.session.add(new_user)
+    invalidate_users()
     db.session.commit()
 
     return jsonify({"msg": "User registered successfully"}), 201
@@ -51,8 +71,17 @@ def login():
         return jsonify({"msg": "Missing email or password"}), 400
 
     user = User.query.filter_by(email=data["email"]).first()
-    if not user or not check_password_hash(user.password, data["password"]):
-        return jsonify({"msg": "Invalid email or password"}), 401
+    try:
+        if not user or not hasher.verify(user.password, data["password"]):
+            return jsonify({"msg": "Invalid email or password"}), 401
+
+        # Upgrade hashes made with older parameters while we have the plaintext
+        if hasher.needs_rehash(user.password):
+            user.password = hasher.hash(data["password"])
+            db.session.commit()
+            hasher.rehashed += 1
+    except HashPoolBusy:
+        return _busy()
 
     access_token = create_access_token(
         identity={"id": user.id, "email": user.email, "role": user.role},
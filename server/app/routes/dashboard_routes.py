@@ -1,22 +1,88 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required
+from sqlalchemy import func
+from datetime import timedelta
 from ..extensions import db
-from ..models import Patient, LabTest
+from ..models import DashboardCounter
+from ..services.counters import today, version_of
+from ..services.http_cache import conditional
 
 dashboard_bp = Blueprint("dashboard", __name__)
 
+DEFAULT_TREND_DAYS = 30
+MAX_TREND_DAYS = 366
+
+def _totals(created_by):
+    """
+    Summed counters, across all creators unless one is given. There is one
+    row per creator, so the sum stays small.
+    """
+    query = db.session.query(
+        func.coalesce(func.sum(DashboardCounter.patient_count), 0).label("patient_count"),
+        func.coalesce(func.sum(DashboardCounter.test_count), 0).label("test_count"),
+        func.coalesce(func.sum(DashboardCounter.abnormal_count), 0).label("abnormal_count"),
+    )
+    if created_by is not None:
+        query = query.filter(DashboardCounter.created_by == created_by)
+    return query
+
+def _scope():
+    created_by = request.args.get("created_by", type=int)
+    return () if created_by is None else (DashboardCounter.created_by == created_by,)
+
+def _since():
+    days = request.args.get("days", DEFAULT_TREND_DAYS, type=int)
+    if days < 1 or days > MAX_TREND_DAYS:
+        days = DEFAULT_TREND_DAYS
+    return today() - timedelta(days=days - 1)
+
+def _summary_version():
+    return version_of(DashboardCounter.day.is_(None), *_scope())
+
+def _trends_version():
+    # The window moves with the date even when no row changes
+    since = _since()
+    token, last_modified = version_of(DashboardCounter.day >= since, *_scope())
+    return f"{since.isoformat()}.{token}", last_modified
+
 @dashboard_bp.route("/summary", methods=["GET"])
 @jwt_required(optional=True)
+@conditional(cache=True, version=_summary_version)
 def get_summary():
     try:
-        patient_count = db.session.query(Patient).count()
-        test_count = db.session.query(LabTest).count()
-        abnormal_count = db.session.query(LabTest).filter(LabTest.flagged.is_(True)).count()
+        # Read of the incrementally maintained all-days totals
+        created_by = request.args.get("created_by", type=int)
+        counter = _totals(created_by).filter(DashboardCounter.day.is_(None)).one()
         return jsonify({
-            "patientCount": patient_count,
-            "testCount": test_count,
-            "abnormalCount": abnormal_count,
+            "patientCount": int(counter.patient_count),
+            "testCount": int(counter.test_count),
+            "abnormalCount": int(counter.abnormal_count),
         }), 200
     except Exception as e:
         print(f"Dashboard error: {str(e)}")
-        return jsonify({"error": "Failed to fetch dashboard data"}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to fetch dashboard data"}), 500
+
+@dashboard_bp.route("/trends", methods=["GET"])
+@jwt_required(optional=True)
+@conditional(version=_trends_version)
+def get_trends():
+    try:
+        created_by = request.args.get("created_by", type=int)
+        since = _since()
+
+        counters = _totals(created_by).add_columns(DashboardCounter.day).filter(
+            DashboardCounter.day >= since,
+        ).group_by(DashboardCounter.day).order_by(DashboardCounter.day).all()
+
+        return jsonify({
+            "since": since.isoformat(),
+            "days": [{
+                "day": c.day.isoformat(),
+                "patientCount": int(c.patient_count),
+                "testCount": int(c.test_count),
+                "abnormalCount": int(c.abnormal_count),
+            } for c in counters],
+        }), 200
+    except Exception as e:
+        print(f"Dashboard trends error: {str(e)}")
+        return jsonify({"error": "Failed to fetch dashboard trends"}), 500
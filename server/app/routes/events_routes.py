@@ -0,0 +1,111 @@
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from flask_jwt_extended import decode_token, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import WrongTokenError
+from ..extensions import db
+from ..models.lab_test import LabTest
+from ..models.patient import Patient
+from ..services import events
+from ..services.principals import get_principal
+import json
+import queue
+
+events_bp = Blueprint("events", __name__)
+
+DEFAULT_HEARTBEAT_SECONDS = 15
+REPLAY_LIMIT = 500
+RETRY_MILLISECONDS = 5000
+BUSY_RETRY_SECONDS = "30"
+
+def _identity():
+    """
+    EventSource cannot send headers, so the stream also accepts ?token=<access token>.
+    Refresh tokens are refused there, as they are in the Authorization header.
+    """
+    token = request.args.get("token")
+    if token:
+        claims = decode_token(token)
+        if claims.get("type") != "access":
+            raise WrongTokenError("Only access tokens are allowed")
+        return claims["sub"]
+    verify_jwt_in_request()
+    return get_jwt_identity()
+
+def _replay(created_by, last_id):
+    """
+    Flagged results a reconnecting client missed, oldest first.
+    """
+    query = db.session.query(
+        LabTest.id, LabTest.patient_id, Patient.created_by, LabTest.parameter,
+        LabTest.result_values, LabTest.status, LabTest.date_conducted,
+    ).join(Patient, Patient.id == LabTest.patient_id).filter(
+        LabTest.flagged.is_(True), LabTest.id > last_id,
+    )
+    if created_by is not None:
+        query = query.filter(Patient.created_by == created_by)
+    return [events.flagged_event(*row) for row in query.order_by(LabTest.id).limit(REPLAY_LIMIT)]
+
+def _message(item):
+    return f"id: {item['id']}\nevent: flagged\ndata: {json.dumps(item)}\n\n"
+
+# GET: Server-sent stream of newly flagged results for the caller's patients
+# (admins may pass ?created_by= to follow another creator)
+@events_bp.route("/flagged", methods=["GET"])
+def stream_flagged():
+    try:
+        identity = _identity()
+    except Exception as e:
+        return jsonify({"msg": f"Invalid or missing token: {str(e)}"}), 401
+    user_id = identity.get("id") if isinstance(identity, dict) else identity
+
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Invalid or missing token"}), 401
+
+    created_by = request.args.get("created_by", user_id, type=int)
+    if created_by != user_id:
+        principal = get_principal(user_id)
+        if principal is None or principal.role != "admin":
+            return jsonify({"msg": "Only admins can follow another user's results"}), 403
+    last_id = request.headers.get("Last-Event-ID", request.args.get("last_event_id"), type=int)
+    app = current_app._get_current_object()
+    heartbeat = app.config.get("EVENTS_HEARTBEAT_SECONDS", DEFAULT_HEARTBEAT_SECONDS)
+
+    # Subscribe before replaying so nothing committed in between is lost
+    try:
+        subscription = events.subscribe(app, created_by)
+    except events.TooManyStreams:
+        response = jsonify({"msg": "Too many open event streams, please retry shortly"})
+        response.headers["Retry-After"] = BUSY_RETRY_SECONDS
+        return response, 503
+    backlog = _replay(created_by, last_id) if last_id is not None else []
+    db.session.remove()
+
+    def generate():
+        replayed = {item["id"] for item in backlog}
+        reported_drops = 0
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            for item in backlog:
+                yield _message(item)
+            while True:
+                try:
+                    item = subscription.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if subscription.dropped != reported_drops:
+                    # The client fell behind; it should refetch instead of trusting the stream
+                    yield f"event: overflow\ndata: {json.dumps({'dropped': subscription.dropped - reported_drops})}\n\n"
+                    reported_drops = subscription.dropped
+                if item["id"] in replayed:
+                    continue
+                yield _message(item)
+        finally:
+            events.broker.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,57 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..services import importer
+import os
+import tempfile
+
+import_bp = Blueprint("imports", __name__)
+
+DEFAULT_MAX_IMPORT_BYTES = 4 * 1024 ** 3
+
+# POST: Upload an HL7 ORU, ASTM or CSV results file (multipart field "file") and import it in the background
+@import_bp.route("", methods=["POST"], strict_slashes=False)
+@jwt_required()
+def upload_results_file():
+    max_bytes = current_app.config.get("MAX_IMPORT_BYTES", DEFAULT_MAX_IMPORT_BYTES)
+    if request.content_length and request.content_length > max_bytes:
+        return jsonify({"msg": f"File too large (max {max_bytes} bytes)"}), 413
+
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        return jsonify({"msg": "Missing file"}), 400
+    fmt = request.form.get("format") or None
+    if fmt and fmt not in importer.FORMATS:
+        return jsonify({"msg": f"format must be one of: {', '.join(importer.FORMATS)}"}), 400
+    try:
+        chunk_size = int(request.form.get("chunk_size", importer.DEFAULT_CHUNK_SIZE))
+    except (ValueError, TypeError):
+        return jsonify({"msg": "chunk_size must be a number"}), 400
+    if chunk_size < 1:
+        return jsonify({"msg": "chunk_size must be a positive number"}), 400
+    create_patients = request.form.get("create_patients", "true").lower() in ("true", "1")
+
+    # Werkzeug has already spooled large uploads to disk; copy the file so the
+    # background job can read it after the request ends
+    fd, path = tempfile.mkstemp(prefix="lab-import-", suffix=os.path.splitext(upload.filename)[1])
+    with os.fdopen(fd, "wb") as out:
+        upload.save(out)
+    if not fmt:
+        with importer.open_text(path) as lines:
+            fmt = importer.detect_format(upload.filename, next(lines, ""))
+
+    user = get_jwt_identity()
+    job = importer.start_job(
+        current_app._get_current_object(), path, fmt,
+        submitted_by=user.get("id") if isinstance(user, dict) else user,
+        source=upload.filename, create_patients=create_patients, chunk_size=chunk_size, delete_after=True,
+    )
+    return jsonify(job.progress()), 202
+
+# GET: Progress, throughput and skipped records of an import job
+@import_bp.route("/<job_id>", methods=["GET"])
+@jwt_required()
+def get_import(job_id):
+    job = importer.get_job(job_id)
+    if not job:
+        return jsonify({"msg": "Import job not found"}), 404
+    return jsonify(job.progress()), 200
@@ -1,30 +1,208 @@
 # server/app/routes/lab_test_routes.py
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from ..extensions import db
 from ..models.lab_test import LabTest
 from ..models.patient import Patient
-from ..services.flagging import flag_abnormal
-from datetime import datetime # Import datetime for isoformat if needed
+from ..models.ingest_item import IngestItem
+from ..services.flagging import (
+    get_result_status, get_result_statuses, typed_values, age_in_years, resolve_range, valid_parameter,
+    valid_result_values,
+)
+from ..services import counters, events, ingest, snapshot, trends
+from ..services import results as results_service
+from .. import serializers
+from ..services.http_cache import conditional
+from ..services.versions import bump_after_commit
+from ..json_provider import orjson
+from datetime import datetime, timedelta, timezone # Import datetime for isoformat if needed
+import csv
+import io
+import json
 
 lab_test_bp = Blueprint("lab_test", __name__)
 
+LAB_TESTS_TABLE = LabTest.__tablename__
+
+DEFAULT_MAX_BATCH_SIZE = 5000
+DEFAULT_MAX_INGEST_WAIT_SECONDS = 10
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+DEFAULT_TREND_POINTS = 200
+MAX_TREND_POINTS = 2000
+EXPORT_FETCH_SIZE = 2000
+EXPORT_FLUSH_ROWS = 500
+EXPORT_COLUMNS = [
+    "id", "patient_id", "patient_name", "parameter", "value", "unit",
+    "value_numeric", "flagged", "status", "date_conducted",
+]
+
+def _parse_conducted(value):
+    """
+    Parses an ISO date_conducted; aware values are converted to naive UTC like datetime.utcnow().
+    """
+    conducted = datetime.fromisoformat(value)
+    if conducted.tzinfo is not None:
+        conducted = conducted.astimezone(timezone.utc).replace(tzinfo=None)
+    return conducted
+
+def _async_requested():
+    return (current_app.config.get("INGEST_MODE", "sync") == "async"
+            or "respond-async" in request.headers.get("Prefer", ""))
+
+def _wait_seconds():
+    """
+    ?wait=<seconds> for read-your-writes, capped at INGEST_MAX_WAIT_SECONDS.
+    """
+    wait = request.args.get("wait", 0, type=float)
+    return max(0.0, min(wait, current_app.config.get("INGEST_MAX_WAIT_SECONDS", DEFAULT_MAX_INGEST_WAIT_SECONDS)))
+
+def _ingest_response(item, created):
+    body = {"ingest": serializers.ingest_item.one(item)}
+    if item.state == ingest.DONE:
+        test = db.session.get(LabTest, item.lab_test_id)
+        body["msg"] = "Test recorded"
+        body["flagged"] = bool(test.flagged) if test else None
+        body["test"] = serializers.lab_test_with_patient.one(test) if test else None
+        status_code = 201 if created else 200
+    elif item.state == ingest.REJECTED:
+        body["msg"] = item.error
+        status_code = 422
+    else:
+        body["msg"] = "Test queued"
+        status_code = 202 if created else 200
+    response = jsonify(body)
+    response.headers["Location"] = f"/api/tests/ingest/{item.id}"
+    return response, status_code
+
+def _enqueue_test(parameter, values, patient_id, now):
+    """
+    Async mode: acknowledges once the result is in the outbox; the ingest
+    worker flags and inserts it with the next batch.
+    """
+    user = get_jwt_identity()
+    key = request.headers.get("Idempotency-Key") or (request.get_json(silent=True) or {}).get("idempotency_key")
+    payload = {
+        "parameter": parameter,
+        "result_values": values,
+        "patient_id": patient_id,
+        "date_conducted": now.isoformat(),
+    }
+    try:
+        item, created = ingest.worker.enqueue(
+            user.get("id") if isinstance(user, dict) else user, payload, str(key)[:128] if key else None,
+        )
+    except ingest.InvalidPayload as e:
+        return jsonify({"msg": str(e)}), 400
+    except ingest.QueueFull:
+        response = jsonify({"msg": "Ingest queue is full, retry shortly"})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+    wait = _wait_seconds()
+    if wait and item.state == ingest.PENDING:
+        item = ingest.worker.wait_for(item.id, wait)
+    return _ingest_response(item, created)
+
+def _filter_tests(query, args):
+    """
+    Applies the patient_id, parameter, value_min/value_max, flagged and date_from/date_to
+    filters from a query string.
+    Returns (query, error_message).
+    """
+    patient_id = args.get("patient_id")
+    if patient_id:
+        try:
+            query = query.filter(LabTest.patient_id == int(patient_id))
+        except ValueError:
+            return query, "patient_id must be an integer"
+
+    parameter = args.get("parameter", type=str)
+    if parameter:
+        query = query.filter(LabTest.parameter == parameter)
+
+    try:
+        value_min = args.get("value_min")
+        if value_min:
+            query = query.filter(LabTest.value_numeric >= float(value_min))
+        value_max = args.get("value_max")
+        if value_max:
+            query = query.filter(LabTest.value_numeric <= float(value_max))
+    except ValueError:
+        return query, "value_min and value_max must be numbers"
+
+    flagged = args.get("flagged")
+    if flagged:
+        if flagged.lower() not in ("true", "false", "1", "0"):
+            return query, "flagged must be true or false"
+        query = query.filter(LabTest.flagged.is_(flagged.lower() in ("true", "1")))
+
+    try:
+        date_from = args.get("date_from")
+        if date_from:
+            query = query.filter(LabTest.date_conducted >= datetime.fromisoformat(date_from))
+        date_to = args.get("date_to")
+        if date_to:
+            if len(date_to) == 10:
+                # A bare date includes the whole day
+                query = query.filter(LabTest.date_conducted < datetime.fromisoformat(date_to) + timedelta(days=1))
+            else:
+                query = query.filter(LabTest.date_conducted <= datetime.fromisoformat(date_to))
+    except ValueError:
+        return query, "date_from and date_to must be ISO dates or datetimes"
+
+    return query, None
+
 @lab_test_bp.route("/<int:patient_id>", methods=["GET"])
 @jwt_required()
+@conditional(LAB_TESTS_TABLE)
 def get_tests_for_patient(patient_id):
     tests = LabTest.query.filter_by(patient_id=patient_id).all()
-    results = [
-        {
-            "id": t.id,
-            "parameter": t.parameter,
-            "result_values": t.result_values,  # FIX 1: Changed 'values' to 'result_values'
-            "flagged": t.flagged,
-            "date_conducted": t.date_conducted.isoformat() if t.date_conducted else None, # FIX 2: Changed 'date' to 'date_conducted' and added .isoformat()
-        }
-        for t in tests
-    ]
+    results = serializers.lab_test_with_panel.many(tests)
     return jsonify(results), 200
 
+# GET: Downsampled time series of one parameter for a patient, with its reference range
+@lab_test_bp.route("/<int:patient_id>/trend", methods=["GET"])
+@jwt_required()
+def get_trend(patient_id):
+    parameter = request.args.get("parameter", type=str)
+    if not parameter:
+        return jsonify({"msg": "parameter is required"}), 400
+    mode = request.args.get("mode", "minmax")
+    if mode not in ("minmax", "lttb"):
+        return jsonify({"msg": "mode must be minmax or lttb"}), 400
+    points = request.args.get("points", DEFAULT_TREND_POINTS, type=int)
+    if points < 3 or points > MAX_TREND_POINTS:
+        points = DEFAULT_TREND_POINTS
+    try:
+        date_from = datetime.fromisoformat(request.args["date_from"]) if request.args.get("date_from") else None
+        date_to = datetime.fromisoformat(request.args["date_to"]) if request.args.get("date_to") else None
+    except ValueError:
+        return jsonify({"msg": "date_from and date_to must be ISO dates or datetimes"}), 400
+
+    patient = db.session.query(Patient.gender, Patient.dob).filter_by(id=patient_id).first()
+    if not patient:
+        return jsonify({"msg": "Patient not found"}), 404
+
+    if mode == "lttb":
+        series, total = trends.lttb_series(patient_id, parameter, points, date_from, date_to)
+    else:
+        series, total = trends.bucketed_series(patient_id, parameter, points, date_from, date_to)
+
+    # Overlay the band that applies to the patient today
+    ref = resolve_range(parameter, patient.gender, age_in_years(patient.dob))
+    return jsonify({
+        "patient_id": patient_id,
+        "parameter": parameter,
+        "mode": mode,
+        "total_points": total,
+        "series": series,
+        "reference_range": {
+            "normal_min": ref.normal_min,
+            "normal_max": ref.normal_max,
+            "units": ref.units,
+        } if ref else None,
+    }), 200
+
 @lab_test_bp.route("", methods=["POST"])
 @jwt_required()
 def create_test():
@@ -35,6 +213,10 @@ def create_test():
 
     if not all([parameter, values, patient_id]):
         return jsonify({"msg": "Missing required fields"}), 400
+    if not valid_parameter(parameter):
+        return jsonify({"msg": "parameter must be a string of at most 100 characters"}), 400
+    if isinstance(patient_id, bool):
+        return jsonify({"msg": "patient_id must be an integer"}), 400
 
     patient = Patient.query.filter_by(id=patient_id).first()
     if not patient:
@@ -42,49 +224,324 @@ def create_test():
 
     # Flag abnormal results
     # Ensure 'values' is a dictionary with 'value' and 'unit' keys
-    if not isinstance(values, dict) or 'value' not in values or 'unit' not in values:
+    if not valid_result_values(values):
         return jsonify({"msg": "result_values must be a dictionary with 'value' and 'unit'"}), 400
 
-    is_flagged = flag_abnormal(parameter, values)
+    now = datetime.utcnow()
+    if _async_requested():
+        return _enqueue_test(parameter, values, patient.id, now)
+
+    status = get_result_status(parameter, values, patient.gender, age_in_years(patient.dob, now))
+    is_flagged = status != "Normal"
 
     test = LabTest(
         parameter=parameter,
         result_values=values,
         patient_id=patient_id,
         flagged=is_flagged,
+        status=status,
+        date_conducted=now,
+        **typed_values(values),
     )
 
     db.session.add(test)
+    counters.record(created_by=patient.created_by, day=test.date_conducted.date(), tests=1, abnormal=int(is_flagged))
+    bump_after_commit(LAB_TESTS_TABLE)
+    if is_flagged:
+        db.session.flush()
+        events.stage_flagged([events.flagged_event(
+            test.id, patient.id, patient.created_by, parameter, values, status, test.date_conducted,
+        )])
     db.session.commit()
 
-    # Return the newly created test data, including its ID and formatted date
+    # Return the newly created test data, including its ID and formatted date,
+    # so the frontend can update its state
     return jsonify({
         "msg": "Test recorded",
         "flagged": is_flagged,
-        "test": { # Return the full test object for frontend to update state
-            "id": test.id,
-            "parameter": test.parameter,
-            "result_values": test.result_values,
-            "flagged": test.flagged,
-            "date_conducted": test.date_conducted.isoformat() if test.date_conducted else None,
-            "patient_id": test.patient_id
-        }
+        "test": serializers.lab_test_with_patient.one(test),
     }), 201
 
+# GET: State of a result submitted in async mode; ?wait=<seconds> blocks until it is written
+@lab_test_bp.route("/ingest/<int:item_id>", methods=["GET"])
+@jwt_required()
+def get_ingest_item(item_id):
+    user = get_jwt_identity()
+    user_id = user.get("id") if isinstance(user, dict) else user
+    item = IngestItem.query.filter_by(id=item_id, submitted_by=user_id).first()
+    if not item:
+        return jsonify({"msg": "Ingest item not found"}), 404
+    wait = _wait_seconds()
+    if wait and item.state == ingest.PENDING:
+        item = ingest.worker.wait_for(item.id, wait)
+    return _ingest_response(item, created=False)
+
 @lab_test_bp.route("", methods=["GET"])
 @jwt_required()
 def get_all_tests():
-    tests = LabTest.query.order_by(LabTest.id.desc()).all()
+    query, error = _filter_tests(
+        db.session.query(
+            LabTest.id,
+            LabTest.parameter,
+            LabTest.result_values,
+            LabTest.flagged,
+            LabTest.status,
+            LabTest.date_conducted,
+            LabTest.patient_id,
+            Patient.name.label("patient_name"),
+        ).join(Patient, Patient.id == LabTest.patient_id),
+        request.args,
+    )
+    if error:
+        return jsonify({"msg": error}), 400
+
+    try:
+        limit = int(request.args.get("limit", DEFAULT_LIMIT))
+    except (ValueError, TypeError):
+        limit = DEFAULT_LIMIT
+    if limit < 1 or limit > MAX_LIMIT:
+        limit = DEFAULT_LIMIT
+
+    # Keyset pagination: the cursor is the last id of the previous page
+    cursor = request.args.get("cursor", type=int)
+    if cursor:
+        query = query.filter(LabTest.id < cursor)
+
+    rows = query.order_by(LabTest.id.desc()).limit(limit + 1).all()
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+
+    results = serializers.lab_test_listing.many(rows)
+
+    return jsonify({
+        "data": results,
+        "pagination": {
+            "limit": limit,
+            "has_next": has_next,
+            "next_cursor": rows[-1].id if has_next else None,
+        }
+    }), 200
+
+# POST: Record a whole analyzer run in one transaction
+@lab_test_bp.route("/batch", methods=["POST"])
+@jwt_required()
+def create_tests_batch():
+    data = request.get_json(silent=True) or {}
+    items = data.get("results") if isinstance(data, dict) else data
+    atomic = bool(data.get("atomic", False)) if isinstance(data, dict) else False
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"msg": "results must be a non-empty list"}), 400
+
+    max_size = current_app.config.get("MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE)
+    if len(items) > max_size:
+        return jsonify({"msg": f"Batch too large: {len(items)} results (max {max_size})"}), 413
+
+    # Validate shape first, then resolve every referenced patient with one query
     results = []
-    for t in tests:
-        patient = Patient.query.get(t.patient_id)
-        results.append({
-            "id": t.id,
-            "parameter": t.parameter,
-            "result_values": t.result_values,
-            "flagged": t.flagged,
-            "date_conducted": t.date_conducted.isoformat() if t.date_conducted else None, # Also format here
-            "patient_id": t.patient_id,
-            "patient_name": patient.name if patient else "",
+    candidates = []
+    for index, item in enumerate(items):
+        error = None
+        if not isinstance(item, dict):
+            error = "Result must be an object"
+        elif not all([item.get("parameter"), item.get("result_values"), item.get("patient_id")]):
+            error = "Missing required fields"
+        elif not valid_parameter(item["parameter"]):
+            error = "parameter must be a string of at most 100 characters"
+        elif not valid_result_values(item["result_values"]):
+            error = "result_values must be a dictionary with 'value' and 'unit'"
+        elif isinstance(item["patient_id"], bool):
+            error = "Invalid patient_id or date_conducted"
+        else:
+            try:
+                patient_id = int(item["patient_id"])
+                date_conducted = _parse_conducted(item["date_conducted"]) if item.get("date_conducted") else None
+            except (ValueError, TypeError):
+                error = "Invalid patient_id or date_conducted"
+        if error:
+            results.append({"index": index, "status": "rejected", "error": error})
+        else:
+            results.append(None)
+            candidates.append((index, patient_id, date_conducted, item))
+
+    patient_ids = {patient_id for _, patient_id, _, _ in candidates}
+    known_patients = {
+        row.id: row for row in db.session.query(
+            Patient.id, Patient.created_by, Patient.gender, Patient.dob,
+        ).filter(Patient.id.in_(patient_ids))
+    } if patient_ids else {}
+
+    accepted = []
+    for candidate in candidates:
+        index, patient_id = candidate[0], candidate[1]
+        if patient_id not in known_patients:
+            results[index] = {"index": index, "status": "rejected", "error": "Patient not found"}
+        else:
+            accepted.append(candidate)
+
+    rejected = len(items) - len(accepted)
+    if atomic and rejected:
+        return jsonify({"created": 0, "rejected": rejected, "results": [r for r in results if r]}), 422
+
+    now = datetime.utcnow()
+    statuses = get_result_statuses(
+        [(item["parameter"], item["result_values"]) for _, _, _, item in accepted],
+        sexes=[known_patients[patient_id].gender for _, patient_id, _, _ in accepted],
+        ages=[age_in_years(known_patients[patient_id].dob, date_conducted or now)
+              for _, patient_id, date_conducted, _ in accepted],
+    )
+    rows = []
+    for (index, patient_id, date_conducted, item), status in zip(accepted, statuses):
+        is_flagged = status != "Normal"
+        rows.append({
+            "parameter": item["parameter"],
+            "result_values": item["result_values"],
+            "patient_id": patient_id,
+            "flagged": is_flagged,
+            "status": status,
+            "date_conducted": date_conducted or now,
+            **typed_values(item["result_values"]),
         })
-    return jsonify(results), 200
\ No newline at end of file
+        results[index] = {"index": index, "status": "created", "flagged": is_flagged}
+
+    if rows:
+        try:
+            # One batched INSERT for the whole run, committed once
+            results_service.insert_lab_tests(rows, {pid: p.created_by for pid, p in known_patients.items()})
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Batch insert error: {str(e)}")
+            return jsonify({"msg": "Failed to record batch"}), 500
+
+    if rows and rejected:
+        status_code = 207
+    elif rows:
+        status_code = 201
+    else:
+        status_code = 422
+    return jsonify({
+        "created": len(rows),
+        "rejected": rejected,
+        "results": results,
+    }), status_code
+
+
+# GET: Stream every matching result as NDJSON (default), CSV or an Arrow IPC stream
+@lab_test_bp.route("/export", methods=["GET"])
+@jwt_required()
+def export_tests():
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv", "arrow"):
+        return jsonify({"msg": "format must be ndjson, csv or arrow"}), 400
+
+    if export_format == "arrow":
+        return _export_arrow()
+
+    query, error = _filter_tests(
+        db.session.query(
+            LabTest.id,
+            LabTest.patient_id,
+            Patient.name.label("patient_name"),
+            LabTest.parameter,
+            LabTest.result_values,
+            LabTest.unit,
+            LabTest.value_numeric,
+            LabTest.flagged,
+            LabTest.status,
+            LabTest.date_conducted,
+        ).join(Patient, Patient.id == LabTest.patient_id),
+        request.args,
+    )
+    if error:
+        return jsonify({"msg": error}), 400
+
+    # yield_per streams from a server-side cursor instead of buffering the result
+    rows = query.order_by(LabTest.id).yield_per(EXPORT_FETCH_SIZE)
+
+    def records():
+        for t in rows:
+            values = t.result_values if isinstance(t.result_values, dict) else {}
+            yield [
+                t.id,
+                t.patient_id,
+                t.patient_name,
+                t.parameter,
+                values.get("value"),
+                t.unit if t.unit is not None else values.get("unit"),
+                t.value_numeric,
+                t.flagged,
+                t.status,
+                t.date_conducted.isoformat() if t.date_conducted else None,
+            ]
+
+    # orjson writes each line straight to bytes; the stdlib is the fallback
+    if orjson is not None:
+        def encode(record):
+            return orjson.dumps(dict(zip(EXPORT_COLUMNS, record)), option=orjson.OPT_APPEND_NEWLINE)
+        empty = b""
+    else:
+        def encode(record):
+            return json.dumps(dict(zip(EXPORT_COLUMNS, record))) + "\n"
+        empty = ""
+
+    def generate_ndjson():
+        lines = []
+        for record in records():
+            lines.append(encode(record))
+            if len(lines) >= EXPORT_FLUSH_ROWS:
+                yield empty.join(lines)
+                lines = []
+        if lines:
+            yield empty.join(lines)
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        pending = 0
+        for record in records():
+            writer.writerow(record)
+            pending += 1
+            if pending >= EXPORT_FLUSH_ROWS:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        yield buffer.getvalue()
+
+    if export_format == "csv":
+        body, mimetype, extension = generate_csv(), "text/csv", "csv"
+    else:
+        body, mimetype, extension = generate_ndjson(), "application/x-ndjson", "ndjson"
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=lab_tests.{extension}"},
+    )
+
+def _export_arrow():
+    try:
+        pa = snapshot.require_pyarrow()
+    except RuntimeError as e:
+        return jsonify({"msg": str(e)}), 501
+
+    query, error = _filter_tests(snapshot.rows_query(), request.args)
+    if error:
+        return jsonify({"msg": error}), 400
+
+    def generate():
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, snapshot.schema()) as writer:
+            for batch in snapshot.record_batches(query=query, chunk_size=EXPORT_FETCH_SIZE * 5):
+                writer.write_batch(batch)
+                yield sink.getvalue()
+                sink.seek(0)
+                sink.truncate()
+        yield sink.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/vnd.apache.arrow.stream",
+        headers={"Content-Disposition": "attachment; filename=lab_tests.arrows"},
+    )
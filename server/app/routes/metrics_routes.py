@@ -0,0 +1,28 @@
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required
+from ..services.flagging import range_cache
+from ..services.passwords import hasher
+from ..services.http_cache import response_cache
+from ..services.events import broker
+from ..services.ingest import worker as ingest_worker
+from ..services.reports import renderer as report_renderer
+from ..services.analytics import result_cache as analytics_cache
+from ..services.principals import principal_cache, user_list_cache
+
+metrics_bp = Blueprint("metrics", __name__)
+
+# GET: In-process cache and pool counters for this worker
+@metrics_bp.route("", methods=["GET"])
+@jwt_required(optional=True)
+def get_metrics():
+    return jsonify({
+        "reference_range_cache": range_cache.stats(),
+        "password_hashing": hasher.stats(),
+        "principal_cache": principal_cache.stats(),
+        "user_list_cache": user_list_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "flagged_events": broker.stats(),
+        "ingest": ingest_worker.stats(),
+        "reports": report_renderer.stats(),
+        "analytics_cache": analytics_cache.stats(),
+    }), 200
@@ -0,0 +1,148 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+from ..extensions import db
+from ..models import LabPanel, LabTest, Patient
+from ..services.flagging import (
+    get_result_statuses, typed_values, age_in_years, valid_parameter, valid_result_values,
+)
+from ..services.results import insert_lab_tests
+from .. import serializers
+from .lab_test_routes import _parse_conducted
+from datetime import datetime
+import uuid
+
+panel_bp = Blueprint("panels", __name__)
+
+DEFAULT_MAX_PANEL_SIZE = 200
+# Postgres' name for the unnamed UNIQUE (accession) in the lab_panels migration
+ACCESSION_CONSTRAINT = "lab_panels_accession_key"
+
+def _new_accession(now):
+    return f"{now:%Y%m%d}-{uuid.uuid4().hex[:10].upper()}"
+
+def _duplicate_accession(error):
+    """
+    Returns True if an IntegrityError came from the accession unique constraint,
+    rather than e.g. a foreign key or a counter row.
+    """
+    diag = getattr(error.orig, "diag", None)
+    constraint = getattr(diag, "constraint_name", None)
+    if constraint:
+        return constraint == ACCESSION_CONSTRAINT
+    # SQLite only reports the columns: "UNIQUE constraint failed: lab_panels.accession"
+    return "lab_panels.accession" in str(error.orig)
+
+def _panel_dict(panel, tests):
+    result = serializers.lab_panel.one(panel)
+    result["flagged_count"] = sum(1 for t in tests if t.flagged)
+    result["tests"] = serializers.panel_test.many(tests)
+    return result
+
+# POST: Record every parameter of a panel (e.g. a CBC) in one transaction
+@panel_bp.route("", methods=["POST"], strict_slashes=False)
+@jwt_required()
+def create_panel():
+    data = request.get_json(silent=True) or {}
+    test_type = data.get("test_type")
+    patient_id = data.get("patient_id")
+    results = data.get("results")
+
+    if not all([test_type, patient_id, results]):
+        return jsonify({"msg": "Missing required fields: test_type, patient_id, results"}), 400
+    if not isinstance(results, dict):
+        return jsonify({"msg": "results must map each parameter to {'value', 'unit'}"}), 400
+
+    max_size = current_app.config.get("MAX_PANEL_SIZE", DEFAULT_MAX_PANEL_SIZE)
+    if len(results) > max_size:
+        return jsonify({"msg": f"Panel too large: {len(results)} parameters (max {max_size})"}), 413
+
+    invalid = [p for p in results if not valid_parameter(p)]
+    if invalid:
+        return jsonify({
+            "msg": "parameter must be a string of at most 100 characters",
+            "parameters": [p[:100] for p in invalid],
+        }), 400
+    invalid = [p for p, values in results.items() if not valid_result_values(values)]
+    if invalid:
+        return jsonify({
+            "msg": "result_values must be a dictionary with 'value' and 'unit'",
+            "parameters": invalid,
+        }), 400
+
+    try:
+        date_conducted = _parse_conducted(data["date_conducted"]) if data.get("date_conducted") else None
+    except (ValueError, TypeError):
+        return jsonify({"msg": "date_conducted must be an ISO date or datetime"}), 400
+
+    patient = db.session.query(
+        Patient.id, Patient.created_by, Patient.gender, Patient.dob,
+    ).filter(Patient.id == patient_id).first()
+    if not patient:
+        return jsonify({"msg": "Patient not found"}), 404
+
+    now = datetime.utcnow()
+    date_conducted = date_conducted or now
+    test_type = str(test_type).strip()
+    accession = str(data.get("accession") or _new_accession(now)).strip()[:64]
+    if LabPanel.query.filter_by(accession=accession).first():
+        return jsonify({"msg": f"Accession {accession} already exists"}), 409
+
+    user = get_jwt_identity()
+    panel = LabPanel(
+        accession=accession,
+        test_type=test_type,
+        patient_id=patient.id,
+        submitted_by=user.get("id") if isinstance(user, dict) else user,
+        date_conducted=date_conducted,
+    )
+
+    # Every parameter is resolved against one snapshot of the ranges, for this patient's band
+    # and the panel's test type
+    parameters = list(results)
+    age = age_in_years(patient.dob, date_conducted)
+    statuses = get_result_statuses(
+        [(parameter, results[parameter]) for parameter in parameters],
+        sexes=[patient.gender] * len(parameters),
+        ages=[age] * len(parameters),
+        test_types=[test_type] * len(parameters),
+    )
+
+    try:
+        db.session.add(panel)
+        db.session.flush()
+        rows = [{
+            "parameter": parameter,
+            "result_values": results[parameter],
+            "patient_id": patient.id,
+            "panel_id": panel.id,
+            "flagged": status != "Normal",
+            "status": status,
+            "date_conducted": date_conducted,
+            **typed_values(results[parameter]),
+        } for parameter, status in zip(parameters, statuses)]
+        insert_lab_tests(rows, {patient.id: patient.created_by})
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        if _duplicate_accession(e):
+            return jsonify({"msg": f"Accession {accession} already exists"}), 409
+        print(f"Panel insert error: {str(e)}")
+        return jsonify({"msg": "Failed to record panel"}), 500
+    except Exception as e:
+        db.session.rollback()
+        print(f"Panel insert error: {str(e)}")
+        return jsonify({"msg": "Failed to record panel"}), 500
+
+    tests = LabTest.query.filter_by(panel_id=panel.id).order_by(LabTest.id).all()
+    return jsonify({"msg": "Panel recorded", "panel": _panel_dict(panel, tests)}), 201
+
+# GET: One panel with all its results, by accession
+@panel_bp.route("/<string:accession>", methods=["GET"])
+@jwt_required()
+def get_panel(accession):
+    panel = LabPanel.query.filter_by(accession=accession).first()
+    if not panel:
+        return jsonify({"msg": "Panel not found"}), 404
+    tests = LabTest.query.filter_by(panel_id=panel.id).order_by(LabTest.id).all()
+    return jsonify(_panel_dict(panel, tests)), 200
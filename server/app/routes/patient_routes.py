@@ -1,43 +1,136 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import case, func
 from ..extensions import db
 from ..models.patient import Patient
 from ..models.lab_test import LabTest
+from ..models.lab_panel import LabPanel
+from ..services import counters, search, sync
+from ..services.http_cache import conditional
+from ..services.versions import bump_version
+from .. import serializers
 
 patient_bp = Blueprint("patient", __name__)
 
+DEFAULT_PAGE = 1
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+# Any column selected by _patients_with_counts can be sorted on
+SORT_COLUMNS = ["id", "name", "dob", "gender", "created_by", "test_count", "abnormal_count"]
+
+def _patients_with_counts():
+    """
+    Patients joined to one grouped aggregate of their test and abnormal counts.
+    """
+    counts = db.session.query(
+        LabTest.patient_id.label("patient_id"),
+        func.count(LabTest.id).label("test_count"),
+        func.sum(case((LabTest.flagged.is_(True), 1), else_=0)).label("abnormal_count"),
+    ).group_by(LabTest.patient_id).subquery()
+
+    return db.session.query(
+        Patient.id,
+        Patient.name,
+        Patient.dob,
+        Patient.gender,
+        Patient.created_by,
+        func.coalesce(counts.c.test_count, 0).label("test_count"),
+        func.coalesce(counts.c.abnormal_count, 0).label("abnormal_count"),
+    ).outerjoin(counts, counts.c.patient_id == Patient.id)
+
+PATIENTS_TABLE = Patient.__tablename__
+LAB_TESTS_TABLE = LabTest.__tablename__
+
 # GET: List patients (optionally filtered by user), with test/abnormal counts
 @patient_bp.route("", methods=["GET"])
 @jwt_required(optional=True)
+@conditional(PATIENTS_TABLE, LAB_TESTS_TABLE)
 def get_patients():
     try:
+        try:
+            page = int(request.args.get("page", DEFAULT_PAGE))
+        except (ValueError, TypeError):
+            page = DEFAULT_PAGE
+        try:
+            per_page = int(request.args.get("per_page", DEFAULT_PER_PAGE))
+        except (ValueError, TypeError):
+            per_page = DEFAULT_PER_PAGE
+
+        if page < 1:
+            page = DEFAULT_PAGE
+        if per_page < 1 or per_page > MAX_PER_PAGE:
+            per_page = DEFAULT_PER_PAGE
+
+        sort = request.args.get("sort", "id")
+        if sort not in SORT_COLUMNS:
+            return jsonify({"error": f"sort must be one of: {', '.join(SORT_COLUMNS)}"}), 400
+        order = request.args.get("order", "asc")
+        if order not in ("asc", "desc"):
+            return jsonify({"error": "order must be asc or desc"}), 400
+
+        query = _patients_with_counts()
         current_user = get_jwt_identity()
         if current_user:
             user_id = current_user.get("id") if isinstance(current_user, dict) else current_user
-            patients = Patient.query.filter_by(created_by=user_id).all()
-        else:
-            patients = Patient.query.all()
-
-        result = []
-        for p in patients:
-            tests = LabTest.query.filter_by(patient_id=p.id).all()
-            abnormal_count = sum(1 for t in tests if getattr(t, "flagged", False))
-            result.append({
-                "id": p.id,
-                "name": p.name,
-                "dob": str(p.dob),
-                "gender": p.gender,
-                "created_by": getattr(p, "created_by", None),
-                "test_count": len(tests),
-                "abnormal_count": abnormal_count,
-            })
-
-        return jsonify(result), 200
+            query = query.filter(Patient.created_by == user_id)
+
+        sort_column = {c["name"]: c["expr"] for c in query.column_descriptions}[sort]
+        sort_expr = sort_column.desc() if order == "desc" else sort_column.asc()
+        # Patient.id as a tiebreaker keeps pages stable
+        patients = query.order_by(sort_expr, Patient.id.asc()).paginate(page=page, per_page=per_page, error_out=False)
+
+        result = serializers.patient_with_counts.many(patients.items)
+
+        return jsonify({
+            "data": result,
+            "pagination": {
+                "page": page,
+                "per_page": per_page,
+                "total": patients.total,
+                "pages": patients.pages,
+                "has_next": patients.has_next,
+                "has_prev": patients.has_prev,
+            }
+        }), 200
 
     except Exception as e:
         print(f"Get patients error: {str(e)}")
         return jsonify({"error": "Failed to fetch patients"}), 500
 
+# GET: Type-ahead search of the caller's patients by name substring or date of birth
+@patient_bp.route("/search", methods=["GET"])
+@jwt_required()
+@conditional(PATIENTS_TABLE)
+def search_patients():
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "q is required"}), 400
+    page = request.args.get("page", DEFAULT_PAGE, type=int)
+    per_page = request.args.get("per_page", DEFAULT_PER_PAGE, type=int)
+    if page < 1:
+        page = DEFAULT_PAGE
+    if per_page < 1 or per_page > MAX_PER_PAGE:
+        per_page = DEFAULT_PER_PAGE
+
+    current_user = get_jwt_identity()
+    user_id = current_user.get("id") if isinstance(current_user, dict) else current_user
+    try:
+        rows, has_next = search.search_patients(user_id, q, page, per_page)
+    except Exception as e:
+        print(f"Search patients error: {str(e)}")
+        return jsonify({"error": "Failed to search patients"}), 500
+
+    # No total: counting every match would cost more than finding the page
+    return jsonify({
+        "data": serializers.patient.many(rows),
+        "pagination": {
+            "page": page,
+            "per_page": per_page,
+            "has_next": has_next,
+            "has_prev": page > 1,
+        }
+    }), 200
+
 # POST: Create new patient
 @patient_bp.route("", methods=["POST"])
 @jwt_required(optional=True)
@@ -62,17 +155,14 @@ def create_patient():
         )
 
         db.session.add(patient)
+        # Patients carry no creation date, so they only count towards the all-days totals
+        counters.record(created_by=created_by, patients=1)
+        bump_version(PATIENTS_TABLE)
         db.session.commit()
 
         return jsonify({
             "message": "Patient created successfully",
-            "data": {
-                "id": patient.id,
-                "name": patient.name,
-                "dob": str(patient.dob),
-                "gender": patient.gender,
-                "created_by": patient.created_by
-            }
+            "data": serializers.patient.one(patient)
         }), 201
 
     except Exception as e:
@@ -82,27 +172,17 @@ def create_patient():
 # GET: One patient by ID, with test/abnormal counts
 @patient_bp.route("/<int:patient_id>", methods=["GET"])
 @jwt_required()
+@conditional(PATIENTS_TABLE, LAB_TESTS_TABLE)
 def get_patient(patient_id):
     user = get_jwt_identity()
     user_id = user.get("id") if isinstance(user, dict) else user
 
-    patient = Patient.query.filter_by(id=patient_id, created_by=user_id).first()
+    patient = _patients_with_counts().filter(Patient.id == patient_id, Patient.created_by == user_id).first()
 
     if not patient:
         return jsonify({"msg": "Patient not found"}), 404
 
-    tests = LabTest.query.filter_by(patient_id=patient.id).all()
-    abnormal_count = sum(1 for t in tests if getattr(t, "flagged", False))
-
-    return jsonify({
-        "id": patient.id,
-        "name": patient.name,
-        "dob": str(patient.dob),
-        "gender": patient.gender,
-        "created_by": patient.created_by,
-        "test_count": len(tests),
-        "abnormal_count": abnormal_count
-    }), 200
+    return jsonify(serializers.patient_with_counts.one(patient)), 200
 
 # PUT: Update a patient
 @patient_bp.route("/<int:patient_id>", methods=["PUT"])
@@ -120,16 +200,12 @@ def update_patient(patient_id):
     patient.dob = data.get("dob", patient.dob)
     patient.gender = data.get("gender", patient.gender)
 
+    bump_version(PATIENTS_TABLE)
     db.session.commit()
 
     return jsonify({
         "msg": "Patient updated successfully",
-        "patient": {
-            "id": patient.id,
-            "name": patient.name,
-            "dob": str(patient.dob),
-            "gender": patient.gender
-        }
+        "patient": serializers.patient.one(patient)
     }), 200
 
 # DELETE: Remove a patient
@@ -143,7 +219,25 @@ def delete_patient(patient_id):
     if not patient:
         return jsonify({"msg": "Patient not found"}), 404
 
+    # Patients carry no creation date, so the patient itself only leaves the all-days totals
+    deltas = [(patient.created_by, None, -1, 0, 0)]
+    for day, test_count, abnormal_count in db.session.query(
+        func.date(LabTest.date_conducted, type_=db.Date),
+        func.count(LabTest.id),
+        func.sum(case((LabTest.flagged.is_(True), 1), else_=0)),
+    ).filter(LabTest.patient_id == patient.id).group_by(func.date(LabTest.date_conducted, type_=db.Date)):
+        deltas.append((patient.created_by, day, 0, -test_count, -int(abnormal_count or 0)))
+    counters.record_many(deltas)
+
+    test_ids = [test_id for test_id, in db.session.query(LabTest.id).filter(LabTest.patient_id == patient.id)]
+    sync.record_deletes(LAB_TESTS_TABLE, test_ids, patient.created_by)
+    sync.record_deletes(PATIENTS_TABLE, [patient.id], patient.created_by)
+    # Results and panels go in the same transaction; lab_tests.patient_id cannot be NULL
+    db.session.query(LabTest).filter(LabTest.patient_id == patient.id).delete(synchronize_session=False)
+    db.session.query(LabPanel).filter(LabPanel.patient_id == patient.id).delete(synchronize_session=False)
     db.session.delete(patient)
+    bump_version(PATIENTS_TABLE)
+    bump_version(LAB_TESTS_TABLE)
     db.session.commit()
 
     return jsonify({"msg": f"Patient '{patient.name}' deleted successfully."}), 200
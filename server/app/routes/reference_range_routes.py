@@ -1,7 +1,13 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
 from ..extensions import db
 from ..models.test_reference_range import TestReferenceRange
+from ..services.flagging import range_cache, normalize_sex
+from ..services import reflag, search, sync
+from .. import serializers
+from ..services.http_cache import conditional
+from ..services.principals import role_required
+from ..services.flagging import RANGES_TABLE
 
 reference_bp = Blueprint("reference_ranges", __name__)
 
@@ -9,160 +15,282 @@ DEFAULT_PAGE = 1
 DEFAULT_PER_PAGE = 20
 MAX_PER_PAGE = 100
 
-@reference_bp.route("", methods=["GET", "POST"],strict_slashes=False)
+def _parse_demographics(data, range_obj=None):
+    """
+    Validates the optional test_type, sex and age_min/age_max (years) fields.
+    Returns (fields_to_set, error_message).
+    """
+    fields = {}
+    if "test_type" in data:
+        test_type = data["test_type"]
+        fields["test_type"] = (str(test_type).strip() or None) if test_type is not None else None
+    if "sex" in data:
+        if data["sex"] in [None, "", "any"]:
+            fields["sex"] = None
+        elif normalize_sex(data["sex"]):
+            fields["sex"] = normalize_sex(data["sex"])
+        else:
+            return None, "sex must be male, female or any."
+    for field in ["age_min", "age_max"]:
+        if field in data:
+            if data[field] in [None, ""]:
+                fields[field] = None
+                continue
+            try:
+                fields[field] = float(data[field])
+            except (ValueError, TypeError):
+                return None, f"{field} must be a number."
+            if fields[field] < 0:
+                return None, f"{field} must be a positive number."
+    age_min = fields.get("age_min", range_obj.age_min if range_obj else None)
+    age_max = fields.get("age_max", range_obj.age_max if range_obj else None)
+    if age_min is not None and age_max is not None and age_min >= age_max:
+        return None, "age_max must be greater than age_min."
+    return fields, None
+
+def _overlapping_band(parameter, test_type, sex, age_min, age_max, exclude_id=None):
+    """
+    Returns an existing band whose ages overlap the given one for the same
+    parameter, test type and sex, so each patient resolves to one band.
+    """
+    query = TestReferenceRange.query.filter(
+        TestReferenceRange.parameter == parameter,
+        TestReferenceRange.test_type.is_(None) if test_type is None else TestReferenceRange.test_type == test_type,
+        TestReferenceRange.sex.is_(None) if sex is None else TestReferenceRange.sex == sex,
+    )
+    if exclude_id is not None:
+        query = query.filter(TestReferenceRange.id != exclude_id)
+    if age_max is not None:
+        query = query.filter(db.or_(TestReferenceRange.age_min.is_(None), TestReferenceRange.age_min < age_max))
+    if age_min is not None:
+        query = query.filter(db.or_(TestReferenceRange.age_max.is_(None), TestReferenceRange.age_max > age_min))
+    return query.first()
+
+def _start_reflag(parameters, dry_run=False, chunk_size=reflag.DEFAULT_CHUNK_SIZE):
+    """Re-flags stored results for the given parameters in the background."""
+    return reflag.start_job(current_app._get_current_object(), parameters=parameters,
+                            dry_run=dry_run, chunk_size=chunk_size)
+
+def _reflag_after_edit(data, parameters):
+    """
+    Edits only re-flag stored results when asked with "reflag": true, so a
+    dry run of POST /reflag can preview their effect first. Returns the job id or None.
+    """
+    if not data.get("reflag"):
+        return None
+    if reflag.active_job():
+        return None
+    return _start_reflag(parameters).id
+
+# GET: List with pagination and optional search
+@reference_bp.route("", methods=["GET"], strict_slashes=False)
 @jwt_required(optional=True)
-def reference_ranges_collection():
-    if request.method == "GET":
-        # List with pagination and optional search, robust defaults
-        try:
-            page = int(request.args.get("page", DEFAULT_PAGE))
-        except (ValueError, TypeError):
-            page = DEFAULT_PAGE
-        try:
-            per_page = int(request.args.get("per_page", DEFAULT_PER_PAGE))
-        except (ValueError, TypeError):
-            per_page = DEFAULT_PER_PAGE
+@conditional(RANGES_TABLE, cache=True)
+def list_reference_ranges():
+    # Robust defaults
+    try:
+        page = int(request.args.get("page", DEFAULT_PAGE))
+    except (ValueError, TypeError):
+        page = DEFAULT_PAGE
+    try:
+        per_page = int(request.args.get("per_page", DEFAULT_PER_PAGE))
+    except (ValueError, TypeError):
+        per_page = DEFAULT_PER_PAGE
 
-        if page < 1:
-            page = DEFAULT_PAGE
-        if per_page < 1 or per_page > MAX_PER_PAGE:
-            per_page = DEFAULT_PER_PAGE
+    if page < 1:
+        page = DEFAULT_PAGE
+    if per_page < 1 or per_page > MAX_PER_PAGE:
+        per_page = DEFAULT_PER_PAGE
 
-        parameter = request.args.get("parameter", type=str)
-        query = TestReferenceRange.query
-        if parameter:
-            query = query.filter(TestReferenceRange.parameter.ilike(f"%{parameter}%"))
-        try:
-            ranges = query.paginate(page=page, per_page=per_page, error_out=False)
-        except Exception as e:
-            return jsonify({"error": f"Failed to paginate: {str(e)}"}), 422
-
-        result = [{
-            "id": r.id,
-            "parameter": r.parameter,
-            "normal_min": r.normal_min,
-            "normal_max": r.normal_max,
-            "units": r.units
-        } for r in ranges.items]
+    parameter = request.args.get("parameter", type=str)
+    query = TestReferenceRange.query
+    if parameter:
+        query = query.filter(search.parameter_filter(parameter))
+    try:
+        ranges = query.paginate(page=page, per_page=per_page, error_out=False)
+    except Exception as e:
+        return jsonify({"error": f"Failed to paginate: {str(e)}"}), 422
 
-        return jsonify({
-            "data": result,
-            "pagination": {
-                "page": page,
-                "per_page": per_page,
-                "total": ranges.total,
-                "pages": ranges.pages,
-                "has_next": ranges.has_next,
-                "has_prev": ranges.has_prev,
-            }
-        }), 200
+    result = serializers.reference_range.many(ranges.items)
+
+    return jsonify({
+        "data": result,
+        "pagination": {
+            "page": page,
+            "per_page": per_page,
+            "total": ranges.total,
+            "pages": ranges.pages,
+            "has_next": ranges.has_next,
+            "has_prev": ranges.has_prev,
+        }
+    }), 200
+
+# POST: Create (admins only); "reflag": true also re-flags stored results
+@reference_bp.route("", methods=["POST"], strict_slashes=False)
+@jwt_required()
+@role_required("admin")
+def create_reference_range():
+    try:
+        data = request.get_json(force=True)
+        required = ["parameter", "normal_min", "normal_max", "units"]
+        missing = [f for f in required if f not in data or data[f] in [None, ""]]
+        if missing:
+            return jsonify({"error": f"Missing fields: {', '.join(missing)}"}), 400
 
-    elif request.method == "POST":
-        # Create new
+        # Validate numeric values
         try:
-            data = request.get_json(force=True)
-            required = ["parameter", "normal_min", "normal_max", "units"]
-            missing = [f for f in required if f not in data or data[f] in [None, ""]]
-            if missing:
-                return jsonify({"error": f"Missing fields: {', '.join(missing)}"}), 400
+            normal_min = float(data["normal_min"])
+            normal_max = float(data["normal_max"])
+            if normal_min < 0 or normal_max < 0:
+                return jsonify({"error": "normal_min and normal_max must be positive numbers."}), 422
+            if normal_min >= normal_max:
+                return jsonify({"error": "normal_max must be greater than normal_min."}), 422
+        except (ValueError, TypeError):
+            return jsonify({"error": "normal_min and normal_max must be numbers."}), 422
 
-            # Validate numeric values
-            try:
-                normal_min = float(data["normal_min"])
-                normal_max = float(data["normal_max"])
-                if normal_min < 0 or normal_max < 0:
-                    return jsonify({"error": "normal_min and normal_max must be positive numbers."}), 422
-                if normal_min >= normal_max:
-                    return jsonify({"error": "normal_max must be greater than normal_min."}), 422
-            except (ValueError, TypeError):
-                return jsonify({"error": "normal_min and normal_max must be numbers."}), 422
-
-            new_range = TestReferenceRange(
-                parameter=data["parameter"].strip(),
-                normal_min=normal_min,
-                normal_max=normal_max,
-                units=data["units"].strip()
-            )
-            db.session.add(new_range)
-            db.session.commit()
-            return jsonify({
-                "message": "Reference range added",
-                "data": {
-                    "id": new_range.id,
-                    "parameter": new_range.parameter,
-                    "normal_min": new_range.normal_min,
-                    "normal_max": new_range.normal_max,
-                    "units": new_range.units
-                }
-            }), 201
-        except Exception as e:
-            print(f"Reference range POST error: {str(e)}")
-            return jsonify({"error": "Failed to add reference range"}), 500
-
-@reference_bp.route("/<int:range_id>", methods=["GET", "PUT", "DELETE"])
+        demographics, error = _parse_demographics(data)
+        if error:
+            return jsonify({"error": error}), 422
+
+        new_range = TestReferenceRange(
+            parameter=data["parameter"].strip(),
+            normal_min=normal_min,
+            normal_max=normal_max,
+            units=data["units"].strip(),
+            **demographics
+        )
+        overlap = _overlapping_band(new_range.parameter, new_range.test_type, new_range.sex,
+                                    new_range.age_min, new_range.age_max)
+        if overlap:
+            return jsonify({"error": f"Overlaps reference range {overlap.id} for this parameter."}), 409
+        db.session.add(new_range)
+        range_cache.invalidate()
+        db.session.commit()
+        return jsonify({
+            "message": "Reference range added",
+            "reflag_job": _reflag_after_edit(data, [new_range.parameter]),
+            "data": serializers.reference_range.one(new_range)
+        }), 201
+    except Exception as e:
+        print(f"Reference range POST error: {str(e)}")
+        return jsonify({"error": "Failed to add reference range"}), 500
+
+# GET: One range by ID
+@reference_bp.route("/<int:range_id>", methods=["GET"])
 @jwt_required(optional=True)
-def reference_range_item(range_id):
+def get_reference_range(range_id):
+    range_obj = TestReferenceRange.query.get(range_id)
+    if not range_obj:
+        return jsonify({"error": "Reference range not found"}), 404
+    return jsonify(serializers.reference_range.one(range_obj)), 200
+
+# PUT: Update (admins only); "reflag": true also re-flags stored results
+@reference_bp.route("/<int:range_id>", methods=["PUT"])
+@jwt_required()
+@role_required("admin")
+def update_reference_range(range_id):
     range_obj = TestReferenceRange.query.get(range_id)
     if not range_obj:
         return jsonify({"error": "Reference range not found"}), 404
+    try:
+        data = request.get_json(force=True)
+        old_parameter = range_obj.parameter
+        updated = False
+        for field in ["parameter", "normal_min", "normal_max", "units"]:
+            if field in data and data[field] not in [None, ""]:
+                value = data[field]
+                if field in ["normal_min", "normal_max"]:
+                    try:
+                        value = float(value)
+                        if value < 0:
+                            return jsonify({"error": f"{field} must be a positive number."}), 422
+                    except (ValueError, TypeError):
+                        return jsonify({"error": f"{field} must be a number."}), 422
+                    setattr(range_obj, field, value)
+                else:
+                    setattr(range_obj, field, value.strip())
+                updated = True
+
+        demographics, error = _parse_demographics(data, range_obj)
+        if error:
+            return jsonify({"error": error}), 422
+        for field, value in demographics.items():
+            setattr(range_obj, field, value)
+            updated = True
+
+        if not updated:
+            return jsonify({"error": "No valid fields to update."}), 400
+
+        # Validation: normal_min < normal_max
+        if range_obj.normal_min >= range_obj.normal_max:
+            return jsonify({"error": "normal_max must be greater than normal_min."}), 422
+        with db.session.no_autoflush:
+            overlap = _overlapping_band(range_obj.parameter, range_obj.test_type, range_obj.sex,
+                                        range_obj.age_min, range_obj.age_max, exclude_id=range_obj.id)
+        if overlap:
+            db.session.rollback()
+            return jsonify({"error": f"Overlaps reference range {overlap.id} for this parameter."}), 409
 
-    if request.method == "GET":
-        # Get by ID
+        range_cache.invalidate()
+        db.session.commit()
         return jsonify({
-            "id": range_obj.id,
-            "parameter": range_obj.parameter,
-            "normal_min": range_obj.normal_min,
-            "normal_max": range_obj.normal_max,
-            "units": range_obj.units
+            "message": "Reference range updated",
+            "reflag_job": _reflag_after_edit(data, sorted({old_parameter, range_obj.parameter})),
+            "data": serializers.reference_range.one(range_obj)
         }), 200
+    except Exception as e:
+        print(f"Reference range PUT error: {str(e)}")
+        return jsonify({"error": "Failed to update reference range"}), 500
 
-    elif request.method == "PUT":
-        # Update
-        try:
-            data = request.get_json(force=True)
-            updated = False
-            for field in ["parameter", "normal_min", "normal_max", "units"]:
-                if field in data and data[field] not in [None, ""]:
-                    value = data[field]
-                    if field in ["normal_min", "normal_max"]:
-                        try:
-                            value = float(value)
-                            if value < 0:
-                                return jsonify({"error": f"{field} must be a positive number."}), 422
-                        except (ValueError, TypeError):
-                            return jsonify({"error": f"{field} must be a number."}), 422
-                        setattr(range_obj, field, value)
-                    else:
-                        setattr(range_obj, field, value.strip())
-                    updated = True
-            if not updated:
-                return jsonify({"error": "No valid fields to update."}), 400
-
-            # Validation: normal_min < normal_max
-            if range_obj.normal_min >= range_obj.normal_max:
-                return jsonify({"error": "normal_max must be greater than normal_min."}), 422
+# DELETE: Delete (admins only); "reflag": true also re-flags stored results
+@reference_bp.route("/<int:range_id>", methods=["DELETE"])
+@jwt_required()
+@role_required("admin")
+def delete_reference_range(range_id):
+    range_obj = TestReferenceRange.query.get(range_id)
+    if not range_obj:
+        return jsonify({"error": "Reference range not found"}), 404
+    try:
+        data = request.get_json(silent=True) or {}
+        parameter = range_obj.parameter
+        sync.record_deletes(TestReferenceRange.__tablename__, [range_obj.id])
+        db.session.delete(range_obj)
+        range_cache.invalidate()
+        db.session.commit()
+        return jsonify({"message": "Reference range deleted", "reflag_job": _reflag_after_edit(data, [parameter])}), 200
+    except Exception as e:
+        print(f"Reference range DELETE error: {str(e)}")
+        return jsonify({"error": "Failed to delete reference range"}), 500
 
-            db.session.commit()
-            return jsonify({
-                "message": "Reference range updated",
-                "data": {
-                    "id": range_obj.id,
-                    "parameter": range_obj.parameter,
-                    "normal_min": range_obj.normal_min,
-                    "normal_max": range_obj.normal_max,
-                    "units": range_obj.units
-                }
-            }), 200
-        except Exception as e:
-            print(f"Reference range PUT error: {str(e)}")
-            return jsonify({"error": "Failed to update reference range"}), 500
-
-    elif request.method == "DELETE":
-        # Delete
-        try:
-            db.session.delete(range_obj)
-            db.session.commit()
-            return jsonify({"message": "Reference range deleted"}), 200
-        except Exception as e:
-            print(f"Reference range DELETE error: {str(e)}")
-            return jsonify({"error": "Failed to delete reference range"}), 500
\ No newline at end of file
+# POST: Re-flag stored results (all parameters unless given; admins only); dry_run only counts flips
+@reference_bp.route("/reflag", methods=["POST"])
+@jwt_required()
+@role_required("admin")
+def start_reflag():
+    data = request.get_json(silent=True) or {}
+    parameters = data.get("parameters")
+    if parameters is not None and (not isinstance(parameters, list) or not all(isinstance(p, str) for p in parameters)):
+        return jsonify({"error": "parameters must be a list of strings."}), 400
+    try:
+        chunk_size = int(data.get("chunk_size", reflag.DEFAULT_CHUNK_SIZE))
+    except (ValueError, TypeError):
+        return jsonify({"error": "chunk_size must be a number."}), 422
+    if chunk_size < 1:
+        return jsonify({"error": "chunk_size must be a positive number."}), 422
+    chunk_size = min(chunk_size, reflag.MAX_CHUNK_SIZE)
+
+    running = reflag.active_job()
+    if running:
+        return jsonify({"error": "A re-flag job is already running.", "job": running.progress()}), 409
+
+    job = _start_reflag(parameters, dry_run=bool(data.get("dry_run", False)), chunk_size=chunk_size)
+    return jsonify(job.progress()), 202
+
+# GET: Progress and throughput of a re-flag job
+@reference_bp.route("/reflag/<job_id>", methods=["GET"])
+@jwt_required()
+def get_reflag(job_id):
+    job = reflag.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Re-flag job not found"}), 404
+    return jsonify(job.progress()), 200
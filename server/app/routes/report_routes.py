@@ -0,0 +1,113 @@
+from flask import Blueprint, request, jsonify, current_app, send_file
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..services import reports
+from datetime import date
+
+report_bp = Blueprint("reports", __name__)
+
+def _user_id():
+    user = get_jwt_identity()
+    return user.get("id") if isinstance(user, dict) else user
+
+def _format(value):
+    fmt = (value or "html").lower()
+    if fmt not in reports.FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(reports.FORMATS)}")
+    if fmt == "pdf":
+        # Fail fast instead of once per report
+        reports._require_weasyprint()
+    return fmt
+
+def _dates(source):
+    """
+    (date_from, date_to) from "date" or "date_from"/"date_to" (inclusive ISO dates).
+    """
+    try:
+        if source.get("date"):
+            day = date.fromisoformat(source["date"])
+            return day, day
+        date_from = date.fromisoformat(source["date_from"]) if source.get("date_from") else None
+        date_to = date.fromisoformat(source["date_to"]) if source.get("date_to") else None
+    except (ValueError, TypeError):
+        raise ValueError("date, date_from and date_to must be ISO dates (YYYY-MM-DD)")
+    return date_from, date_to
+
+def _send_report(context, fmt):
+    path, digest = reports.renderer.get(context, fmt)
+    # The content hash is a strong validator: same hash, same bytes
+    response = send_file(path, mimetype=reports.MIMETYPES[fmt], etag=digest, conditional=True,
+                         download_name=f"{context['report_key']}.{fmt}")
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# GET: A patient's lab report (HTML, or PDF with ?format=pdf), optionally limited to date_from/date_to
+@report_bp.route("/patients/<int:patient_id>", methods=["GET"])
+@jwt_required()
+def get_patient_report(patient_id):
+    try:
+        fmt = _format(request.args.get("format"))
+        date_from, date_to = _dates(request.args)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"msg": str(e)}), 501
+
+    context = next(reports.patient_reports(_user_id(), [patient_id], date_from, date_to), None)
+    if context is None:
+        return jsonify({"msg": "No results to report for this patient"}), 404
+    try:
+        return _send_report(context, fmt)
+    except Exception as e:
+        print(f"Report error: {str(e)}")
+        return jsonify({"msg": "Failed to render report", "error": str(e)}), 500
+
+# GET: The report of one panel submission by accession number
+@report_bp.route("/accessions/<accession>", methods=["GET"])
+@jwt_required()
+def get_accession_report(accession):
+    try:
+        fmt = _format(request.args.get("format"))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"msg": str(e)}), 501
+
+    context = next(reports.accession_reports(_user_id(), [accession]), None)
+    if context is None:
+        return jsonify({"msg": "Accession not found"}), 404
+    try:
+        return _send_report(context, fmt)
+    except Exception as e:
+        print(f"Report error: {str(e)}")
+        return jsonify({"msg": "Failed to render report", "error": str(e)}), 500
+
+# POST: Render every patient or accession report of a day (or date range) in the background
+@report_bp.route("/batch", methods=["POST"])
+@jwt_required()
+def start_report_batch():
+    data = request.get_json(silent=True) or {}
+    kind = data.get("kind", "patient")
+    if kind not in reports.KINDS:
+        return jsonify({"msg": f"kind must be one of: {', '.join(reports.KINDS)}"}), 400
+    try:
+        fmt = _format(data.get("format"))
+        date_from, date_to = _dates(data)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"msg": str(e)}), 501
+    if not date_from and not date_to:
+        date_from = date_to = date.today()
+
+    job = reports.start_job(current_app._get_current_object(), kind, fmt, _user_id(), date_from, date_to)
+    return jsonify(job.progress()), 202
+
+# GET: Progress of a report batch: rendered, served from cache, failed
+@report_bp.route("/batch/<job_id>", methods=["GET"])
+@jwt_required()
+def get_report_batch(job_id):
+    job = reports.get_job(job_id)
+    # Someone else's job is reported as missing rather than forbidden
+    if not job or str(job.user_id) != str(_user_id()):
+        return jsonify({"msg": "Report job not found"}), 404
+    return jsonify(job.progress()), 200
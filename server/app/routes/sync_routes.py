@@ -0,0 +1,37 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..services import sync
+from datetime import datetime
+
+sync_bp = Blueprint("sync", __name__)
+
+# GET: Patients, lab tests and reference ranges changed or deleted since a cursor.
+# Without ?since the first page of a full sync is returned. Clients upsert
+# "changes" by id, then drop the ids in "deleted", and keep the new cursor;
+# while has_more is true they should ask again straight away.
+@sync_bp.route("", methods=["GET"], strict_slashes=False)
+@jwt_required()
+def get_changes():
+    user = get_jwt_identity()
+    user_id = user.get("id") if isinstance(user, dict) else user
+    now = datetime.utcnow()
+
+    since = request.args.get("since")
+    try:
+        positions = sync.decode_cursor(since) if since else sync.initial_positions(now)
+        changes, deleted, positions, has_more = sync.changes_since(user_id, positions, now)
+    except sync.CursorError as e:
+        return jsonify({"msg": str(e)}), 400
+    except sync.CursorExpired:
+        return jsonify({"msg": "Sync cursor expired; start a full sync without ?since"}), 410
+    except Exception as e:
+        print(f"Sync error: {str(e)}")
+        return jsonify({"msg": "Failed to fetch changes"}), 500
+
+    return jsonify({
+        "changes": changes,
+        "deleted": deleted,
+        "cursor": sync.encode_cursor(positions),
+        "has_more": has_more,
+        "full": not since,
+    }), 200
@@ -1,20 +1,71 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required
+from ..extensions import db
 from ..models.user import User
+from .. import serializers
+from ..services.principals import current_principal, invalidate_users, role_required, user_list_cache
 
 user_bp = Blueprint("user", __name__)
 
+DEFAULT_PAGE = 1
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+ROLES = ["user", "admin"]
+
+def _users_page(page, per_page):
+    users = db.session.query(User.id, User.name, User.email, User.role).order_by(User.id).paginate(
+        page=page, per_page=per_page, error_out=False,
+    )
+    return {
+        "data": serializers.user.many(users.items),
+        "pagination": {
+            "page": users.page,
+            "per_page": users.per_page,
+            "total": users.total,
+            "pages": users.pages,
+            "has_next": users.has_next,
+            "has_prev": users.has_prev,
+        }
+    }
+
 @user_bp.route("/", methods=["GET"])
 @jwt_required()
 def get_all_users():
-    users = User.query.all()
-    result = [
-        {
-            "id": user.id,
-            "name": user.name,
-            "email": user.email,
-            "role": user.role,
-        }
-        for user in users
-    ]
+    page = request.args.get("page", DEFAULT_PAGE, type=int)
+    per_page = request.args.get("per_page", DEFAULT_PER_PAGE, type=int)
+    if page < 1:
+        page = DEFAULT_PAGE
+    if per_page < 1 or per_page > MAX_PER_PAGE:
+        per_page = DEFAULT_PER_PAGE
+
+    # Pages are cached per worker until a register or role change
+    result = user_list_cache.get_or_load((page, per_page), lambda: _users_page(page, per_page))
     return jsonify(result), 200
+
+# GET: The signed-in user, served from the principal cache
+@user_bp.route("/me", methods=["GET"])
+@jwt_required()
+def get_current_user():
+    principal = current_principal()
+    if principal is None:
+        return jsonify({"msg": "User not found"}), 404
+    return jsonify(principal._asdict()), 200
+
+# PUT: Change a user's role (admins only)
+@user_bp.route("/<int:user_id>/role", methods=["PUT"])
+@jwt_required()
+@role_required("admin")
+def update_user_role(user_id):
+    data = request.get_json(silent=True) or {}
+    role = data.get("role")
+    if role not in ROLES:
+        return jsonify({"msg": f"role must be one of: {', '.join(ROLES)}"}), 400
+
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({"msg": "User not found"}), 404
+
+    user.role = role
+    invalidate_users()
+    db.session.commit()
+    return jsonify({"msg": "Role updated", "user": serializers.user.one(user)}), 200
@@ -0,0 +1,61 @@
+"""
+Shared row -> dict serializers for API responses.
+
+Each serializer is built once per field list, and works the same on model
+instances and on query Rows. Dates and datetimes are left as objects:
+the app's JSON provider writes them as ISO 8601, so routes no longer call
+isoformat() per row.
+"""
+from operator import attrgetter
+
+class Serializer:
+    """
+    Turns objects into dicts of a fixed set of attributes.
+
+    Keyword arguments map a field to a converter applied to its value
+    (e.g. int for SQL aggregates that come back as Decimal).
+    """
+
+    def __init__(self, *fields, **converters):
+        self.fields = fields
+        self.converters = converters
+        self._get = attrgetter(*fields)
+
+    def extend(self, *fields, **converters):
+        """
+        Returns a serializer with extra fields.
+        """
+        return Serializer(*(self.fields + fields), **{**self.converters, **converters})
+
+    def one(self, obj):
+        item = dict(zip(self.fields, self._get(obj)))
+        for field, convert in self.converters.items():
+            if item[field] is not None:
+                item[field] = convert(item[field])
+        return item
+
+    def many(self, objs):
+        fields, get = self.fields, self._get
+        if not self.converters:
+            return [dict(zip(fields, get(obj))) for obj in objs]
+        return [self.one(obj) for obj in objs]
+
+user = Serializer("id", "name", "email", "role")
+
+patient = Serializer("id", "name", "dob", "gender", "created_by")
+patient_with_counts = patient.extend("test_count", "abnormal_count", test_count=int, abnormal_count=int)
+
+lab_test = Serializer("id", "parameter", "result_values", "flagged", "status", "date_conducted")
+lab_test_with_panel = lab_test.extend("panel_id")
+lab_test_with_patient = lab_test.extend("patient_id")
+lab_test_listing = lab_test_with_patient.extend("patient_name")
+lab_test_sync = lab_test_with_patient.extend("panel_id")
+
+reference_range = Serializer(
+    "id", "test_type", "parameter", "normal_min", "normal_max", "units", "sex", "age_min", "age_max",
+)
+
+panel_test = Serializer("id", "parameter", "result_values", "flagged", "status")
+ingest_item = Serializer("id", "state", "lab_test_id", "error", "idempotency_key", "created_at", "processed_at")
+
+lab_panel = Serializer("id", "accession", "test_type", "patient_id", "submitted_by", "date_conducted")
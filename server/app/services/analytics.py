@@ -0,0 +1,371 @@
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import case, cast, func
+from sqlalchemy.exc import IntegrityError
+from ..extensions import db
+from ..models import LabTest, LabTestRollup, Patient, RollupWindow, Tombstone
+from .versions import get_version
+
+LAB_TESTS_TABLE = LabTest.__tablename__
+GRANULARITIES = ("day", "week")
+PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p95", 0.95))
+DEFAULT_CACHE_SIZE = 128
+# Closed buckets recomputed per statement (and per transaction)
+MAX_RUN_BUCKETS = 31
+# Changes committed up to this long after their updated_at was set are
+# still seen by the next staleness check (as with SYNC_OVERLAP_SECONDS)
+OVERLAP = timedelta(seconds=5)
+
+def bucket_start(value, granularity):
+    """
+    First day of the day or (ISO, Monday-based) week containing `value`.
+    """
+    day = value.date() if isinstance(value, datetime) else value
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+def _width(granularity):
+    return timedelta(days=7 if granularity == "week" else 1)
+
+def _at(day):
+    return datetime.combine(day, datetime.min.time())
+
+def _bucket_column(granularity):
+    if db.engine.dialect.name == "postgresql":
+        return cast(func.date_trunc(granularity, LabTest.date_conducted), db.Date)
+    if granularity == "week":
+        # SQLite: forward to Sunday, back to that week's Monday
+        return func.date(LabTest.date_conducted, "weekday 0", "-6 days", type_=db.Date)
+    return func.date(LabTest.date_conducted, type_=db.Date)
+
+def _aggregate(granularity, start, end, parameters=None, created_by=None, by_creator=False):
+    """
+    Per-bucket statistics of lab_tests conducted in [start, end), computed
+    in the database. Returns {(bucket_start, parameter, created_by): stats}.
+    """
+    bucket = _bucket_column(granularity)
+    keys = [bucket, LabTest.parameter] + ([Patient.created_by] if by_creator else [])
+
+    def scoped(query):
+        query = query.filter(LabTest.date_conducted >= _at(start), LabTest.date_conducted < _at(end))
+        if by_creator or created_by is not None:
+            query = query.join(Patient, Patient.id == LabTest.patient_id)
+        if by_creator:
+            query = query.filter(Patient.created_by.isnot(None))
+        if created_by is not None:
+            query = query.filter(Patient.created_by == created_by)
+        if parameters:
+            query = query.filter(LabTest.parameter.in_(parameters))
+        return query.group_by(*keys)
+
+    def key_of(row):
+        return row[0], row[1], row[2] if by_creator else created_by
+
+    postgres = db.engine.dialect.name == "postgresql"
+    columns = [
+        func.count(LabTest.id),
+        func.count(LabTest.value_numeric),
+        func.sum(case((LabTest.flagged.is_(True), 1), else_=0)),
+        func.sum(LabTest.value_numeric),
+        func.min(LabTest.value_numeric),
+        func.max(LabTest.value_numeric),
+    ]
+    if postgres:
+        columns += [func.percentile_cont(q).within_group(LabTest.value_numeric) for _, q in PERCENTILES]
+
+    results = {}
+    for row in scoped(db.session.query(*keys, *columns)):
+        values = row[len(keys):]
+        stats = {
+            "count": values[0],
+            "numeric_count": values[1],
+            "abnormal_count": int(values[2] or 0),
+            "sum": values[3],
+            "min": values[4],
+            "max": values[5],
+        }
+        stats.update(zip((name for name, _ in PERCENTILES), values[6:] if postgres else [None] * len(PERCENTILES)))
+        results[key_of(row)] = stats
+
+    if not postgres:
+        # No percentile_cont in SQLite; np.percentile's default linear
+        # interpolation gives the same answer
+        series = defaultdict(list)
+        for row in scoped(db.session.query(*keys, func.group_concat(LabTest.value_numeric))):
+            if row[-1] is not None:
+                series[key_of(row)] = [float(v) for v in row[-1].split(",")]
+        for key, values in series.items():
+            points = np.percentile(values, [q * 100 for _, q in PERCENTILES])
+            results[key].update(zip((name for name, _ in PERCENTILES), points.tolist()))
+    return results
+
+def _runs(buckets, granularity):
+    """
+    Splits sorted bucket starts into contiguous runs of at most MAX_RUN_BUCKETS.
+    """
+    width, run = _width(granularity), []
+    for bucket in buckets:
+        if run and (bucket != run[-1] + width or len(run) >= MAX_RUN_BUCKETS):
+            yield run
+            run = []
+        run.append(bucket)
+    if run:
+        yield run
+
+def _recompute(granularity, buckets):
+    width = _width(granularity)
+    for run in _runs(buckets, granularity):
+        computed_at = datetime.utcnow() - OVERLAP
+        start, end = run[0], run[-1] + width
+        stats = _aggregate(granularity, start, end)
+        stats.update(_aggregate(granularity, start, end, by_creator=True))
+
+        LabTestRollup.query.filter(
+            LabTestRollup.granularity == granularity,
+            LabTestRollup.bucket_start >= start,
+            LabTestRollup.bucket_start < end,
+        ).delete(synchronize_session=False)
+        RollupWindow.query.filter(
+            RollupWindow.granularity == granularity,
+            RollupWindow.bucket_start >= start,
+            RollupWindow.bucket_start < end,
+        ).delete(synchronize_session=False)
+        if stats:
+            db.session.execute(LabTestRollup.__table__.insert(), [{
+                "granularity": granularity,
+                "bucket_start": bucket,
+                "parameter": parameter,
+                "created_by": creator,
+                "test_count": s["count"],
+                "numeric_count": s["numeric_count"],
+                "abnormal_count": s["abnormal_count"],
+                "value_sum": s["sum"],
+                "value_min": s["min"],
+                "value_max": s["max"],
+                **{name: s[name] for name, _ in PERCENTILES},
+            } for (bucket, parameter, creator), s in stats.items()])
+        db.session.execute(RollupWindow.__table__.insert(), [
+            {"granularity": granularity, "bucket_start": bucket, "computed_at": computed_at} for bucket in run
+        ])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same windows first
+            db.session.rollback()
+
+def refresh_rollups(granularity, start, end):
+    """
+    Brings the stored rollups of the closed buckets in [start, end) up to
+    date. A bucket is (re)computed when it has never been stored, when a
+    result dated inside it was added or changed after it was computed, or
+    when results were deleted since (deletions do not say which bucket
+    they came from). Returns the number of buckets computed.
+    """
+    checked_at = datetime.utcnow() - OVERLAP
+    width = _width(granularity)
+    computed = dict(db.session.query(RollupWindow.bucket_start, RollupWindow.computed_at).filter(
+        RollupWindow.granularity == granularity,
+        RollupWindow.bucket_start >= start,
+        RollupWindow.bucket_start < end,
+    ))
+    stale = set()
+    bucket = start
+    while bucket < end:
+        if bucket not in computed:
+            stale.add(bucket)
+        bucket += width
+
+    if computed:
+        since = min(computed.values())
+        column = _bucket_column(granularity)
+        # Only rows touched since the oldest window's check, found through the
+        # updated_at index; a date_conducted filter would tempt the planner
+        # into scanning the whole window instead
+        for changed, updated_at in db.session.query(column, func.max(LabTest.updated_at)).filter(
+            LabTest.updated_at > since,
+        ).group_by(column):
+            if changed in computed and updated_at > computed[changed]:
+                stale.add(changed)
+        deleted_at = db.session.query(func.max(Tombstone.deleted_at)).filter(
+            Tombstone.table_name == LAB_TESTS_TABLE,
+            Tombstone.deleted_at > since,
+        ).scalar()
+        if deleted_at:
+            stale.update(b for b, at in computed.items() if at < deleted_at)
+
+    _recompute(granularity, sorted(stale))
+    fresh = [b for b in computed if b not in stale]
+    if fresh:
+        # Windows found unchanged are current as of this check, so the next
+        # check only has to scan rows touched after it
+        RollupWindow.query.filter(
+            RollupWindow.granularity == granularity,
+            RollupWindow.bucket_start.in_(fresh),
+            RollupWindow.computed_at < checked_at,
+        ).update({"computed_at": checked_at}, synchronize_session=False)
+        db.session.commit()
+    return len(stale)
+
+def _stored(granularity, start, end, parameters=None, created_by=None, by_creator=False):
+    # Plain rows, not ORM instances: a year of daily buckets is thousands of them
+    query = db.session.query(
+        LabTestRollup.bucket_start, LabTestRollup.parameter, LabTestRollup.created_by,
+        LabTestRollup.test_count, LabTestRollup.numeric_count, LabTestRollup.abnormal_count,
+        LabTestRollup.value_sum, LabTestRollup.value_min, LabTestRollup.value_max,
+        *(getattr(LabTestRollup, name) for name, _ in PERCENTILES),
+    ).filter(
+        LabTestRollup.granularity == granularity,
+        LabTestRollup.bucket_start >= start,
+        LabTestRollup.bucket_start < end,
+    )
+    if by_creator:
+        query = query.filter(LabTestRollup.created_by.isnot(None))
+    if created_by is not None:
+        query = query.filter(LabTestRollup.created_by == created_by)
+    elif not by_creator:
+        query = query.filter(LabTestRollup.created_by.is_(None))
+    if parameters:
+        query = query.filter(LabTestRollup.parameter.in_(parameters))
+    names = ("count", "numeric_count", "abnormal_count", "sum", "min", "max") + tuple(name for name, _ in PERCENTILES)
+    return {tuple(r[:3]): dict(zip(names, r[3:])) for r in query}
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else None
+
+def _mean(stats):
+    return round(stats["sum"] / stats["numeric_count"], 4) if stats["numeric_count"] else None
+
+def _summary(buckets):
+    """
+    Whole-window totals for one parameter. Percentiles do not combine across
+    buckets, so only the additive statistics are summarised.
+    """
+    count = sum(s["count"] for s in buckets)
+    numeric = sum(s["numeric_count"] for s in buckets)
+    abnormal = sum(s["abnormal_count"] for s in buckets)
+    mins = [s["min"] for s in buckets if s["min"] is not None]
+    maxs = [s["max"] for s in buckets if s["max"] is not None]
+    return {
+        "count": count,
+        "numeric_count": numeric,
+        "mean": round(sum(s["sum"] or 0 for s in buckets) / numeric, 4) if numeric else None,
+        "min": min(mins) if mins else None,
+        "max": max(maxs) if maxs else None,
+        "abnormal_count": abnormal,
+        "abnormal_rate": _rate(abnormal, count),
+    }
+
+class ResultCache:
+    """
+    Per-worker LRU of computed statistics. Keys include the lab_tests change
+    version and the current bucket, so any write or a window closing makes
+    old entries unreachable.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        max_entries = current_app.config.get("ANALYTICS_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+result_cache = ResultCache()
+
+def parameter_stats(granularity, date_from, date_to, parameters=None, created_by=None, by_creator=False):
+    """
+    Per-parameter distributions (count, mean, min/max, p50/p90/p95,
+    abnormal rate) per day or week between two dates (inclusive).
+
+    Closed buckets are read from lab_test_rollups, refreshed first if
+    results in them changed; only the current, still open bucket is
+    aggregated from lab_tests on each call.
+    """
+    width = _width(granularity)
+    start = bucket_start(date_from, granularity)
+    end = bucket_start(date_to, granularity) + width
+    current = bucket_start(datetime.utcnow(), granularity)
+    closed_end = min(max(start, current), end)
+    parameters = sorted(set(parameters)) if parameters else None
+
+    key = (granularity, start, end, tuple(parameters or ()), created_by, by_creator, current,
+           get_version(LAB_TESTS_TABLE))
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    recomputed, stats = 0, {}
+    if closed_end > start:
+        recomputed = refresh_rollups(granularity, start, closed_end)
+        stats.update(_stored(granularity, start, closed_end, parameters, created_by, by_creator))
+    if end > closed_end:
+        stats.update(_aggregate(granularity, closed_end, end, parameters, created_by, by_creator))
+
+    grouped = defaultdict(list)
+    for (bucket, parameter, creator), s in sorted(stats.items(), key=lambda item: (
+        item[0][1], item[0][0], item[0][2] if item[0][2] is not None else -1,
+    )):
+        grouped[parameter].append((bucket, creator, s))
+
+    result = {
+        "granularity": granularity,
+        "date_from": start.isoformat(),
+        "date_to": (end - timedelta(days=1)).isoformat(),
+        "group_by": "creator" if by_creator else None,
+        "created_by": created_by,
+        "closed_buckets": (closed_end - start) // width,
+        "live_buckets": (end - closed_end) // width,
+        "recomputed_buckets": recomputed,
+        "parameters": [{
+            "parameter": parameter,
+            **_summary([s for _, _, s in buckets]),
+            "buckets": [{
+                "start": bucket.isoformat(),
+                "created_by": creator,
+                "closed": bucket < closed_end,
+                "count": s["count"],
+                "numeric_count": s["numeric_count"],
+                "mean": _mean(s),
+                "min": s["min"],
+                "max": s["max"],
+                **{name: s[name] for name, _ in PERCENTILES},
+                "abnormal_count": s["abnormal_count"],
+                "abnormal_rate": _rate(s["abnormal_count"], s["count"]),
+            } for bucket, creator, s in buckets],
+        } for parameter, buckets in grouped.items()],
+    }
+    result_cache.put(key, result)
+    return result
@@ -0,0 +1,117 @@
+from collections import defaultdict
+from datetime import date, datetime
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from ..extensions import db
+from ..models.dashboard_counter import DashboardCounter
+
+SCOPE_INDEX = "uq_dashboard_counters_scope"
+COUNT_COLUMNS = ("patient_count", "test_count", "abnormal_count")
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def _matches(column, value):
+    return column.is_(None) if value is None else column == value
+
+def _scope():
+    table = DashboardCounter.__table__
+    return next(index for index in table.indexes if index.name == SCOPE_INDEX).expressions
+
+def _upsert(insert, rows):
+    """
+    Adds every row's counts in one INSERT ... ON CONFLICT DO UPDATE, so two
+    transactions making the first write to the same scope both add up
+    instead of racing to INSERT.
+    """
+    stmt = insert(DashboardCounter).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=_scope(),
+        set_={
+            **{name: getattr(DashboardCounter, name) + stmt.excluded[name] for name in COUNT_COLUMNS},
+            "version": DashboardCounter.version + 1,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.session.execute(stmt)
+
+def _apply(created_by, day, patients, tests, abnormal, now):
+    updated = DashboardCounter.query.filter(
+        _matches(DashboardCounter.created_by, created_by),
+        _matches(DashboardCounter.day, day),
+    ).update({
+        "patient_count": DashboardCounter.patient_count + patients,
+        "test_count": DashboardCounter.test_count + tests,
+        "abnormal_count": DashboardCounter.abnormal_count + abnormal,
+        "version": DashboardCounter.version + 1,
+        "updated_at": now,
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(DashboardCounter(
+            created_by=created_by,
+            day=day,
+            patient_count=patients,
+            test_count=tests,
+            abnormal_count=abnormal,
+            version=1,
+            updated_at=now,
+        ))
+
+def record_many(deltas):
+    """
+    Applies counter deltas inside the current transaction; the caller commits.
+
+    `deltas` is an iterable of (created_by, day, patients, tests, abnormal) tuples.
+    Each one is rolled up into the creator's all-days and per-day rows. A day
+    of None only touches the all-days row. Only the touched rows change:
+    there is no global version to bump, readers derive theirs from the rows
+    (see version_of).
+    """
+    rows = defaultdict(lambda: [0, 0, 0])
+    for created_by, day, patients, tests, abnormal in deltas:
+        keys = [(created_by, None)]
+        if day is not None:
+            keys.append((created_by, day))
+        for key in keys:
+            rows[key][0] += patients
+            rows[key][1] += tests
+            rows[key][2] += abnormal
+
+    # A fixed order keeps concurrent writers from locking the same rows in opposite orders
+    changed = [(key, counts) for key, counts in rows.items() if any(counts)]
+    changed.sort(key=lambda item: (item[0][0] or 0, item[0][1] or date.min))
+    if not changed:
+        return
+    now = datetime.utcnow()
+    insert = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if insert is not None:
+        _upsert(insert, [
+            dict(zip(("created_by", "day") + COUNT_COLUMNS + ("version", "updated_at"),
+                     (created_by, day, *counts, 1, now)))
+            for (created_by, day), counts in changed
+        ])
+    else:
+        for (created_by, day), (patients, tests, abnormal) in changed:
+            _apply(created_by, day, patients, tests, abnormal, now)
+
+def version_of(*criteria):
+    """
+    Returns (token, last_modified) for the counter rows matching `criteria`.
+
+    Every write adds one to the version of each row it touches, so the row
+    count plus the summed versions changes whenever any matching row does.
+    """
+    count, versions, last_modified = db.session.query(
+        func.count(DashboardCounter.id),
+        func.coalesce(func.sum(DashboardCounter.version), 0),
+        func.max(DashboardCounter.updated_at),
+    ).filter(*criteria).one()
+    return f"{count}.{versions}", last_modified
+
+def record(created_by=None, day=None, patients=0, tests=0, abnormal=0):
+    """
+    Applies a single counter delta inside the current transaction.
+    """
+    record_many([(created_by, day, patients, tests, abnormal)])
+
+def today():
+    return datetime.utcnow().date()
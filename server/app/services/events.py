@@ -0,0 +1,220 @@
+import json
+import queue
+import select
+import threading
+import time
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from flask import current_app
+from ..extensions import db
+
+CHANNEL = "lab_results_flagged"
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_MAX_STREAMS = 50
+# pg_notify payloads must stay under 8000 bytes
+MAX_NOTIFY_BYTES = 7500
+LISTEN_RETRY_SECONDS = 5.0
+PENDING_KEY = "pending_flagged_events"
+
+class TooManyStreams(Exception):
+    """Raised when this worker already holds EVENTS_MAX_STREAMS open streams."""
+
+class Subscription:
+    """
+    One SSE client: a bounded buffer of events for one patient creator.
+
+    When the client falls behind, the oldest events are dropped and counted
+    so the stream can tell the client to refetch.
+    """
+
+    def __init__(self, created_by, maxsize):
+        self.created_by = created_by
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+class Broker:
+    """
+    In-process pub/sub of flagged results, fanned out by patient creator.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, created_by, maxsize=DEFAULT_QUEUE_SIZE, limit=None):
+        subscription = Subscription(created_by, maxsize)
+        with self._lock:
+            if limit is not None and len(self._subscriptions) >= limit:
+                raise TooManyStreams(f"{limit} event streams already open")
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for item in events:
+            self.published += 1
+            for subscription in subscriptions:
+                if subscription.created_by is None or subscription.created_by == item["created_by"]:
+                    subscription.offer(item)
+                    self.delivered += 1
+
+    def stats(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        return {
+            "backend": _listener.backend,
+            "subscribers": len(subscriptions),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": sum(s.dropped for s in subscriptions),
+            "listener_connected": _listener.connected,
+        }
+
+broker = Broker()
+
+def backend():
+    """
+    Returns "postgres" (LISTEN/NOTIFY, shared by all workers) or "memory" (this process only).
+    """
+    configured = current_app.config.get("EVENTS_BACKEND", "auto")
+    if configured == "auto":
+        return "postgres" if db.engine.dialect.name == "postgresql" else "memory"
+    return configured
+
+def flagged_event(test_id, patient_id, created_by, parameter, values, status, date_conducted):
+    values = values if isinstance(values, dict) else {}
+    return {
+        "id": test_id,
+        "patient_id": patient_id,
+        "created_by": created_by,
+        "parameter": parameter,
+        "value": values.get("value"),
+        "unit": values.get("unit"),
+        "status": status,
+        "date_conducted": date_conducted.isoformat() if date_conducted else None,
+    }
+
+def stage_flagged(events):
+    """
+    Queues flagged-result events to go out when the current transaction commits.
+
+    With the postgres backend they are sent with pg_notify inside the
+    transaction, which Postgres delivers only on commit. With the memory
+    backend they wait in the session until the after_commit hook.
+    """
+    events = [e for e in events if e]
+    if not events:
+        return
+    if backend() == "postgres":
+        for payload in _notify_payloads(events):
+            db.session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+    else:
+        db.session.info.setdefault(PENDING_KEY, []).extend(events)
+
+def _notify_payloads(events):
+    chunk, size = [], 2
+    for item in events:
+        encoded = json.dumps(item)
+        if chunk and size + len(encoded) + 1 > MAX_NOTIFY_BYTES:
+            yield "[" + ",".join(chunk) + "]"
+            chunk, size = [], 2
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        yield "[" + ",".join(chunk) + "]"
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        broker.publish(pending)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+class PostgresListener:
+    """
+    Background thread holding one LISTEN connection per worker process and
+    forwarding notifications into the local broker. Started on first subscribe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.backend = None
+        self.connected = False
+
+    def ensure_started(self, app):
+        with self._lock:
+            self.backend = backend()
+            if self.backend != "postgres" or (self._thread and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, args=(app,), name="events-listener", daemon=True)
+            self._thread.start()
+
+    def _run(self, app):
+        while True:
+            dbapi = None
+            try:
+                with app.app_context():
+                    connection = db.engine.raw_connection()
+                # A dedicated connection; never handed back to the pool
+                connection.detach()
+                dbapi = connection.dbapi_connection
+                dbapi.autocommit = True
+                dbapi.cursor().execute(f"LISTEN {CHANNEL}")
+                self.connected = True
+                while True:
+                    if select.select([dbapi], [], [], 30) == ([], [], []):
+                        continue
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        notify = dbapi.notifies.pop(0)
+                        broker.publish(json.loads(notify.payload))
+            except Exception as e:
+                self.connected = False
+                print(f"Event listener error: {str(e)}")
+                if dbapi is not None:
+                    try:
+                        dbapi.close()
+                    except Exception:
+                        pass
+                time.sleep(LISTEN_RETRY_SECONDS)
+
+_listener = PostgresListener()
+
+def subscribe(app, created_by):
+    """
+    Opens a subscription for one stream, or raises TooManyStreams.
+
+    Every open stream holds a server thread for as long as the client stays
+    connected, so gunicorn must run a gthread or gevent worker class (e.g.
+    `-k gthread --threads 100`); EVENTS_MAX_STREAMS keeps some of those
+    threads free for ordinary requests.
+    """
+    _listener.ensure_started(app)
+    return broker.subscribe(
+        created_by,
+        app.config.get("EVENTS_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+        app.config.get("EVENTS_MAX_STREAMS", DEFAULT_MAX_STREAMS),
+    )
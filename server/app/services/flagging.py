@@ -1,26 +1,486 @@
+import math
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from functools import lru_cache
+from itertools import repeat
+import numpy as np
+from flask import current_app
+from ..extensions import db
 from ..models.test_reference_range import TestReferenceRange
+from .versions import bump_version, get_version
 
-def get_result_status(parameter, values):
+RANGES_TABLE = TestReferenceRange.__tablename__
+DEFAULT_VERSION_CHECK_SECONDS = 5.0
+
+RangeEntry = namedtuple(
+    "RangeEntry",
+    ["id", "test_type", "parameter", "normal_min", "normal_max", "units", "sex", "age_min", "age_max"],
+    defaults=(None, None, None),
+)
+
+# Status codes produced by RangeTable.classify, indexing into STATUS_LABELS
+UNKNOWN, LOW, HIGH, NORMAL = 0, 1, 2, 3
+STATUS_LABELS = np.array(["Unknown", "Low", "High", "Normal"], dtype=object)
+
+def normalize_sex(value):
     """
-    Returns the status ('Low', 'High', 'Normal', 'Unknown') for a test parameter and value.
+    Maps free-text Patient.gender values to 'male', 'female' or None.
     """
-    ref = TestReferenceRange.query.filter_by(parameter=parameter).first()
-    if not ref:
-        return "Unknown"
+    if not value:
+        return None
+    value = str(value).strip().lower()
+    if value in ("m", "male", "man"):
+        return "male"
+    if value in ("f", "female", "woman"):
+        return "female"
+    return None
+
+SEXES = (None, "male", "female")
+# Ages are clamped to [0, AGE_SPAN) when searching band intervals
+AGE_SPAN = 1000.0
+
+@lru_cache(maxsize=256)
+def _sex_code(value):
+    return SEXES.index(normalize_sex(value))
+
+def age_in_years(dob, on=None):
+    """
+    Age in (fractional) years on a given datetime, or None if dob is unknown.
+    """
+    if not dob:
+        return None
+    on = on or datetime.utcnow()
+    return (on.date() - dob).days / 365.25
+
+def _is_banded(band):
+    return band.sex is not None or band.age_min is not None or band.age_max is not None
+
+class RangeTable:
+    """
+    Reference range bands compiled into parallel arrays for vectorized classification.
+
+    Every band is one row; row -1 is a sentinel for "no range". Bands are
+    grouped per (test_type, parameter), and each group has a default row (its
+    lowest-id band without sex/age limits, else its lowest-id band). A result
+    of a given test type uses its own group, else the group without a test
+    type; without a test type it uses the parameter's default row, which
+    comes from the untyped group when there is one. Bands of groups with
+    demographic limits are also indexed per (group, sex) as sorted age
+    intervals for binary search.
+    """
+
+    def __init__(self, bands):
+        self.bands = bands
+        self.keys = {}
+        defaults = {}
+        for row, band in enumerate(bands):
+            for chosen, key in ((self.keys, (band.test_type, band.parameter)), (defaults, band.parameter)):
+                current = chosen.get(key)
+                if current is None or (_is_banded(bands[current]) and not _is_banded(band)):
+                    chosen[key] = row
+        self.index = {p: self.keys.get((None, p), row) for p, row in defaults.items()}
+        self.mins = np.array([b.normal_min for b in bands] + [np.nan], dtype=np.float64)
+        self.maxs = np.array([b.normal_max for b in bands] + [np.nan], dtype=np.float64)
+        self.test_types = [b.test_type for b in bands] + [None]
+
+        # Parameters with bands for more than one test type
+        test_types = defaultdict(set)
+        for test_type, parameter in self.keys:
+            test_types[parameter].add(test_type)
+        self.mixed = {p for p, types in test_types.items() if len(types) > 1}
+
+        banded_keys = {(b.test_type, b.parameter) for b in bands if _is_banded(b)}
+        # Parameters whose results cannot all use one range: reflag classifies them row by row
+        self.banded = {p for _, p in banded_keys} | self.mixed
+        self.banded_rows = np.array([(b.test_type, b.parameter) in banded_keys for b in bands] + [False], dtype=bool)
+        self._banded_defaults = {self.keys[key] for key in banded_keys}
+        grouped = defaultdict(list)
+        for row, band in enumerate(bands):
+            key = (band.test_type, band.parameter)
+            if key in banded_keys:
+                start = band.age_min if band.age_min is not None else -np.inf
+                end = band.age_max if band.age_max is not None else np.inf
+                grouped[(self.keys[key], _sex_code(band.sex))].append((start, end, row))
+
+        # All (group, sex) interval lists are laid end to end, each shifted
+        # by its group number times AGE_SPAN, so one searchsorted call covers
+        # every group. group_of maps default_row * 3 + sex code to the group.
+        self.group_of = np.full((len(bands) + 1) * len(SEXES), -1, dtype=np.intp)
+        self.unbounded = np.full(len(grouped), -1, dtype=np.intp)
+        starts, ends, groups, rows = [], [], [], []
+        for group, (key, items) in enumerate(grouped.items()):
+            items.sort()
+            self.group_of[key[0] * len(SEXES) + key[1]] = group
+            for start, end, row in items:
+                if start == -np.inf and end == np.inf and self.unbounded[group] < 0:
+                    self.unbounded[group] = row
+                offset = group * AGE_SPAN
+                starts.append(offset + min(max(start, 0.0), AGE_SPAN - 1))
+                ends.append(offset + min(max(end, 0.0), AGE_SPAN))
+                groups.append(group)
+                rows.append(row)
+        self.starts = np.array(starts, dtype=np.float64)
+        self.ends = np.array(ends, dtype=np.float64)
+        self.groups = np.array(groups, dtype=np.intp)
+        self.rows = np.array(rows, dtype=np.intp)
+        # Plain-list copies for resolve_one, where NumPy call overhead dominates
+        self._groups = {key: int(group) for key, group in enumerate(self.group_of) if group >= 0}
+        self._intervals = (starts, ends, groups, rows, self.unbounded.tolist())
+
+    def _row(self, parameter, test_type):
+        row = self.keys.get((test_type, parameter))
+        if row is None:
+            row = self.keys.get((None, parameter))
+        # Another test type's range only stands in when it is the only one
+        if row is None and (test_type is None or parameter not in self.mixed):
+            row = self.index.get(parameter)
+        return -1 if row is None else row
+
+    def lookup(self, parameters, test_types=None):
+        """
+        Returns the default row of each parameter (for its test type, if
+        given), -1 where none is configured.
+        """
+        if test_types is None:
+            return np.fromiter(map(self.index.get, parameters, repeat(-1)), dtype=np.intp, count=len(parameters))
+        return np.fromiter(map(self._row, parameters, test_types), dtype=np.intp, count=len(parameters))
+
+    def resolve(self, parameters, sexes=None, ages=None, test_types=None):
+        """
+        Returns the row of the band matching each (parameter, sex, age, test type).
+
+        Each pass is a single vectorized binary search over the concatenated
+        band starts. Sex-specific bands win over any-sex bands; anything
+        unmatched falls back to the group's default row.
+        """
+        rows = self.lookup(parameters, test_types)
+        if not self.banded or (sexes is None and ages is None):
+            return rows
+        n = len(rows)
+        sex_codes = (np.zeros(n, dtype=np.intp) if sexes is None
+                     else np.fromiter(map(_sex_code, sexes), dtype=np.intp, count=n))
+        ages = np.asarray(ages if ages is not None else [np.nan] * n, dtype=np.float64)
+
+        # The default row identifies the group; only banded groups need work
+        positions = np.flatnonzero(self.banded_rows[rows])
+        if not len(positions):
+            return rows
+        base = rows[positions] * len(SEXES)
+        ages = ages[positions]
+        unknown_age = np.isnan(ages)
+        shifted = np.clip(np.nan_to_num(ages), 0.0, AGE_SPAN - 1)
+        resolved = np.full(len(positions), -1, dtype=np.intp)
+
+        # Sex-specific bands first, then bands for either sex
+        for keys in (base + sex_codes[positions], base):
+            group = self.group_of[keys]
+            pending = (resolved < 0) & (group >= 0)
+            needle = group * AGE_SPAN + shifted
+            pos = np.clip(np.searchsorted(self.starts, needle, side="right") - 1, 0, None)
+            hit = pending & ~unknown_age & (self.groups[pos] == group) & (needle < self.ends[pos])
+            resolved[hit] = self.rows[pos[hit]]
+            fallback = pending & unknown_age
+            resolved[fallback] = self.unbounded[group[fallback]]
+        rows[positions] = np.where(resolved >= 0, resolved, rows[positions])
+        return rows
+
+    def resolve_one(self, parameter, sex=None, age=None, test_type=None):
+        """
+        Scalar resolve() for a single result, without NumPy overhead.
+        """
+        row = self._row(parameter, test_type)
+        if row not in self._banded_defaults:
+            return row
+        starts, ends, groups, rows, unbounded = self._intervals
+        unknown_age = age is None or age != age
+        needle_age = 0.0 if unknown_age else min(max(float(age), 0.0), AGE_SPAN - 1)
+        base = row * len(SEXES)
+        for key in (base + _sex_code(sex), base):
+            group = self._groups.get(key)
+            if group is None:
+                continue
+            if unknown_age:
+                if unbounded[group] >= 0:
+                    return unbounded[group]
+                continue
+            needle = group * AGE_SPAN + needle_age
+            pos = max(bisect_right(starts, needle) - 1, 0)
+            if groups[pos] == group and needle < ends[pos]:
+                return rows[pos]
+        return row
+
+    def classify(self, rows, values, parsed):
+        """
+        Returns status codes for float `values` against table `rows`.
+        `parsed` is False where the original value was not numeric.
+        """
+        codes = np.full(len(values), NORMAL, dtype=np.int8)
+        codes[values < self.mins[rows]] = LOW
+        codes[values > self.maxs[rows]] = HIGH
+        codes[(rows < 0) | ~parsed] = UNKNOWN
+        return codes
+
+def _to_floats(values):
+    """
+    Converts raw result values to a float array plus a mask of which ones parsed,
+    with the same rules as float() in the scalar path.
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind in "fiu":
+        floats = values.astype(np.float64, copy=False)
+        return floats, np.isfinite(floats)
     try:
-        val = float(values.get("value"))
-        if val < ref.normal_min:
-            return "Low"
-        elif val > ref.normal_max:
-            return "High"
+        # Fast path: everything converts in C. NaN and infinity are never
+        # results, whether they came from None or from strings like "nan"
+        floats = np.asarray(values, dtype=np.float64)
+        return floats, np.isfinite(floats)
+    except (TypeError, ValueError):
+        pass
+    floats = np.empty(len(values), dtype=np.float64)
+    parsed = np.ones(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        floats[i] = _finite(value)
+        parsed[i] = floats[i] == floats[i]
+    return floats, parsed
+
+def _finite(value):
+    """
+    Returns value as a float, or NaN if it is not a finite number.
+    """
+    try:
+        value = float(value)
+    except Exception:
+        return np.nan
+    return value if math.isfinite(value) else np.nan
+
+class ReferenceRangeCache:
+    """
+    Per-worker, versioned index of reference ranges keyed by parameter.
+
+    The index is loaded once and reused until the `test_reference_ranges`
+    change version moves. Workers compare versions at most once every
+    REFERENCE_RANGE_VERSION_CHECK_SECONDS, so steady-state lookups never
+    touch the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ranges = None
+        self._table = None
+        self._version = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.unmatched = 0
+        self.reloads = 0
+        self.version_checks = 0
+
+    def check_interval(self):
+        return current_app.config.get("REFERENCE_RANGE_VERSION_CHECK_SECONDS", DEFAULT_VERSION_CHECK_SECONDS)
+
+    def _load(self):
+        rows = db.session.query(
+            TestReferenceRange.id,
+            TestReferenceRange.test_type,
+            TestReferenceRange.parameter,
+            TestReferenceRange.normal_min,
+            TestReferenceRange.normal_max,
+            TestReferenceRange.units,
+            TestReferenceRange.sex,
+            TestReferenceRange.age_min,
+            TestReferenceRange.age_max,
+        ).order_by(TestReferenceRange.id).all()
+        return RangeTable([RangeEntry(*row) for row in rows])
+
+    def _refresh(self, force=False):
+        """
+        Returns the index, reloading it if another worker changed the ranges.
+        `force` skips the check interval and compares versions right away.
+        Returns (ranges, reloaded).
+        """
+        now = time.monotonic()
+        ranges = self._ranges
+        if not force and ranges is not None and now - self._checked_at < self.check_interval():
+            return ranges, False
+        with self._lock:
+            if not force and self._ranges is not None and now - self._checked_at < self.check_interval():
+                return self._ranges, False
+            version = get_version(RANGES_TABLE)
+            self.version_checks += 1
+            reloaded = False
+            if self._ranges is None or version != self._version:
+                self._table = self._load()
+                self._ranges = {p: self._table.bands[row] for p, row in self._table.index.items()}
+                self._version = version
+                self.reloads += 1
+                reloaded = True
+            self._checked_at = now
+            return self._ranges, reloaded
+
+    def snapshot(self, force=False):
+        """
+        Returns the current parameter -> default RangeEntry mapping.
+        """
+        return self._refresh(force)[0]
+
+    def get(self, parameter):
+        """
+        Returns the default RangeEntry for a parameter, or None if none is configured.
+        """
+        ranges, reloaded = self._refresh()
+        if reloaded:
+            self.misses += 1
         else:
-            return "Normal"
+            self.hits += 1
+        ref = ranges.get(parameter)
+        if ref is None:
+            self.unmatched += 1
+        return ref
+
+    def table(self, lookups=1):
+        """
+        Returns the compiled RangeTable for the current ranges, recording `lookups` in the counters.
+        """
+        ranges, reloaded = self._refresh()
+        if reloaded:
+            self.misses += 1
+            lookups -= 1
+        self.hits += max(lookups, 0)
+        return self._table
+
+    def invalidate(self):
+        """
+        Marks the ranges as changed. Call before committing a create/update/delete
+        so the version bump lands in the same transaction.
+        """
+        bump_version(RANGES_TABLE)
+        with self._lock:
+            # Forces a version comparison (and so a reload) on the next lookup,
+            # while concurrent readers keep using the previous index
+            self._version = None
+            self._checked_at = 0.0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "version": self._version,
+            "size": len(self._ranges) if self._ranges is not None else 0,
+            "bands": len(self._table.bands) if self._table is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "unmatched": self.unmatched,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "reloads": self.reloads,
+            "version_checks": self.version_checks,
+        }
+
+range_cache = ReferenceRangeCache()
+
+def parse_numeric(values):
+    """
+    Returns result_values["value"] as a float, or None if it is not a finite number.
+    """
+    value = _finite(_raw_value(values))
+    return value if value == value else None
+
+MAX_PARAMETER_LENGTH = 100
+
+def valid_parameter(parameter):
+    """
+    Returns True if parameter is a non-empty string that fits LabTest.parameter.
+    """
+    return isinstance(parameter, str) and 0 < len(parameter) <= MAX_PARAMETER_LENGTH
+
+def valid_result_values(values):
+    """
+    Returns True if values is a result_values dict with 'value' and 'unit'.
+    """
+    return isinstance(values, dict) and "value" in values and "unit" in values
+
+def typed_values(values):
+    """
+    Returns the typed LabTest columns derived from a result_values dict.
+    """
+    unit = values.get("unit")
+    return {
+        "value_numeric": parse_numeric(values),
+        "unit": str(unit)[:50] if unit is not None else None,
+    }
+
+def classify_batch(parameters, values, sexes=None, ages=None, test_types=None):
+    """
+    Returns a status ('Low', 'High', 'Normal', 'Unknown') for each parameter/value pair.
+
+    `values` are the raw result values (not result_values dicts); a float
+    NumPy array is used as-is, with NaN meaning "no value". Optional `sexes`
+    and `ages` (years) select demographic bands, and `test_types` (e.g. the
+    panel's) the ranges configured for that test type.
+    """
+    return STATUS_LABELS[classify_codes(parameters, values, sexes, ages, test_types)].tolist()
+
+def classify_codes(parameters, values, sexes=None, ages=None, test_types=None):
+    """
+    Like classify_batch, but returns the int8 status code array for callers that stay in NumPy.
+    """
+    table = range_cache.table(lookups=len(parameters))
+    rows = table.resolve(parameters, sexes, ages, test_types)
+    range_cache.unmatched += int((rows < 0).sum())
+    floats, parsed = _to_floats(values)
+    return table.classify(rows, floats, parsed)
+
+def resolve_range(parameter, sex=None, age=None, test_type=None):
+    """
+    Returns the RangeEntry that applies to one patient, or None.
+    """
+    table = range_cache.table()
+    row = table.resolve_one(parameter, sex, age, test_type)
+    return table.bands[row] if row >= 0 else None
+
+def _raw_value(values):
+    try:
+        return values.get("value")
     except Exception:
+        return None
+
+def get_result_status(parameter, values, sex=None, age=None, test_type=None):
+    """
+    Returns the status ('Low', 'High', 'Normal', 'Unknown') for a test parameter and value.
+    """
+    table = range_cache.table()
+    row = table.resolve_one(parameter, sex, age, test_type)
+    if row < 0:
+        range_cache.unmatched += 1
         return "Unknown"
+    val = _finite(_raw_value(values))
+    if val != val:
+        return "Unknown"
+    if val < table.mins[row]:
+        return "Low"
+    elif val > table.maxs[row]:
+        return "High"
+    return "Normal"
 
-def flag_abnormal(parameter, values):
+def flag_abnormal(parameter, values, sex=None, age=None):
     """
     Returns True if result is abnormal ('Low' or 'High'), False otherwise.
     """
-    status = get_result_status(parameter, values)
-    return status != "Normal"
\ No newline at end of file
+    status = get_result_status(parameter, values, sex, age)
+    return status != "Normal"
+
+def get_result_statuses(results, sexes=None, ages=None, test_types=None):
+    """
+    Returns the status of each (parameter, values) pair, resolved against a single snapshot of the ranges.
+    """
+    return classify_batch(
+        [parameter for parameter, _ in results], [_raw_value(values) for _, values in results],
+        sexes, ages, test_types,
+    )
+
+def flag_abnormal_many(results, sexes=None, ages=None):
+    """
+    Flags a list of (parameter, values) pairs against a single snapshot of the ranges.
+    Returns a list of booleans in the same order.
+    """
+    return [status != "Normal" for status in get_result_statuses(results, sexes, ages)]
@@ -0,0 +1,174 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timezone
+from functools import wraps
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from ..extensions import db
+from ..models.table_version import TableVersion
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+DEFAULT_RESPONSE_CACHE_SIZE = 256
+DEFAULT_COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+class ResponseCache:
+    """
+    Per-worker LRU of rendered 200 responses keyed by their ETag.
+
+    The ETag already covers the URL, the caller and the version of every
+    table the response reads, so a write that bumps a version makes the
+    old entries unreachable; they age out of the LRU.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        max_entries = current_app.config.get("RESPONSE_CACHE_SIZE", DEFAULT_RESPONSE_CACHE_SIZE)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+response_cache = ResponseCache()
+
+def _table_versions(tables):
+    if not tables:
+        return {}
+    rows = db.session.query(TableVersion.table_name, TableVersion.version, TableVersion.updated_at).filter(
+        TableVersion.table_name.in_(tables)
+    ).all()
+    versions = {table: (0, None) for table in tables}
+    versions.update({name: (version, updated_at) for name, version, updated_at in rows})
+    return versions
+
+def _identity_key():
+    identity = get_jwt_identity()
+    return identity.get("id") if isinstance(identity, dict) else identity
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    return False
+
+def _validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # Clients may keep the body but must revalidate before reusing it
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def conditional(*tables, cache=False, version=None):
+    """
+    Route decorator (inside @jwt_required) adding ETag/Last-Modified validators
+    derived from the change versions of `tables`.
+
+    `version`, for data not tracked in table_versions, is called with no
+    arguments inside the request and returns (token, last_modified).
+
+    A matching If-None-Match or If-Modified-Since gets a 304 without running
+    the view. With `cache`, 200 responses are also kept in the per-worker
+    response cache when RESPONSE_CACHE_ENABLED is set.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return fn(*args, **kwargs)
+            versions = _table_versions(tables)
+            modified = [updated for _, updated in versions.values() if updated]
+            parts = [f"{table}:{versions[table][0]}" for table in sorted(versions)]
+            if version is not None:
+                token, updated = version()
+                parts.append(str(token))
+                if updated:
+                    modified.append(updated)
+            last_modified = max(modified, default=None)
+            key = "|".join([
+                request.full_path,
+                str(_identity_key()),
+                ",".join(parts),
+            ])
+            etag = hashlib.sha1(key.encode()).hexdigest()[:24]
+
+            if _not_modified(etag, last_modified):
+                return _validators(current_app.response_class(status=304), etag, last_modified)
+
+            use_cache = cache and current_app.config.get("RESPONSE_CACHE_ENABLED", True)
+            if use_cache:
+                entry = response_cache.get(etag)
+                if entry is not None:
+                    body, mimetype = entry
+                    return _validators(current_app.response_class(body, 200, mimetype=mimetype), etag, last_modified)
+
+            response = current_app.make_response(fn(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if use_cache:
+                response_cache.put(etag, (response.get_data(), response.mimetype))
+            return _validators(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+def compress_response(response):
+    """
+    after_request hook: brotli- or gzip-encodes JSON bodies of at least
+    COMPRESS_MIN_BYTES when the client accepts it.
+    """
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or "Content-Encoding" in response.headers or not response.is_json):
+        return response
+    body = response.get_data()
+    if len(body) < current_app.config.get("COMPRESS_MIN_BYTES", DEFAULT_COMPRESS_MIN_BYTES):
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        encoding, compressed = "br", brotli.compress(body, quality=BROTLI_QUALITY)
+    elif accepted["gzip"]:
+        encoding, compressed = "gzip", gzip.compress(body, compresslevel=GZIP_LEVEL)
+    else:
+        return response
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
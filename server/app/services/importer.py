@@ -0,0 +1,519 @@
+"""
+Streaming importers for analyzer exports: HL7 v2 ORU^R01, ASTM E1394
+(LIS2-A2) and CSV.
+
+Each parser is a generator over text lines that yields one Observation per
+result, so only the current message/record context is held in memory. An
+ImportJob groups observations into chunks, resolves (or creates) their
+patients, flags the whole chunk against one snapshot of the ranges and
+writes it in one transaction.
+"""
+import csv
+import io
+import os
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from ..extensions import db
+from ..models.patient import Patient
+from . import counters
+from .flagging import age_in_years, get_result_statuses, normalize_sex, typed_values
+from .results import insert_lab_tests
+from .versions import bump_version
+
+DEFAULT_CHUNK_SIZE = 2000
+PATIENT_CACHE_SIZE = 10000
+MAX_REPORTED_ERRORS = 50
+MAX_TRACKED_JOBS = 20
+FORMATS = ("hl7", "astm", "csv")
+PATIENTS_TABLE = Patient.__tablename__
+
+Observation = namedtuple("Observation", [
+    "line", "patient_id", "patient_name", "dob", "gender", "parameter", "value", "unit", "date_conducted",
+])
+
+class RecordError(ValueError):
+    """A record that cannot be imported; the job skips it and carries on."""
+
+# LOINC codes analyzers commonly send, mapped to this app's parameter names
+PARAMETER_ALIASES = {
+    "718-7": "hemoglobin",
+    "6690-2": "wbc",
+    "777-3": "platelets",
+    "2345-7": "glucose",
+    "2160-0": "creatinine",
+    "2089-1": "ldl",
+    "13457-7": "ldl",
+    "2085-9": "hdl",
+    "2951-2": "sodium",
+    "hgb": "hemoglobin",
+    "plt": "platelets",
+    "glu": "glucose",
+    "crea": "creatinine",
+    "na": "sodium",
+}
+
+def _parameter(code, text=None):
+    code = (code or "").strip()
+    alias = PARAMETER_ALIASES.get(code) or PARAMETER_ALIASES.get(code.lower())
+    if alias:
+        return alias
+    name = (text or code).strip().lower()
+    return PARAMETER_ALIASES.get(name, name)
+
+def parse_ts(value):
+    """
+    HL7/ASTM timestamps: YYYY[MM[DD[HH[MM[SS[.S]]]]]][+/-ZZZZ], returned as naive UTC.
+    """
+    value = (value or "").strip()
+    if not value:
+        return None
+    offset = None
+    for position in range(8, len(value)):
+        if value[position] in "+-":
+            zone = value[position + 1:]
+            try:
+                offset = timedelta(hours=int(zone[:2] or 0), minutes=int(zone[2:4] or 0))
+            except ValueError:
+                raise RecordError(f"Invalid time zone {zone!r}")
+            if value[position] == "-":
+                offset = -offset
+            value = value[:position]
+            break
+    digits = value.split(".")[0]
+    parts = [digits[0:4], digits[4:6] or "1", digits[6:8] or "1", digits[8:10] or "0",
+             digits[10:12] or "0", digits[12:14] or "0"]
+    try:
+        parsed = datetime(*(int(part) for part in parts))
+    except ValueError:
+        raise RecordError(f"Invalid timestamp {value!r}")
+    return parsed - offset if offset is not None else parsed
+
+def parse_iso(value):
+    """
+    CSV timestamps: ISO 8601, with or without an offset, returned as naive UTC.
+    """
+    parsed = datetime.fromisoformat(value.strip())
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _dob(value):
+    parsed = parse_ts(value)
+    return parsed.date() if parsed else None
+
+def _field(fields, index):
+    return fields[index] if len(fields) > index else ""
+
+def _person_name(value, component_sep):
+    """
+    'DOE^JANE^Q' -> 'Jane Q Doe'.
+    """
+    parts = [part.strip() for part in (value or "").split(component_sep)]
+    family, given = parts[0], [part for part in parts[1:3] if part]
+    return " ".join(given + [family]).title().strip()
+
+def parse_hl7(lines):
+    """
+    Observations from HL7 v2 ORU^R01 messages (PID, OBR, OBX segments).
+    Segments may be separated by CR, LF or CRLF.
+    """
+    field, component = "|", "^"
+    patient = None
+    observed_at = None
+    for number, line in enumerate(lines, 1):
+        line = line.strip("\r\n\x0b\x1c")
+        if not line:
+            continue
+        segment = line[:3]
+        if segment == "MSH":
+            field, component = line[3], line[4]
+            patient, observed_at = None, None
+            continue
+        try:
+            fields = line.split(field)
+            if segment == "PID":
+                # Cleared first so a bad PID never leaves results on the previous patient
+                patient = None
+                patient = (
+                    _person_name(_field(fields, 5), component),
+                    _dob(_field(fields, 7)),
+                    normalize_sex(_field(fields, 8)) or "unknown",
+                )
+            elif segment == "OBR":
+                observed_at = parse_ts(_field(fields, 7))
+            elif segment == "OBX":
+                if _field(fields, 11).strip() in ("X", "D", "W"):
+                    continue  # not obtained / deleted / wrong result
+                if patient is None:
+                    yield RecordError(f"line {number}: OBX before PID")
+                    continue
+                identifier = _field(fields, 3).split(component)
+                yield Observation(
+                    line=number,
+                    patient_id=None,
+                    patient_name=patient[0],
+                    dob=patient[1],
+                    gender=patient[2],
+                    parameter=_parameter(identifier[0], identifier[1] if len(identifier) > 1 else None),
+                    value=_field(fields, 5).split(component)[0].strip(),
+                    unit=_field(fields, 6).split(component)[0].strip(),
+                    date_conducted=parse_ts(_field(fields, 14)) or observed_at,
+                )
+        except RecordError as e:
+            yield RecordError(f"line {number}: {str(e)}")
+
+def parse_astm(lines):
+    """
+    Observations from ASTM E1394 / LIS2-A2 records (H, P, O, R, L).
+    Low-level frame numbers, STX/ETX and checksums are stripped if present.
+    """
+    field, component = "|", "^"
+    patient = None
+    for number, line in enumerate(lines, 1):
+        # Drop any ETX/ETB and the checksum after it, then framing characters
+        line = line.split("\x03")[0].split("\x17")[0].strip("\r\n\x02\x04\x05\x06")
+        if len(line) > 1 and line[0].isdigit() and line[1].isalpha():
+            line = line[1:]
+        if not line:
+            continue
+        record = line[0].upper()
+        if record == "H":
+            field, component = line[1], line[3] if len(line) > 3 else "^"
+            patient = None
+            continue
+        try:
+            # ASTM numbers fields from 1 at the record type
+            fields = [""] + line.split(field)
+            if record == "P":
+                patient = None
+                patient = (
+                    _person_name(_field(fields, 6), component),
+                    _dob(_field(fields, 8)),
+                    normalize_sex(_field(fields, 9)) or "unknown",
+                )
+            elif record == "R":
+                if _field(fields, 9).strip() in ("X", "D"):
+                    continue
+                if patient is None:
+                    yield RecordError(f"line {number}: R record before P")
+                    continue
+                test_id = [part for part in _field(fields, 3).split(component) if part.strip()]
+                yield Observation(
+                    line=number,
+                    patient_id=None,
+                    patient_name=patient[0],
+                    dob=patient[1],
+                    gender=patient[2],
+                    parameter=_parameter(test_id[0] if test_id else ""),
+                    value=_field(fields, 4).split(component)[0].strip(),
+                    unit=_field(fields, 5).split(component)[0].strip(),
+                    date_conducted=parse_ts(_field(fields, 13)),
+                )
+            elif record == "L":
+                patient = None
+        except RecordError as e:
+            yield RecordError(f"line {number}: {str(e)}")
+
+CSV_COLUMNS = ("parameter", "value", "unit")
+
+def parse_csv(lines):
+    """
+    Observations from a CSV with a header row: parameter, value, unit, and
+    either patient_id or patient_name + dob (gender optional);
+    date_conducted (ISO) is optional.
+    """
+    reader = csv.DictReader(lines)
+    header = set(reader.fieldnames or [])
+    missing = [c for c in CSV_COLUMNS if c not in header]
+    if missing or not ("patient_id" in header or {"patient_name", "dob"} <= header):
+        raise RecordError(f"CSV header must include {', '.join(CSV_COLUMNS)} and patient_id or patient_name, dob")
+    for row in reader:
+        number = reader.line_num
+        try:
+            yield Observation(
+                line=number,
+                patient_id=int(row["patient_id"]) if row.get("patient_id") else None,
+                patient_name=(row.get("patient_name") or "").strip() or None,
+                dob=date.fromisoformat(row["dob"].strip()) if row.get("dob") else None,
+                gender=normalize_sex(row.get("gender")) or "unknown",
+                parameter=_parameter(row["parameter"]),
+                value=(row["value"] or "").strip(),
+                unit=(row["unit"] or "").strip(),
+                date_conducted=parse_iso(row["date_conducted"]) if row.get("date_conducted") else None,
+            )
+        except (ValueError, TypeError) as e:
+            yield RecordError(f"line {number}: {str(e)}")
+
+PARSERS = {"hl7": parse_hl7, "astm": parse_astm, "csv": parse_csv}
+
+def detect_format(filename, first_line):
+    """
+    Picks a parser from the file extension, else from the first line.
+    """
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension in ("hl7", "oru"):
+        return "hl7"
+    if extension in ("astm", "lis", "asc"):
+        return "astm"
+    if extension == "csv":
+        return "csv"
+    first_line = (first_line or "").lstrip("﻿\x0b\x02")
+    if first_line.startswith("MSH"):
+        return "hl7"
+    if first_line[:2] in ("H|", "1H") or first_line.startswith("1H|"):
+        return "astm"
+    return "csv"
+
+def open_text(path):
+    # Universal newlines turn HL7's bare CR segment separators into line breaks
+    return io.open(path, "r", encoding="utf-8-sig", errors="replace", newline=None)
+
+class ImportJob:
+    """
+    Imports one file in chunks of `chunk_size` observations, each flagged
+    in one batch and committed separately.
+
+    Patients are matched by id (CSV) or by name and date of birth among the
+    importing user's patients, and created when missing if
+    `create_patients` is set. Records that cannot be imported are counted
+    and the first few reported. A chunk the database rejects is rolled back
+    and retried one observation at a time, skipping the ones that still fail.
+    """
+
+    def __init__(self, source, fmt, submitted_by, create_patients=True, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.id = uuid.uuid4().hex
+        self.source = source
+        self.format = fmt
+        self.submitted_by = submitted_by
+        self.create_patients = create_patients
+        self.chunk_size = chunk_size
+        self.state = "pending"
+        self.read = 0
+        self.imported = 0
+        self.flagged = 0
+        self.skipped = 0
+        self.patients_created = 0
+        self.errors = []
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self._patients = OrderedDict()
+        # Cache keys of patients inserted by the open transaction
+        self._created = []
+
+    def _skip(self, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    def _remember(self, key, patient):
+        self._patients[key] = patient
+        self._patients.move_to_end(key)
+        while len(self._patients) > PATIENT_CACHE_SIZE:
+            self._patients.popitem(last=False)
+
+    def _resolve_patients(self, chunk):
+        """
+        Maps every observation of a chunk to a (id, created_by, gender, dob)
+        row, with one query for ids and one for name/dob pairs not cached.
+        """
+        columns = (Patient.id, Patient.created_by, Patient.gender, Patient.dob)
+        by_id = {o.patient_id for o in chunk if o.patient_id is not None and ("id", o.patient_id) not in self._patients}
+        if by_id:
+            for row in db.session.query(*columns).filter(Patient.id.in_(by_id)):
+                self._remember(("id", row.id), row)
+
+        wanted = {
+            (o.patient_name.lower(), o.dob) for o in chunk
+            if o.patient_id is None and o.patient_name and o.dob
+            and ("name", o.patient_name.lower(), o.dob) not in self._patients
+        }
+        if wanted:
+            rows = db.session.query(*columns, func.lower(Patient.name)).filter(
+                Patient.created_by == self.submitted_by,
+                func.lower(Patient.name).in_({name for name, _ in wanted}),
+                Patient.dob.in_({dob for _, dob in wanted}),
+            ).order_by(Patient.id)
+            for row in rows:
+                key = ("name", row[4], row.dob)
+                if (row[4], row.dob) in wanted and key not in self._patients:
+                    self._remember(key, row[:4])
+
+            missing = {}
+            for o in chunk:
+                key = ("name", o.patient_name.lower(), o.dob) if o.patient_name and o.dob else None
+                if key and key not in self._patients and key not in missing:
+                    missing[key] = {"name": o.patient_name, "dob": o.dob, "gender": o.gender,
+                                    "created_by": self.submitted_by}
+            if missing and self.create_patients:
+                ids = db.session.execute(
+                    Patient.__table__.insert().returning(Patient.__table__.c.id, sort_by_parameter_order=True),
+                    list(missing.values()),
+                ).scalars().all()
+                for (key, values), patient_id in zip(missing.items(), ids):
+                    self._remember(key, (patient_id, self.submitted_by, values["gender"], values["dob"]))
+                    self._created.append(key)
+                counters.record(created_by=self.submitted_by, patients=len(ids))
+                bump_version(PATIENTS_TABLE)
+                self.patients_created += len(ids)
+
+        resolved = []
+        for o in chunk:
+            if o.patient_id is not None:
+                key = ("id", o.patient_id)
+            elif o.patient_name and o.dob:
+                key = ("name", o.patient_name.lower(), o.dob)
+            else:
+                self._skip(f"line {o.line}: no patient id, name or date of birth")
+                continue
+            patient = self._patients.get(key)
+            if patient is None:
+                self._skip(f"line {o.line}: patient not found")
+                continue
+            resolved.append((o, patient))
+        return resolved
+
+    def _write_chunk(self, chunk):
+        try:
+            self._write(chunk)
+        except SQLAlchemyError as e:
+            print(f"Import job {self.id} chunk error, retrying one record at a time: {str(e)}")
+            for o in chunk:
+                try:
+                    self._write([o])
+                except SQLAlchemyError as e:
+                    self._skip(f"line {o.line}: {str(e).splitlines()[0]}")
+
+    def _write(self, chunk):
+        """
+        Resolves, flags and inserts `chunk` in one transaction. On a database
+        error it rolls back, along with the counts and cached patients of the
+        attempt, and re-raises.
+        """
+        saved = (self.skipped, len(self.errors), self.patients_created)
+        self._created = []
+        try:
+            added, flagged = self._insert(chunk)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            for key in self._created:
+                self._patients.pop(key, None)
+            self.skipped, self.patients_created = saved[0], saved[2]
+            del self.errors[saved[1]:]
+            raise
+        finally:
+            self._created = []
+        self.imported += added
+        self.flagged += flagged
+
+    def _insert(self, chunk):
+        resolved = self._resolve_patients(chunk)
+        now = datetime.utcnow()
+        pairs = []
+        for o, patient in resolved:
+            if not o.parameter or o.value == "":
+                self._skip(f"line {o.line}: missing parameter or value")
+                continue
+            pairs.append((o, patient))
+        statuses = get_result_statuses(
+            [(o.parameter, {"value": o.value, "unit": o.unit}) for o, _ in pairs],
+            sexes=[patient[2] for _, patient in pairs],
+            ages=[age_in_years(patient[3], o.date_conducted or now) for o, patient in pairs],
+        )
+        rows = []
+        for (o, patient), status in zip(pairs, statuses):
+            values = {"value": o.value, "unit": o.unit}
+            rows.append({
+                "parameter": o.parameter[:100],
+                "result_values": values,
+                "patient_id": patient[0],
+                "flagged": status != "Normal",
+                "status": status,
+                "date_conducted": o.date_conducted or now,
+                **typed_values(values),
+            })
+        insert_lab_tests(rows, {patient[0]: patient[1] for _, patient in pairs})
+        return len(rows), sum(1 for row in rows if row["flagged"])
+
+    def run(self, lines):
+        """
+        Parses and writes `lines` (any iterable of text lines).
+        """
+        self.state = "running"
+        self.started_at = datetime.utcnow()
+        try:
+            chunk = []
+            for observation in PARSERS[self.format](lines):
+                self.read += 1
+                if isinstance(observation, RecordError):
+                    self._skip(str(observation))
+                    continue
+                chunk.append(observation)
+                if len(chunk) >= self.chunk_size:
+                    self._write_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self._write_chunk(chunk)
+            self.state = "done"
+        except Exception as e:
+            db.session.rollback()
+            self.state = "failed"
+            self.error = str(e)
+            print(f"Import job {self.id} error: {str(e)}")
+        finally:
+            self.finished_at = datetime.utcnow()
+        return self
+
+    def progress(self):
+        elapsed = ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds() if self.started_at else 0
+        return {
+            "id": self.id,
+            "source": self.source,
+            "format": self.format,
+            "state": self.state,
+            "records_read": self.read,
+            "imported": self.imported,
+            "flagged": self.flagged,
+            "skipped": self.skipped,
+            "patients_created": self.patients_created,
+            "elapsed_seconds": round(elapsed, 3),
+            "records_per_second": round(self.read / elapsed, 1) if elapsed else None,
+            "errors": self.errors,
+            "error": self.error,
+        }
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+def start_job(app, path, fmt, submitted_by, source=None, create_patients=True, chunk_size=DEFAULT_CHUNK_SIZE,
+              delete_after=False):
+    """
+    Imports the file at `path` on a background thread and returns the job immediately.
+    """
+    job = ImportJob(source or os.path.basename(path), fmt, submitted_by, create_patients, chunk_size)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > MAX_TRACKED_JOBS:
+            _jobs.popitem(last=False)
+
+    def target():
+        with app.app_context():
+            try:
+                with open_text(path) as lines:
+                    job.run(lines)
+            finally:
+                db.session.remove()
+                if delete_after:
+                    os.remove(path)
+
+    threading.Thread(target=target, name=f"import-{job.id}", daemon=True).start()
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
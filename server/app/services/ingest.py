@@ -0,0 +1,295 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from ..extensions import db
+from ..models import IngestItem, Patient
+from .flagging import age_in_years, get_result_statuses, typed_values, valid_parameter, valid_result_values
+from .results import insert_lab_tests
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_DELAY_SECONDS = 0.5
+DEFAULT_MAX_PENDING = 50000
+DEFAULT_RETENTION_HOURS = 24
+PRUNE_INTERVAL_SECONDS = 60
+PENDING, DONE, REJECTED = "pending", "done", "rejected"
+
+class QueueFull(Exception):
+    pass
+
+class InvalidPayload(ValueError):
+    """Raised by enqueue for a result the synchronous path would reject."""
+
+def validate_payload(payload):
+    """
+    Checks a queued result the way POST /api/tests does. Raises InvalidPayload.
+    """
+    if not isinstance(payload, dict):
+        raise InvalidPayload("payload must be a dictionary")
+    if not valid_parameter(payload.get("parameter")):
+        raise InvalidPayload("parameter must be a string of at most 100 characters")
+    if not valid_result_values(payload.get("result_values")):
+        raise InvalidPayload("result_values must be a dictionary with 'value' and 'unit'")
+    patient_id = payload.get("patient_id")
+    if not isinstance(patient_id, int) or isinstance(patient_id, bool):
+        raise InvalidPayload("patient_id must be an integer")
+    try:
+        datetime.fromisoformat(payload.get("date_conducted"))
+    except (TypeError, ValueError):
+        raise InvalidPayload("date_conducted must be an ISO datetime")
+
+class IngestWorker:
+    """
+    Write-behind for POST /api/tests in async mode.
+
+    Requests append the validated result to the ingest_outbox table and
+    return. A background thread per worker process drains pending rows in
+    batches of INGEST_BATCH_SIZE, or whatever is pending after
+    INGEST_MAX_DELAY_SECONDS, flagging and inserting each batch in one
+    transaction. If a batch fails, its items are written one at a time and
+    the ones that still fail are rejected with their error. On Postgres,
+    FOR UPDATE SKIP LOCKED lets every process drain the same outbox without
+    taking the same rows.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._drained = threading.Condition()
+        self._thread = None
+        self._since_drain = 0
+        self._last_prune = 0.0
+        self.backlog = 0
+        self.oldest_pending_at = None
+        self.enqueued = 0
+        self.duplicates = 0
+        self.refused = 0
+        self.batches = 0
+        self.processed = 0
+        self.rejected = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = None
+        self.last_error = None
+
+    def ensure_started(self, app):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(app,), name="ingest-worker", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, submitted_by, payload, idempotency_key=None):
+        """
+        Durably records one result for the worker. Returns (item, created);
+        a repeated idempotency key returns the original item instead.
+        Raises InvalidPayload for a result the synchronous path would reject
+        and QueueFull when the backlog is over INGEST_MAX_PENDING.
+        """
+        validate_payload(payload)
+        config = current_app.config
+        self.ensure_started(current_app._get_current_object())
+        if idempotency_key:
+            existing = IngestItem.query.filter_by(submitted_by=submitted_by, idempotency_key=idempotency_key).first()
+            if existing:
+                self.duplicates += 1
+                return existing, False
+        if self.backlog + self._since_drain >= config.get("INGEST_MAX_PENDING", DEFAULT_MAX_PENDING):
+            self.refused += 1
+            raise QueueFull()
+
+        item = IngestItem(submitted_by=submitted_by, idempotency_key=idempotency_key, payload=payload, state=PENDING)
+        db.session.add(item)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Same key submitted concurrently; the other request won
+            db.session.rollback()
+            self.duplicates += 1
+            return IngestItem.query.filter_by(submitted_by=submitted_by, idempotency_key=idempotency_key).first(), False
+
+        self.enqueued += 1
+        with self._lock:
+            self._since_drain += 1
+            full = self._since_drain >= config.get("INGEST_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+        if full:
+            self._wake.set()
+        return item, True
+
+    def wait_for(self, item_id, timeout):
+        """
+        Read-your-writes: asks for an immediate drain and blocks until the
+        item is no longer pending or `timeout` seconds pass. Returns the item.
+        """
+        self.ensure_started(current_app._get_current_object())
+        deadline = time.monotonic() + timeout
+        self._wake.set()
+        while True:
+            # End the read transaction so the next query sees the worker's commit
+            db.session.rollback()
+            item = db.session.get(IngestItem, item_id)
+            remaining = deadline - time.monotonic()
+            if item is None or item.state != PENDING or remaining <= 0:
+                return item
+            with self._drained:
+                self._drained.wait(min(remaining, DEFAULT_MAX_DELAY_SECONDS))
+
+    def _run(self, app):
+        while True:
+            self._wake.wait(timeout=app.config.get("INGEST_MAX_DELAY_SECONDS", DEFAULT_MAX_DELAY_SECONDS))
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    while self._drain_batch(app.config.get("INGEST_BATCH_SIZE", DEFAULT_BATCH_SIZE)):
+                        pass
+                    self._refresh_backlog()
+                    if time.monotonic() - self._last_prune > PRUNE_INTERVAL_SECONDS:
+                        self._prune(app.config.get("INGEST_RETENTION_HOURS", DEFAULT_RETENTION_HOURS))
+                except Exception as e:
+                    db.session.rollback()
+                    self.last_error = str(e)
+                    print(f"Ingest worker error: {str(e)}")
+                finally:
+                    db.session.remove()
+            with self._drained:
+                self._drained.notify_all()
+
+    def _drain_batch(self, batch_size):
+        """
+        Writes one batch of pending items. Returns True if the batch was full,
+        i.e. there may be more to drain right away.
+        """
+        with self._lock:
+            self._since_drain = 0
+        items = IngestItem.query.filter(IngestItem.state == PENDING).order_by(IngestItem.id).limit(
+            batch_size
+        ).with_for_update(skip_locked=True).all()
+        if not items:
+            return False
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        item_ids = [item.id for item in items]
+
+        try:
+            processed, rejected = self._write(items, now)
+            db.session.commit()
+        except Exception as e:
+            # One bad item must not hold back (or endlessly retry) the rest
+            db.session.rollback()
+            self.last_error = str(e)
+            print(f"Ingest batch error, writing items one at a time: {str(e)}")
+            processed = rejected = 0
+            for item_id in item_ids:
+                done, failed = self._write_one(item_id, now)
+                processed += done
+                rejected += failed
+
+        self.batches += 1
+        self.processed += processed
+        self.rejected += rejected
+        self.last_batch_size = len(item_ids)
+        self.last_batch_ms = round((time.perf_counter() - started) * 1000, 2)
+        return len(item_ids) == batch_size
+
+    def _write_one(self, item_id, now):
+        """
+        Writes one item in its own transaction, rejecting it with the error if
+        that fails. Returns (processed, rejected) counts.
+        """
+        item = IngestItem.query.filter(IngestItem.id == item_id, IngestItem.state == PENDING).with_for_update(
+            skip_locked=True
+        ).first()
+        if item is None:
+            # Taken by another worker since the batch was rolled back
+            return 0, 0
+        try:
+            counts = self._write([item], now)
+            db.session.commit()
+            return counts
+        except Exception as e:
+            db.session.rollback()
+            IngestItem.query.filter(IngestItem.id == item_id, IngestItem.state == PENDING).update(
+                {"state": REJECTED, "error": str(e)[:255], "processed_at": now}, synchronize_session=False,
+            )
+            db.session.commit()
+            return 0, 1
+
+    def _write(self, items, now):
+        """
+        Flags and inserts `items` in the current transaction; the caller
+        commits. Returns (processed, rejected) counts.
+        """
+        patient_ids = {item.payload["patient_id"] for item in items}
+        patients = {
+            row.id: row for row in db.session.query(
+                Patient.id, Patient.created_by, Patient.gender, Patient.dob,
+            ).filter(Patient.id.in_(patient_ids))
+        }
+        accepted = []
+        for item in items:
+            if item.payload["patient_id"] in patients:
+                accepted.append(item)
+            else:
+                # The patient was deleted after the result was queued
+                item.state, item.error, item.processed_at = REJECTED, "Patient not found", now
+
+        if accepted:
+            dates = [datetime.fromisoformat(item.payload["date_conducted"]) for item in accepted]
+            statuses = get_result_statuses(
+                [(item.payload["parameter"], item.payload["result_values"]) for item in accepted],
+                sexes=[patients[item.payload["patient_id"]].gender for item in accepted],
+                ages=[age_in_years(patients[item.payload["patient_id"]].dob, d) for item, d in zip(accepted, dates)],
+            )
+            rows = [{
+                "parameter": item.payload["parameter"],
+                "result_values": item.payload["result_values"],
+                "patient_id": item.payload["patient_id"],
+                "flagged": status != "Normal",
+                "status": status,
+                "date_conducted": date_conducted,
+                **typed_values(item.payload["result_values"]),
+            } for item, status, date_conducted in zip(accepted, statuses, dates)]
+            ids = insert_lab_tests(rows, {pid: p.created_by for pid, p in patients.items()})
+            for item, test_id in zip(accepted, ids):
+                item.state, item.lab_test_id, item.processed_at = DONE, test_id, now
+        return len(accepted), len(items) - len(accepted)
+
+    def _refresh_backlog(self):
+        count, oldest = db.session.query(func.count(IngestItem.id), func.min(IngestItem.created_at)).filter(
+            IngestItem.state == PENDING
+        ).one()
+        self.backlog, self.oldest_pending_at = count, oldest
+        db.session.commit()
+
+    def _prune(self, retention_hours):
+        """
+        Drops processed items once their idempotency keys no longer need to be honoured.
+        """
+        IngestItem.query.filter(
+            IngestItem.state != PENDING,
+            IngestItem.processed_at < datetime.utcnow() - timedelta(hours=retention_hours),
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        self._last_prune = time.monotonic()
+
+    def stats(self):
+        lag = (datetime.utcnow() - self.oldest_pending_at).total_seconds() if self.oldest_pending_at else 0.0
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "backlog": self.backlog,
+            "enqueued_since_drain": self._since_drain,
+            "oldest_pending_seconds": round(lag, 3),
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "refused_full": self.refused,
+            "batches": self.batches,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "avg_batch_size": round((self.processed + self.rejected) / self.batches, 1) if self.batches else None,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": self.last_batch_ms,
+            "last_error": self.last_error,
+        }
+
+worker = IngestWorker()
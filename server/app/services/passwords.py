@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from functools import lru_cache
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"
+DEFAULT_MAX_PENDING = 32
+DEFAULT_TIMEOUT_SECONDS = 10.0
+
+class HashPoolBusy(Exception):
+    """Raised when too many hash/verify calls are already queued."""
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification on a bounded process pool.
+
+    scrypt/pbkdf2 are deliberately slow, and on the request thread a burst
+    of logins holds the GIL and starves every other request in the worker.
+    Here the work runs in separate processes while the request thread waits
+    without the GIL. At most PASSWORD_HASH_MAX_PENDING calls may be queued
+    or running; beyond that callers get HashPoolBusy (a 503) right away
+    instead of stalling. PASSWORD_HASH_WORKERS=0 hashes inline.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._slots = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def _config(self, key, default):
+        return current_app.config.get(key, default)
+
+    def method(self):
+        return self._config("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD)
+
+    def _workers(self):
+        workers = self._config("PASSWORD_HASH_WORKERS", None)
+        if workers is None:
+            workers = max((os.cpu_count() or 2) // 2, 1)
+        return workers
+
+    def _executor(self):
+        # A pool inherited across a fork (e.g. gunicorn --preload) is unusable,
+        # so each worker process starts its own on first use
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers(),
+                    # spawn: forking a multi-threaded server process is unsafe
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._pool_pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(
+                    self._config("PASSWORD_HASH_MAX_PENDING", DEFAULT_MAX_PENDING)
+                )
+            return self._pool, self._slots
+
+    def _run(self, fn, *args):
+        if self._workers() == 0:
+            self.completed += 1
+            return fn(*args)
+        pool, slots = self._executor()
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashPoolBusy("Too many password operations in progress")
+        self.pending += 1
+        try:
+            future = pool.submit(fn, *args)
+        except Exception:
+            self._release(slots)
+            raise
+        # The slot is held until the pool finishes, not until the caller gives
+        # up waiting, so timed-out calls still count against the limit
+        future.add_done_callback(lambda _: self._release(slots))
+        try:
+            result = future.result(
+                timeout=self._config("PASSWORD_HASH_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS)
+            )
+        except FuturesTimeout:
+            raise HashPoolBusy("Password operation timed out")
+        self.completed += 1
+        return result
+
+    def _release(self, slots):
+        self.pending -= 1
+        slots.release()
+
+    def hash(self, password):
+        """
+        Returns a werkzeug hash of `password` using PASSWORD_HASH_METHOD.
+        """
+        return self._run(generate_password_hash, password, self.method())
+
+    def verify(self, stored_hash, password):
+        """
+        Returns True if `password` matches `stored_hash`.
+        """
+        return self._run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """
+        Returns True if `stored_hash` was made with other parameters than the configured method.
+        """
+        return stored_hash.split("$", 1)[0] != _canonical_method(self.method())
+
+    def stats(self):
+        return {
+            "workers": self._workers(),
+            "method": self.method(),
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+@lru_cache(maxsize=8)
+def _canonical_method(method):
+    # werkzeug fills in defaults ("scrypt" -> "scrypt:32768:8:1"); the cheapest
+    # way to get the same spelling is to look at one hash of an empty string
+    return generate_password_hash("", method).split("$", 1)[0]
+
+hasher = PasswordHasher()
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import current_app, jsonify
+from flask_jwt_extended import get_jwt_identity
+from ..extensions import db
+from ..models.user import User
+from .versions import bump_version, get_version
+
+USERS_TABLE = User.__tablename__
+DEFAULT_TTL_SECONDS = 60.0
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_VERSION_CHECK_SECONDS = 5.0
+
+Principal = namedtuple("Principal", ["id", "name", "email", "role"])
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a fixed TTL.
+
+    Each worker keeps its own copy. Writers bump the `users` table version
+    (in the same transaction as the change), and every worker compares
+    versions at most once every PRINCIPAL_CACHE_VERSION_CHECK_SECONDS,
+    clearing itself when the version moved. Between checks an entry is
+    served without touching the database.
+    """
+
+    def __init__(self, ttl_key, size_key):
+        self._ttl_key = ttl_key
+        self._size_key = size_key
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _sync(self, now):
+        interval = current_app.config.get("PRINCIPAL_CACHE_VERSION_CHECK_SECONDS", DEFAULT_VERSION_CHECK_SECONDS)
+        if self._version is not None and now - self._checked_at < interval:
+            return
+        version = get_version(USERS_TABLE)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked_at = now
+
+    def get_or_load(self, key, load):
+        """
+        Returns the cached value for `key`, calling `load()` on a miss.
+        None results are not cached.
+        """
+        now = time.monotonic()
+        self._sync(now)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expired += 1
+            self.misses += 1
+
+        value = load()
+        if value is None:
+            return None
+        ttl = current_app.config.get(self._ttl_key, DEFAULT_TTL_SECONDS)
+        max_entries = current_app.config.get(self._size_key, DEFAULT_MAX_ENTRIES)
+        with self._lock:
+            self._entries[key] = (value, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            # Re-read the version on the next lookup, after the writer commits
+            self._checked_at = 0.0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+principal_cache = TTLCache("PRINCIPAL_CACHE_TTL_SECONDS", "PRINCIPAL_CACHE_SIZE")
+user_list_cache = TTLCache("PRINCIPAL_CACHE_TTL_SECONDS", "USER_LIST_CACHE_SIZE")
+
+def invalidate_users():
+    """
+    Marks users as changed. Call before committing a register or role change
+    so the version bump lands in the same transaction.
+    """
+    bump_version(USERS_TABLE)
+    principal_cache.clear()
+    user_list_cache.clear()
+
+def _load_principal(user_id):
+    row = db.session.query(User.id, User.name, User.email, User.role).filter(User.id == user_id).first()
+    return Principal(*row) if row else None
+
+def get_principal(user_id):
+    """
+    Returns the Principal for a user id, or None if there is no such user.
+    """
+    return principal_cache.get_or_load(user_id, lambda: _load_principal(user_id))
+
+def current_principal():
+    """
+    Returns the Principal behind the request's JWT identity, or None.
+    """
+    identity = get_jwt_identity()
+    user_id = identity.get("id") if isinstance(identity, dict) else identity
+    if user_id is None:
+        return None
+    try:
+        return get_principal(int(user_id))
+    except (TypeError, ValueError):
+        return None
+
+def role_required(*roles):
+    """
+    Route decorator (inside @jwt_required) that rejects users whose current role is not in `roles`.
+    The role is read from the principal cache, not the token, so demotions apply without re-login.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            principal = current_principal()
+            if principal is None:
+                return jsonify({"msg": "User not found"}), 401
+            if principal.role not in roles:
+                return jsonify({"msg": "Insufficient permissions"}), 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
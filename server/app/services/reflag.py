@@ -0,0 +1,270 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import case, func, literal, update
+from ..extensions import db
+from ..models.lab_panel import LabPanel
+from ..models.lab_test import LabTest
+from ..models.patient import Patient
+from . import counters
+from .versions import bump_version
+from .flagging import NORMAL, STATUS_LABELS, age_in_years, classify_codes, range_cache
+
+DEFAULT_CHUNK_SIZE = 20000
+MAX_CHUNK_SIZE = 100000
+LAB_TESTS_TABLE = LabTest.__tablename__
+MAX_TRACKED_JOBS = 50
+
+def status_expression(ref):
+    """
+    SQL equivalent of flagging.classify_batch for one resolved range.
+    """
+    if ref is None:
+        return literal("Unknown")
+    return case(
+        (LabTest.value_numeric.is_(None), "Unknown"),
+        (LabTest.value_numeric < ref.normal_min, "Low"),
+        (LabTest.value_numeric > ref.normal_max, "High"),
+        else_="Normal",
+    )
+
+class ReflagJob:
+    """
+    Recomputes `flagged` and `status` for stored results after ranges change.
+
+    Work is done per parameter in id-ranged chunks, each committed separately,
+    so no lock is held for longer than one chunk. Parameters with a single
+    range use a set-based UPDATE; parameters with sex/age bands or ranges for
+    several test types are classified in vectorized batches and written back
+    with one bulk UPDATE per chunk.
+    A dry run only counts the rows whose flag would flip.
+
+    Other workers keep flagging new results against their cached ranges
+    until their next version check, so once that interval has passed the
+    job re-scans the rows written since it started. Jobs in one worker run
+    one at a time.
+    """
+
+    def __init__(self, parameters=None, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.id = uuid.uuid4().hex
+        self.parameters = parameters
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.state = "pending"
+        self.error = None
+        self.total = 0
+        self.processed = 0
+        self.updated = 0
+        self.flipped = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def _write(self, where, new_status):
+        """
+        Writes `new_status` (a SQL expression) and its flag to the rows matching
+        `where`. Returns the number of rows changed.
+
+        Counter deltas come from the rows each UPDATE actually flipped, via
+        RETURNING: a row another job flipped first no longer matches the WHERE
+        clause once its lock is released, so it is never counted twice.
+        """
+        new_flagged = new_status != "Normal"
+        deltas = defaultdict(int)
+        flips = []
+        for flip, delta in ((new_flagged & LabTest.flagged.isnot(True), 1),
+                            (~new_flagged & LabTest.flagged.is_(True), -1)):
+            rows = db.session.execute(
+                update(LabTest).where(*where, flip).values(flagged=new_flagged, status=new_status)
+                .returning(LabTest.patient_id, LabTest.date_conducted),
+                execution_options={"synchronize_session": False},
+            ).all()
+            flips.extend((row, delta) for row in rows)
+        # Status-only changes (and NULL flags) carry no counter delta
+        restated = db.session.execute(
+            update(LabTest).where(
+                *where, LabTest.flagged.is_distinct_from(new_flagged) | LabTest.status.is_distinct_from(new_status),
+            ).values(flagged=new_flagged, status=new_status),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+
+        if flips:
+            creators = dict(db.session.query(Patient.id, Patient.created_by).filter(
+                Patient.id.in_({row.patient_id for row, _ in flips})
+            ))
+            for row, delta in flips:
+                day = row.date_conducted.date() if row.date_conducted else None
+                deltas[(creators.get(row.patient_id), day)] += delta
+            counters.record_many(
+                (created_by, day, 0, 0, delta) for (created_by, day), delta in deltas.items() if delta
+            )
+        self.flipped += len(flips)
+        return len(flips) + restated
+
+    def _chunk(self, parameter, new_status, lo, hi, since=None):
+        in_chunk = (LabTest.parameter == parameter, LabTest.id >= lo, LabTest.id < hi)
+        if since is not None:
+            in_chunk += (LabTest.updated_at >= since,)
+
+        if self.dry_run:
+            would_flip = case(
+                ((new_status == "Normal") & LabTest.flagged.is_(True), 1),
+                ((new_status != "Normal") & LabTest.flagged.isnot(True), 1),
+                else_=0,
+            )
+            count, flips = db.session.query(func.count(LabTest.id), func.sum(would_flip)).filter(*in_chunk).one()
+            self.processed += count
+            self.flipped += int(flips or 0)
+            return
+
+        self.processed += db.session.query(func.count(LabTest.id)).filter(*in_chunk).scalar()
+        updated = self._write(in_chunk, new_status)
+        if updated:
+            bump_version(LAB_TESTS_TABLE)
+        db.session.commit()
+        self.updated += updated
+
+    def _chunk_banded(self, parameter, lo, hi, since=None):
+        in_chunk = (LabTest.parameter == parameter, LabTest.id >= lo, LabTest.id < hi)
+        if since is not None:
+            in_chunk += (LabTest.updated_at >= since,)
+        rows = db.session.query(
+            LabTest.id,
+            LabTest.value_numeric,
+            LabTest.flagged,
+            LabTest.status,
+            LabTest.date_conducted,
+            Patient.gender,
+            Patient.dob,
+            LabPanel.test_type,
+        ).join(Patient, Patient.id == LabTest.patient_id).outerjoin(
+            LabPanel, LabPanel.id == LabTest.panel_id,
+        ).filter(*in_chunk).all()
+        if not rows:
+            return
+        self.processed += len(rows)
+
+        values = np.array([r.value_numeric if r.value_numeric is not None else np.nan for r in rows])
+        ages = [age_in_years(r.dob, r.date_conducted) if r.date_conducted else None for r in rows]
+        codes = classify_codes([parameter] * len(rows), values, [r.gender for r in rows], ages,
+                               [r.test_type for r in rows])
+        statuses = STATUS_LABELS[codes]
+
+        # The ids to move to each status; the UPDATEs re-check the current flag
+        changes = defaultdict(list)
+        for r, status in zip(rows, statuses):
+            if r.flagged is (status != "Normal") and r.status == status:
+                continue
+            changes[status].append(r.id)
+            if self.dry_run and bool(r.flagged) != (status != "Normal"):
+                self.flipped += 1
+        if self.dry_run or not changes:
+            return
+
+        updated = sum(self._write((LabTest.id.in_(ids),), literal(status)) for status, ids in changes.items())
+        if updated:
+            bump_version(LAB_TESTS_TABLE)
+        db.session.commit()
+        self.updated += updated
+
+    def _pass(self, parameters, since=None):
+        # Compare versions now rather than trusting a copy loaded before the edit committed
+        ranges = range_cache.snapshot(force=True)
+        banded = range_cache.table(lookups=0).banded
+        for parameter in parameters:
+            new_status = status_expression(ranges.get(parameter))
+            query = db.session.query(func.min(LabTest.id), func.max(LabTest.id)).filter(LabTest.parameter == parameter)
+            if since is not None:
+                query = query.filter(LabTest.updated_at >= since)
+            lo, hi = query.one()
+            if lo is None:
+                continue
+            for start in range(lo, hi + 1, self.chunk_size):
+                end = min(start + self.chunk_size, hi + 1)
+                if parameter in banded:
+                    self._chunk_banded(parameter, start, end, since)
+                else:
+                    self._chunk(parameter, new_status, start, end, since)
+
+    def run(self):
+        self.state = "running"
+        self.started_at = datetime.utcnow()
+        started = time.monotonic()
+        try:
+            parameters = self.parameters
+            if not parameters:
+                parameters = [row[0] for row in db.session.query(LabTest.parameter).distinct()]
+            self.total = db.session.query(func.count(LabTest.id)).filter(
+                LabTest.parameter.in_(parameters)
+            ).scalar()
+            with _run_lock:
+                self._pass(parameters)
+
+            if not self.dry_run:
+                # Wait out the other workers' version check, then fix what they
+                # flagged with the old ranges in the meantime
+                interval = range_cache.check_interval()
+                time.sleep(max(interval - (time.monotonic() - started), 0))
+                with _run_lock:
+                    self._pass(parameters, since=self.started_at - timedelta(seconds=interval))
+            self.state = "done"
+        except Exception as e:
+            db.session.rollback()
+            self.state = "failed"
+            self.error = str(e)
+            print(f"Reflag job {self.id} error: {str(e)}")
+        finally:
+            self.finished_at = datetime.utcnow()
+            db.session.remove()
+
+    def progress(self):
+        elapsed = ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds() if self.started_at else 0
+        return {
+            "id": self.id,
+            "state": self.state,
+            "dry_run": self.dry_run,
+            "parameters": self.parameters,
+            "total": self.total,
+            "processed": self.processed,
+            "updated": self.updated,
+            "would_flip" if self.dry_run else "flipped": self.flipped,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.processed / elapsed, 1) if elapsed else None,
+            "error": self.error,
+        }
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+# Held during each pass, so a worker never rewrites lab_tests from two jobs at once
+_run_lock = threading.Lock()
+
+def active_job():
+    """
+    Returns a pending or running job of this worker, or None.
+    """
+    with _jobs_lock:
+        return next((job for job in _jobs.values() if job.state in ("pending", "running")), None)
+
+def start_job(app, parameters=None, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Runs a ReflagJob on a background thread and returns it immediately.
+    Its passes wait for any other job's pass in this worker to finish first.
+    """
+    job = ReflagJob(parameters=parameters, dry_run=dry_run, chunk_size=min(chunk_size, MAX_CHUNK_SIZE))
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > MAX_TRACKED_JOBS:
+            _jobs.popitem(last=False)
+
+    def target():
+        with app.app_context():
+            job.run()
+
+    threading.Thread(target=target, name=f"reflag-{job.id}", daemon=True).start()
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
@@ -0,0 +1,488 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+from functools import lru_cache
+from operator import attrgetter
+import orjson
+from flask import current_app
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from ..extensions import db
+from ..models import LabPanel, LabTest, Patient
+from .flagging import age_in_years, range_cache
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates", "reports")
+TEMPLATE_NAME = "lab_report.html"
+FORMATS = ("html", "pdf")
+KINDS = ("patient", "accession")
+MIMETYPES = {"html": "text/html", "pdf": "application/pdf"}
+MARKERS = {"High": "H", "Low": "L"}
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "labtracker-reports")
+DEFAULT_CHUNK_SIZE = 5000
+# Reports sent to a pool worker per task, and tasks kept in flight per worker
+RENDER_CHUNK = 25
+TASKS_PER_WORKER = 4
+MAX_TRACKED_JOBS = 50
+MAX_REPORTED_ERRORS = 20
+
+def _require_weasyprint():
+    try:
+        import weasyprint
+    except ImportError:
+        raise RuntimeError("PDF reports need weasyprint (pip install weasyprint)")
+    return weasyprint
+
+@lru_cache(maxsize=1)
+def _template():
+    # Compiled once per process and never re-checked against the source,
+    # so a render is just a call into the generated code
+    env = Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(["html"]),
+        auto_reload=False,
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    return env.get_template(TEMPLATE_NAME)
+
+@lru_cache(maxsize=1)
+def template_digest():
+    """
+    Hash of the template source; part of every report's content hash so a
+    template change re-renders everything.
+    """
+    with open(os.path.join(TEMPLATE_DIR, TEMPLATE_NAME), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def content_hash(context, fmt):
+    """
+    Cache key of a report: its data, the template and the output format.
+    """
+    payload = orjson.dumps(context, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(b"|".join([template_digest().encode(), fmt.encode(), payload])).hexdigest()
+
+def cache_path(root, digest, fmt):
+    return os.path.join(root, digest[:2], f"{digest}.{fmt}")
+
+def _write_atomic(path, body):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(body)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+def render(context, fmt):
+    """
+    Renders one report context to HTML or PDF bytes.
+    """
+    html = _template().render(**context)
+    if fmt == "pdf":
+        return _require_weasyprint().HTML(string=html).write_pdf()
+    return html.encode("utf-8")
+
+def _render_chunk(root, fmt, items):
+    """
+    Pool task: renders (digest, context) pairs into the cache. Returns
+    (rendered, bytes, errors) so one bad report does not fail the others.
+    """
+    rendered, written, errors = 0, 0, []
+    for digest, context in items:
+        path = cache_path(root, digest, fmt)
+        if os.path.exists(path):
+            continue
+        try:
+            body = render(context, fmt)
+            _write_atomic(path, body)
+            rendered += 1
+            written += len(body)
+        except Exception as e:
+            errors.append(f"{context['report_key']}: {str(e)}")
+    return rendered, written, errors
+
+def _warm_worker():
+    _template()
+
+class ReportRenderer:
+    """
+    Renders reports into a content-addressed file cache.
+
+    A report's cache key is the hash of its data (results, statuses, the
+    reference ranges in force, patient details), the template and the
+    format, so unchanged reports are served from disk and any change to
+    the underlying results gets a new file. Batches render on a process
+    pool; REPORT_WORKERS=0 renders in-process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.rendered = 0
+        self.failed = 0
+
+    def _workers(self):
+        workers = current_app.config.get("REPORT_WORKERS", None)
+        if workers is None:
+            workers = max((os.cpu_count() or 2) // 2, 1)
+        return workers
+
+    def cache_dir(self):
+        return current_app.config.get("REPORT_CACHE_DIR") or DEFAULT_CACHE_DIR
+
+    def _executor(self):
+        # Like the password hashing pool: one per worker process, spawned, not forked
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers(),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_worker,
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _cached(self, path):
+        if not os.path.exists(path):
+            self.misses += 1
+            return False
+        self.hits += 1
+        # Hits refresh the mtime so prune() only drops reports nobody asks for
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def get(self, context, fmt):
+        """
+        Returns (path, digest) of one report's file, rendering it on this
+        thread only when the cache has no copy.
+        """
+        digest = content_hash(context, fmt)
+        path = cache_path(self.cache_dir(), digest, fmt)
+        if not self._cached(path):
+            _write_atomic(path, render(context, fmt))
+            self.rendered += 1
+        return path, digest
+
+    def render_all(self, contexts, fmt, job):
+        """
+        Renders every context not already cached, recording progress on `job`.
+        Keeps a bounded number of pool tasks in flight, so the contexts can
+        be a stream and memory stays flat however many reports there are.
+        """
+        if fmt == "pdf":
+            _require_weasyprint()
+        root = self.cache_dir()
+        workers = self._workers()
+        pool = self._executor() if workers else None
+        in_flight, chunk = set(), []
+
+        def record(rendered, written, errors):
+            job.record(rendered, written, errors)
+            self.rendered += rendered
+            self.failed += len(errors)
+
+        def collect(futures):
+            for future in futures:
+                try:
+                    record(*future.result())
+                except Exception as e:
+                    record(0, 0, [str(e)])
+
+        def submit(items):
+            if pool is None:
+                record(*_render_chunk(root, fmt, items))
+                return
+            if len(in_flight) >= workers * TASKS_PER_WORKER:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                in_flight.difference_update(done)
+                collect(done)
+            in_flight.add(pool.submit(_render_chunk, root, fmt, items))
+
+        for context in contexts:
+            job.total += 1
+            digest = content_hash(context, fmt)
+            if self._cached(cache_path(root, digest, fmt)):
+                job.cached += 1
+                continue
+            chunk.append((digest, context))
+            if len(chunk) >= RENDER_CHUNK:
+                submit(chunk)
+                chunk = []
+        if chunk:
+            submit(chunk)
+        if in_flight:
+            collect(wait(in_flight).done)
+
+    def prune(self, max_age_days):
+        """
+        Deletes cached reports not rendered or served in `max_age_days`. Returns the count.
+        """
+        root = self.cache_dir()
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for directory, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "workers": self._workers(),
+            "cache_dir": self.cache_dir(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "rendered": self.rendered,
+            "failed": self.failed,
+        }
+
+renderer = ReportRenderer()
+
+def _results_query(user_id=None):
+    query = db.session.query(
+        LabTest.id,
+        LabTest.patient_id,
+        LabTest.panel_id,
+        LabTest.parameter,
+        LabTest.result_values,
+        LabTest.unit,
+        LabTest.value_numeric,
+        LabTest.status,
+        LabTest.date_conducted,
+        Patient.name,
+        Patient.dob,
+        Patient.gender,
+        LabPanel.accession,
+        LabPanel.test_type,
+    ).join(Patient, Patient.id == LabTest.patient_id).outerjoin(LabPanel, LabPanel.id == LabTest.panel_id)
+    if user_id is not None:
+        query = query.filter(Patient.created_by == user_id)
+    return query
+
+def _window(query, column, date_from, date_to):
+    if date_from:
+        query = query.filter(column >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.filter(column < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return query
+
+def _status(value, band):
+    # Rows flagged before statuses were stored
+    if value is None or band is None:
+        return "Unknown"
+    if value < band.normal_min:
+        return "Low"
+    if value > band.normal_max:
+        return "High"
+    return "Normal"
+
+def _result(table, row):
+    age = age_in_years(row.dob, row.date_conducted) if row.date_conducted else None
+    band_row = table.resolve_one(row.parameter, row.gender, age, row.test_type)
+    band = table.bands[band_row] if band_row >= 0 else None
+    values = row.result_values if isinstance(row.result_values, dict) else {}
+    status = row.status or _status(row.value_numeric, band)
+    return {
+        "id": row.id,
+        "parameter": row.parameter,
+        "value": values.get("value"),
+        "unit": row.unit or values.get("unit"),
+        "status": status,
+        "marker": MARKERS.get(status, ""),
+        "normal_min": band.normal_min if band else None,
+        "normal_max": band.normal_max if band else None,
+        "range_units": band.units if band else None,
+        "date_conducted": row.date_conducted.strftime("%Y-%m-%d %H:%M") if row.date_conducted else None,
+        "accession": row.accession,
+    }
+
+def _context(kind, head, results, period):
+    if kind == "accession":
+        title = f"{head.test_type} report"
+        report_key = f"accession-{head.accession}"
+    else:
+        title = "Laboratory report"
+        report_key = f"patient-{head.patient_id}"
+        if period:
+            report_key += f"-{period['start'] or ''}-{period['end'] or ''}"
+    return {
+        "kind": kind,
+        "report_key": report_key,
+        "title": title,
+        "patient": {
+            "id": head.patient_id,
+            "name": head.name,
+            "dob": head.dob.isoformat() if head.dob else None,
+            "gender": head.gender,
+        },
+        "accession": head.accession if kind == "accession" else None,
+        "test_type": head.test_type if kind == "accession" else None,
+        "period": period,
+        "results": results,
+        "abnormal_count": sum(1 for r in results if r["marker"]),
+    }
+
+def _contexts(rows, kind, key_of, period=None):
+    """
+    Groups rows ordered by report into one context per report.
+    """
+    table = range_cache.table(lookups=0)
+    current, head, results = None, None, []
+    for row in rows:
+        key = key_of(row)
+        if results and key != current:
+            yield _context(kind, head, results, period)
+            results = []
+        if not results:
+            current, head = key, row
+        results.append(_result(table, row))
+    if results:
+        yield _context(kind, head, results, period)
+
+def patient_reports(user_id=None, patient_ids=None, date_from=None, date_to=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields one report context per patient with results conducted between
+    `date_from` and `date_to` (dates, inclusive), reading rows in chunks.
+    """
+    query = _window(_results_query(user_id), LabTest.date_conducted, date_from, date_to)
+    if patient_ids is not None:
+        query = query.filter(LabTest.patient_id.in_(patient_ids))
+    rows = query.order_by(LabTest.patient_id, LabTest.date_conducted, LabTest.id).yield_per(chunk_size)
+    period = None
+    if date_from or date_to:
+        period = {
+            "start": date_from.isoformat() if date_from else None,
+            "end": date_to.isoformat() if date_to else None,
+        }
+    return _contexts(rows, "patient", attrgetter("patient_id"), period)
+
+def accession_reports(user_id=None, accessions=None, date_from=None, date_to=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields one report context per panel (accession) conducted between
+    `date_from` and `date_to` (dates, inclusive).
+    """
+    query = _window(_results_query(user_id).filter(LabTest.panel_id.isnot(None)),
+                    LabPanel.date_conducted, date_from, date_to)
+    if accessions is not None:
+        query = query.filter(LabPanel.accession.in_(accessions))
+    rows = query.order_by(LabTest.panel_id, LabTest.id).yield_per(chunk_size)
+    return _contexts(rows, "accession", attrgetter("panel_id"))
+
+class ReportJob:
+    """
+    One batch of reports rendered in the background, with its progress.
+    """
+
+    def __init__(self, kind, fmt, user_id=None, date_from=None, date_to=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.format = fmt
+        self.user_id = user_id
+        self.date_from = date_from
+        self.date_to = date_to
+        self.state = "queued"
+        self.total = 0
+        self.cached = 0
+        self.rendered = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.errors = []
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, rendered, written, errors):
+        self.rendered += rendered
+        self.bytes_written += written
+        self.failed += len(errors)
+        self.errors.extend(errors[:MAX_REPORTED_ERRORS - len(self.errors)])
+
+    def contexts(self):
+        collect = patient_reports if self.kind == "patient" else accession_reports
+        return collect(user_id=self.user_id, date_from=self.date_from, date_to=self.date_to)
+
+    def run(self):
+        self.state = "running"
+        self.started_at = datetime.utcnow()
+        try:
+            renderer.render_all(self.contexts(), self.format, self)
+            self.state = "done"
+        except Exception as e:
+            db.session.rollback()
+            self.state = "failed"
+            self.error = str(e)
+            print(f"Report job {self.id} error: {str(e)}")
+        finally:
+            self.finished_at = datetime.utcnow()
+        return self
+
+    def progress(self):
+        elapsed = ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds() if self.started_at else 0
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "format": self.format,
+            "date_from": self.date_from.isoformat() if self.date_from else None,
+            "date_to": self.date_to.isoformat() if self.date_to else None,
+            "state": self.state,
+            "total": self.total,
+            "cached": self.cached,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "bytes_written": self.bytes_written,
+            "errors": self.errors,
+            "error": self.error,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "elapsed_seconds": round(elapsed, 3),
+            "reports_per_second": round(self.total / elapsed, 1) if elapsed else None,
+        }
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+def start_job(app, kind, fmt, user_id=None, date_from=None, date_to=None):
+    """
+    Renders a batch of reports on a background thread and returns the job immediately.
+    """
+    job = ReportJob(kind, fmt, user_id, date_from, date_to)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > MAX_TRACKED_JOBS:
+            _jobs.popitem(last=False)
+
+    def target():
+        with app.app_context():
+            try:
+                job.run()
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=target, name=f"reports-{job.id}", daemon=True).start()
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
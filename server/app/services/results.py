@@ -0,0 +1,33 @@
+from ..extensions import db
+from ..models.lab_test import LabTest
+from . import counters, events
+from .versions import bump_after_commit
+
+LAB_TESTS_TABLE = LabTest.__tablename__
+
+def insert_lab_tests(rows, creators):
+    """
+    Writes already-flagged lab_tests rows inside the current transaction; the
+    caller commits.
+
+    One batched INSERT for all rows, plus their dashboard counter deltas,
+    flagged-result events and a lab_tests version bump once the caller commits. `creators` maps
+    each patient id to its created_by. Returns the new ids in row order.
+    """
+    if not rows:
+        return []
+    ids = db.session.execute(
+        LabTest.__table__.insert().returning(LabTest.__table__.c.id, sort_by_parameter_order=True), rows,
+    ).scalars().all()
+    counters.record_many(
+        (creators[row["patient_id"]], row["date_conducted"].date(), 0, 1, int(row["flagged"])) for row in rows
+    )
+    bump_after_commit(LAB_TESTS_TABLE)
+    events.stage_flagged(
+        events.flagged_event(
+            test_id, row["patient_id"], creators[row["patient_id"]], row["parameter"],
+            row["result_values"], row["status"], row["date_conducted"],
+        )
+        for test_id, row in zip(ids, rows) if row["flagged"]
+    )
+    return ids
@@ -0,0 +1,202 @@
+import heapq
+import re
+import threading
+from datetime import date
+from flask import current_app
+from sqlalchemy import and_, case, func, or_, true
+from ..extensions import db
+from ..models import Patient, TestReferenceRange
+from .versions import get_version
+
+MAX_QUERY_LENGTH = 100
+MAX_TOKENS = 5
+# "1980", "1980-01" or "1980-01-02" search date of birth instead of names
+DATE_TOKEN = re.compile(r"^(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?$")
+
+def backend():
+    """
+    Returns "postgres" (ILIKE served by pg_trgm GIN indexes) or "memory"
+    (per-worker suffix tries, for SQLite test runs).
+    """
+    configured = current_app.config.get("SEARCH_BACKEND", "auto")
+    if configured == "auto":
+        return "postgres" if db.engine.dialect.name == "postgresql" else "memory"
+    return configured
+
+def tokenize(q):
+    """
+    Splits a query into (name_tokens, dob_ranges); dob ranges are [start, end).
+    """
+    names, dates = [], []
+    for token in (q or "").lower()[:MAX_QUERY_LENGTH].split()[:MAX_TOKENS]:
+        match = DATE_TOKEN.match(token)
+        if match:
+            year, month, day = (int(part) if part else None for part in match.groups())
+            try:
+                if day:
+                    start = date(year, month, day)
+                    dates.append((start, date.fromordinal(start.toordinal() + 1)))
+                elif month:
+                    dates.append((date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)))
+                else:
+                    dates.append((date(year, 1, 1), date(year + 1, 1, 1)))
+                continue
+            except ValueError:
+                pass
+        names.append(token)
+    return names, dates
+
+def _like(token):
+    return token.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+class SuffixTrie:
+    """
+    Every suffix of every word, so a token found at a node is a substring
+    of the words below it. Each node keeps the ids of the rows it came from.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, text, row_id):
+        for word in text.lower().split():
+            for start in range(len(word)):
+                node = self.root
+                for char in word[start:]:
+                    node = node.setdefault(char, {})
+                    node.setdefault(None, set()).add(row_id)
+
+    def find(self, token):
+        node = self.root
+        for char in token:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get(None, set())
+
+class TrieIndex:
+    """
+    Per-worker tries over one text column, rebuilt when the table's change
+    version moves. Rows can be split into one trie per `partition` key
+    (e.g. patient creator) so a lookup only touches the caller's rows.
+    """
+
+    def __init__(self, table_name, load, partition=None):
+        self.table_name = table_name
+        self.load = load
+        self.partition = partition or (lambda row: None)
+        self._lock = threading.Lock()
+        self._version = None
+        self._tries = {}
+        self._rows = {}
+
+    def _sync(self):
+        version = get_version(self.table_name)
+        with self._lock:
+            if version == self._version:
+                return
+            tries, rows = {}, {}
+            for row in self.load():
+                key = self.partition(row)
+                if key not in tries:
+                    tries[key], rows[key] = SuffixTrie(), {}
+                tries[key].add(row[1], row[0])
+                rows[key][row[0]] = row
+            self._tries, self._rows, self._version = tries, rows, version
+
+    def match(self, tokens, key=None):
+        """
+        Rows of partition `key` containing every token.
+        """
+        self._sync()
+        rows = self._rows.get(key, {})
+        if not tokens:
+            return list(rows.values())
+        trie = self._tries.get(key)
+        ids = None
+        for token in tokens:
+            found = trie.find(token) if trie else set()
+            ids = set(found) if ids is None else ids & found
+            if not ids:
+                return []
+        return [rows[i] for i in ids]
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+
+patient_index = TrieIndex(
+    Patient.__tablename__,
+    lambda: db.session.query(Patient.id, Patient.name, Patient.dob, Patient.created_by).all(),
+    partition=lambda row: row.created_by,
+)
+range_index = TrieIndex(
+    TestReferenceRange.__tablename__,
+    lambda: db.session.query(TestReferenceRange.id, TestReferenceRange.parameter).all(),
+)
+
+def _rank(name, names):
+    """
+    0: the name starts with the query, 1: a word starts with its first
+    token, 2: substring matches only.
+    """
+    name = (name or "").lower()
+    if name.startswith(" ".join(names)):
+        return 0
+    if any(word.startswith(names[0]) for word in name.split()):
+        return 1
+    return 2
+
+def search_patients(user_id, q, page, per_page):
+    """
+    Ranked page of the caller's patients matching every token of `q`
+    (name substrings, or dates of birth). Returns (rows, has_next).
+    """
+    names, dates = tokenize(q)
+    if not names and not dates:
+        return [], False
+    offset = (page - 1) * per_page
+    columns = (Patient.id, Patient.name, Patient.dob, Patient.gender, Patient.created_by)
+
+    if backend() == "postgres":
+        query = db.session.query(*columns).filter(Patient.created_by == user_id)
+        for token in names:
+            query = query.filter(Patient.name.ilike(f"%{_like(token)}%", escape="\\"))
+        for start, end in dates:
+            query = query.filter(Patient.dob >= start, Patient.dob < end)
+        order = [Patient.name, Patient.id]
+        if names:
+            first = _like(names[0])
+            rank = case(
+                (Patient.name.ilike(f"{_like(' '.join(names))}%", escape="\\"), 0),
+                (or_(Patient.name.ilike(f"{first}%", escape="\\"),
+                     Patient.name.ilike(f"% {first}%", escape="\\")), 1),
+                else_=2,
+            )
+            order = [rank, func.similarity(Patient.name, " ".join(names)).desc()] + order
+        rows = query.order_by(*order).offset(offset).limit(per_page + 1).all()
+        return rows[:per_page], len(rows) > per_page
+
+    matches = patient_index.match(names, user_id)
+    if dates:
+        matches = [row for row in matches if all(start <= row.dob < end for start, end in dates)]
+    if names:
+        key = lambda row: (_rank(row.name, names), row.name, row.id)
+    else:
+        key = lambda row: (row.name, row.id)
+    # Only rank as far as the requested page (plus one row to know if there is a next one)
+    ranked = heapq.nsmallest(offset + per_page + 1, matches, key=key)
+    page_ids = [row.id for row in ranked[offset:offset + per_page]]
+    by_id = {row.id: row for row in db.session.query(*columns).filter(Patient.id.in_(page_ids))}
+    return [by_id[i] for i in page_ids if i in by_id], len(ranked) > offset + per_page
+
+def parameter_filter(q):
+    """
+    Filter clause for reference ranges whose parameter contains every token of `q`.
+    """
+    tokens = (q or "").lower()[:MAX_QUERY_LENGTH].split()[:MAX_TOKENS]
+    if not tokens:
+        return true()
+    if backend() == "postgres":
+        return and_(*[TestReferenceRange.parameter.ilike(f"%{_like(t)}%", escape="\\") for t in tokens])
+    return TestReferenceRange.id.in_(sorted(row.id for row in range_index.match(tokens)))
@@ -0,0 +1,247 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from ..extensions import db
+from ..models.lab_panel import LabPanel
+from ..models.lab_test import LabTest
+from ..models.patient import Patient
+from .flagging import range_cache, age_in_years
+
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_SETTLE_SECONDS = 5
+DEFAULT_OVERLAP_SECONDS = 300
+MANIFEST_NAME = "_snapshot.json"
+
+def require_pyarrow():
+    """
+    Returns the pyarrow module, or raises RuntimeError if it is not installed.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Columnar export needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def schema():
+    pa = require_pyarrow()
+    return pa.schema([
+        ("id", pa.int64()),
+        ("patient_id", pa.int64()),
+        ("patient_name", pa.string()),
+        ("patient_gender", pa.string()),
+        ("patient_dob", pa.date32()),
+        ("created_by", pa.int64()),
+        ("test_type", pa.string()),
+        ("parameter", pa.string()),
+        ("value_numeric", pa.float64()),
+        ("unit", pa.string()),
+        ("normal_min", pa.float64()),
+        ("normal_max", pa.float64()),
+        ("flagged", pa.bool_()),
+        ("status", pa.string()),
+        ("date_conducted", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+        ("month", pa.string()),
+    ])
+
+def rows_query(since=None, until=None):
+    """
+    The lab_tests + patients (+ panels) query behind every columnar export, ordered by id.
+    `since`/`until` bound LabTest.updated_at (inclusive, exclusive).
+    """
+    query = db.session.query(
+        LabTest.id,
+        LabTest.patient_id,
+        Patient.name,
+        Patient.gender,
+        Patient.dob,
+        Patient.created_by,
+        LabTest.parameter,
+        LabTest.value_numeric,
+        LabTest.unit,
+        LabTest.flagged,
+        LabTest.status,
+        LabTest.date_conducted,
+        LabTest.updated_at,
+        LabPanel.test_type,
+    ).join(Patient, Patient.id == LabTest.patient_id).outerjoin(LabPanel, LabPanel.id == LabTest.panel_id)
+    if since is not None:
+        query = query.filter(LabTest.updated_at >= since)
+    if until is not None:
+        query = query.filter(LabTest.updated_at < until)
+    return query.order_by(LabTest.id)
+
+def settled_before():
+    """
+    Returns the updated_at cutoff of a snapshot run: rows written within the
+    last SNAPSHOT_SETTLE_SECONDS are left to the next one.
+    """
+    settle = current_app.config.get("SNAPSHOT_SETTLE_SECONDS", DEFAULT_SETTLE_SECONDS)
+    return datetime.utcnow() - timedelta(seconds=settle)
+
+def record_batches(query=None, chunk_size=DEFAULT_CHUNK_SIZE, skip=None):
+    """
+    Yields pyarrow RecordBatches of lab_tests joined with patients and their
+    resolved reference range, reading at most `chunk_size` rows at a time.
+    `query` defaults to rows_query() and may carry extra filters; rows whose
+    id maps to their own updated_at in `skip` were already exported and are left out.
+    """
+    pa = require_pyarrow()
+    batch_schema = schema()
+    table = range_cache.table(lookups=0)
+
+    columns = [[] for _ in range(14)]
+    if query is None:
+        query = rows_query()
+    for row in query.yield_per(chunk_size):
+        if skip and skip.get(row.id) == row.updated_at:
+            continue
+        for column, value in zip(columns, row):
+            column.append(value)
+        if len(columns[0]) >= chunk_size:
+            yield _to_batch(pa, batch_schema, table, columns)
+            columns = [[] for _ in range(14)]
+    if columns[0]:
+        yield _to_batch(pa, batch_schema, table, columns)
+
+def _to_batch(pa, batch_schema, table, columns):
+    (ids, patient_ids, names, genders, dobs, creators,
+     parameters, values, units, flagged, statuses, dates, updated, panel_types) = columns
+    # Resolve each row's demographic band for the whole chunk at once,
+    # with the same compiled table flagging uses
+    ages = [age_in_years(dob, d) if d else None for dob, d in zip(dobs, dates)]
+    rows = table.resolve(parameters, genders, ages, panel_types)
+    return pa.RecordBatch.from_arrays([
+        pa.array(ids, pa.int64()),
+        pa.array(patient_ids, pa.int64()),
+        pa.array(names, pa.string()),
+        pa.array(genders, pa.string()),
+        pa.array(dobs, pa.date32()),
+        pa.array(creators, pa.int64()),
+        pa.array([table.test_types[i] for i in rows], pa.string()),
+        pa.array(parameters, pa.string()),
+        pa.array(values, pa.float64()),
+        pa.array(units, pa.string()),
+        pa.array(table.mins[rows], pa.float64(), from_pandas=True),
+        pa.array(table.maxs[rows], pa.float64(), from_pandas=True),
+        pa.array(flagged, pa.bool_()),
+        pa.array(statuses, pa.string()),
+        pa.array(dates, pa.timestamp("us")),
+        pa.array(updated, pa.timestamp("us")),
+        pa.array([d.strftime("%Y-%m") if d else "unknown" for d in dates], pa.string()),
+    ], schema=batch_schema)
+
+def read_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"watermark": None, "recent": {}, "snapshots": []}
+    with open(path) as f:
+        manifest = json.load(f)
+    # Manifests of id-watermarked snapshots carry no watermark, so the next run is a full one
+    manifest.setdefault("watermark", None)
+    manifest.setdefault("recent", {})
+    return manifest
+
+def _write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _move_files(staging, out_dir):
+    """
+    Moves each file written under `staging` to the same place under `out_dir`.
+    """
+    for root, _, files in os.walk(staging):
+        target = os.path.join(out_dir, os.path.relpath(root, staging))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            os.replace(os.path.join(root, name), os.path.join(target, name))
+    shutil.rmtree(staging)
+
+def _swap_dir(staging, out_dir):
+    """
+    Puts a fully written dataset in place of `out_dir`, so readers only ever
+    see the old dataset or the new one.
+    """
+    retired = f"{out_dir}.old-{uuid.uuid4().hex[:12]}"
+    if os.path.exists(out_dir):
+        os.replace(out_dir, retired)
+    os.replace(staging, out_dir)
+    shutil.rmtree(retired, ignore_errors=True)
+
+def write_snapshot(out_dir, incremental=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Writes lab results as a Parquet dataset partitioned by month and parameter.
+
+    Every run exports rows last written before settled_before(). With
+    `incremental`, it starts SNAPSHOT_OVERLAP_SECONDS before the previous
+    run's cutoff, so rows of transactions that committed late are still
+    picked up; rows the previous runs already wrote are skipped, and edited
+    rows are written again (readers keep the newest updated_at per id).
+    New files are written aside and moved into place once complete; a full
+    run replaces the whole directory.
+    """
+    pa = require_pyarrow()
+    import pyarrow.parquet as pq
+
+    out_dir = os.path.normpath(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = read_manifest(out_dir)
+    overlap = timedelta(seconds=current_app.config.get("SNAPSHOT_OVERLAP_SECONDS", DEFAULT_OVERLAP_SECONDS))
+    watermark = manifest["watermark"] if incremental else None
+    since = datetime.fromisoformat(watermark) - overlap if watermark else None
+    until = settled_before()
+    snapshot_id = uuid.uuid4().hex[:12]
+    if since is None:
+        manifest = {"watermark": None, "recent": {}, "snapshots": manifest["snapshots"]}
+        staging = f"{out_dir}.staging-{snapshot_id}"
+    else:
+        staging = os.path.join(out_dir, f"_staging-{snapshot_id}")
+    skip = {int(row_id): datetime.fromisoformat(ts) for row_id, ts in manifest["recent"].items()}
+    # Rows this close to the cutoff are read again by the next run and must be skipped there
+    recent = {row_id: ts for row_id, ts in skip.items() if ts >= until - overlap}
+
+    started = time.perf_counter()
+    rows = 0
+    batches = record_batches(query=rows_query(since, until), chunk_size=chunk_size, skip=skip)
+    for chunk, batch in enumerate(batches):
+        pq.write_to_dataset(
+            pa.Table.from_batches([batch]),
+            root_path=staging,
+            partition_cols=["month", "parameter"],
+            basename_template=f"part-{snapshot_id}-{chunk:05d}-{{i}}.parquet",
+        )
+        rows += batch.num_rows
+        for row_id, ts in zip(batch.column("id").to_pylist(), batch.column("updated_at").to_pylist()):
+            if ts >= until - overlap:
+                recent[row_id] = ts
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "id": snapshot_id,
+        "created_at": datetime.utcnow().isoformat(),
+        "incremental": since is not None,
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat(),
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+    }
+    manifest["watermark"] = until.isoformat()
+    manifest["recent"] = {str(row_id): ts.isoformat() for row_id, ts in recent.items()}
+    manifest["snapshots"].append(summary)
+    if since is None:
+        os.makedirs(staging, exist_ok=True)
+        _write_manifest(staging, manifest)
+        _swap_dir(staging, out_dir)
+    else:
+        if os.path.exists(staging):
+            _move_files(staging, out_dir)
+        _write_manifest(out_dir, manifest)
+    return summary
@@ -0,0 +1,135 @@
+import base64
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, true, tuple_
+from ..extensions import db
+from ..models import LabTest, Patient, TestReferenceRange, Tombstone
+from .. import serializers
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_OVERLAP_SECONDS = 5
+DEFAULT_TOMBSTONE_RETENTION_DAYS = 30
+DELETED = "deleted"
+
+# Feed name -> (model, serializer); the feed name is also the key in responses
+FEEDS = {
+    "patients": (Patient, serializers.patient),
+    "lab_tests": (LabTest, serializers.lab_test_sync),
+    "reference_ranges": (TestReferenceRange, serializers.reference_range),
+}
+FEED_OF_TABLE = {model.__tablename__: name for name, (model, _) in FEEDS.items()}
+
+class CursorError(ValueError):
+    pass
+
+class CursorExpired(Exception):
+    pass
+
+def record_deletes(table_name, row_ids, owner_id=None):
+    """
+    Writes tombstones for deleted rows inside the current transaction; the
+    caller commits. Tombstones past the retention window are pruned here too.
+    """
+    now = datetime.utcnow()
+    rows = [{"table_name": table_name, "row_id": row_id, "owner_id": owner_id, "deleted_at": now}
+            for row_id in row_ids]
+    if rows:
+        db.session.execute(Tombstone.__table__.insert(), rows)
+    retention = current_app.config.get("SYNC_TOMBSTONE_RETENTION_DAYS", DEFAULT_TOMBSTONE_RETENTION_DAYS)
+    Tombstone.query.filter(Tombstone.deleted_at < now - timedelta(days=retention)).delete(synchronize_session=False)
+
+def encode_cursor(positions):
+    raw = {name: [ts.isoformat(), row_id] if ts else None for name, (ts, row_id) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(raw, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        positions = {}
+        for name in list(FEEDS) + [DELETED]:
+            value = raw.get(name)
+            positions[name] = (datetime.fromisoformat(value[0]), int(value[1])) if value else (None, 0)
+        return positions
+    except Exception as e:
+        raise CursorError(f"Invalid sync cursor: {str(e)}")
+
+def initial_positions(now):
+    """
+    A full sync reads every live row, and only deletions from now on.
+    """
+    overlap = timedelta(seconds=current_app.config.get("SYNC_OVERLAP_SECONDS", DEFAULT_OVERLAP_SECONDS))
+    positions = {name: (None, 0) for name in FEEDS}
+    positions[DELETED] = (now - overlap, 0)
+    return positions
+
+def _after(columns, position):
+    ts, row_id = position
+    if ts is None:
+        return true()
+    updated_at, id_column = columns
+    return tuple_(updated_at, id_column) > tuple_(ts, row_id)
+
+def _next_position(rows, full, now, overlap):
+    """
+    A full page continues exactly after its last row. Once caught up, the
+    cursor moves to `overlap` before now, so rows written by transactions
+    that committed late are sent again rather than skipped.
+    """
+    if full:
+        last = rows[-1]
+        return (last.updated_at, last.id)
+    return (now - overlap, 0)
+
+def _feed_query(name, user_id):
+    model, serializer = FEEDS[name]
+    columns = [getattr(model, field) for field in serializer.fields] + [model.updated_at]
+    query = db.session.query(*columns)
+    if model is Patient:
+        query = query.filter(Patient.created_by == user_id)
+    elif model is LabTest:
+        query = query.join(Patient, Patient.id == LabTest.patient_id).filter(Patient.created_by == user_id)
+    return query, (model.updated_at, model.id)
+
+def changes_since(user_id, positions, now):
+    """
+    Returns (changes, deleted, positions, has_more) for one page of the
+    caller's change feed after `positions`.
+    """
+    config = current_app.config
+    page_size = config.get("SYNC_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+    overlap = timedelta(seconds=config.get("SYNC_OVERLAP_SECONDS", DEFAULT_OVERLAP_SECONDS))
+    retention = timedelta(days=config.get("SYNC_TOMBSTONE_RETENTION_DAYS", DEFAULT_TOMBSTONE_RETENTION_DAYS))
+
+    deleted_since = positions[DELETED][0]
+    if deleted_since is None or deleted_since < now - retention:
+        raise CursorExpired()
+
+    changes, next_positions, has_more = {}, {}, False
+    for name, (_, serializer) in FEEDS.items():
+        query, order = _feed_query(name, user_id)
+        rows = query.filter(_after(order, positions[name])).order_by(*order).limit(page_size + 1).all()
+        full = len(rows) > page_size
+        rows = rows[:page_size]
+        has_more = has_more or full
+        changes[name] = serializer.many(rows)
+        next_positions[name] = _next_position(rows, full, now, overlap)
+
+    order = (Tombstone.deleted_at, Tombstone.id)
+    tombstones = db.session.query(
+        Tombstone.id, Tombstone.table_name, Tombstone.row_id, Tombstone.deleted_at.label("updated_at"),
+    ).filter(
+        or_(Tombstone.owner_id == user_id, Tombstone.owner_id.is_(None)),
+        _after(order, positions[DELETED]),
+    ).order_by(*order).limit(page_size + 1).all()
+    full = len(tombstones) > page_size
+    tombstones = tombstones[:page_size]
+    has_more = has_more or full
+    deleted = {name: [] for name in FEEDS}
+    for tombstone in tombstones:
+        name = FEED_OF_TABLE.get(tombstone.table_name)
+        if name:
+            deleted[name].append(tombstone.row_id)
+    next_positions[DELETED] = _next_position(tombstones, full, now, overlap)
+
+    return changes, deleted, next_positions, has_more
@@ -0,0 +1,164 @@
+from datetime import datetime
+from sqlalchemy import case, cast, extract, func, or_
+from ..extensions import db
+from ..models.lab_test import LabTest
+
+EPOCH = datetime(1970, 1, 1)
+# lttb_series reads at most 4 rows from each of points * PREBUCKET_FACTOR buckets
+PREBUCKET_FACTOR = 4
+
+def _series_filter(query, patient_id, parameter, date_from=None, date_to=None):
+    query = query.filter(
+        LabTest.patient_id == patient_id,
+        LabTest.parameter == parameter,
+        LabTest.value_numeric.isnot(None),
+        LabTest.date_conducted.isnot(None),
+    )
+    if date_from:
+        query = query.filter(LabTest.date_conducted >= date_from)
+    if date_to:
+        query = query.filter(LabTest.date_conducted <= date_to)
+    return query
+
+def _extent(patient_id, parameter, date_from=None, date_to=None):
+    """
+    Returns (first date, last date, count) of the series.
+    """
+    return _series_filter(
+        db.session.query(func.min(LabTest.date_conducted), func.max(LabTest.date_conducted), func.count(LabTest.id)),
+        patient_id, parameter, date_from, date_to,
+    ).one()
+
+def bucketed_series(patient_id, parameter, points, date_from=None, date_to=None):
+    """
+    Splits the series into `points` equal time buckets and returns min/max/avg
+    per non-empty bucket. Aggregation runs in the database, so only O(points)
+    rows come back regardless of history length.
+    """
+    first, last, total = _extent(patient_id, parameter, date_from, date_to)
+    if not total:
+        return [], 0
+
+    span = (last - first).total_seconds()
+    width = span / points if span > 0 else 1.0
+    start = _naive_epoch(first)
+    offset = (extract("epoch", LabTest.date_conducted) - start) / width
+    if db.session.get_bind().dialect.name == "postgresql":
+        # CAST rounds a numeric on Postgres; SQLite truncates, which is a
+        # floor for these non-negative offsets
+        offset = func.floor(offset)
+    index = cast(offset, db.Integer)
+    # The last point sits exactly at `span`; keep it in the final bucket
+    bucket = case((index >= points, points - 1), else_=index)
+    rows = _series_filter(
+        db.session.query(
+            bucket.label("bucket"),
+            func.min(LabTest.date_conducted),
+            func.max(LabTest.date_conducted),
+            func.min(LabTest.value_numeric),
+            func.max(LabTest.value_numeric),
+            func.avg(LabTest.value_numeric),
+            func.count(LabTest.id),
+        ),
+        patient_id, parameter, date_from, date_to,
+    ).group_by(bucket).order_by(bucket).all()
+
+    return [{
+        "start": t_min.isoformat(),
+        "end": t_max.isoformat(),
+        "min": v_min,
+        "max": v_max,
+        "avg": float(v_avg),
+        "count": count,
+    } for _, t_min, t_max, v_min, v_max, v_avg, count in rows], total
+
+def _naive_epoch(value):
+    # date_conducted is stored as naive UTC
+    return (value - EPOCH).total_seconds()
+
+def lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling of (x, y, ...) tuples sorted by x.
+    Keeps the first and last point and the visually most significant point
+    of every bucket in between.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = points[next_start:next_end]
+        avg_x = sum(p[0] for p in span) / len(span)
+        avg_y = sum(p[1] for p in span) / len(span)
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = points[a][0], points[a][1]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            x, y = points[j][0], points[j][1]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+def _prebucketed(patient_id, parameter, buckets, date_from=None, date_to=None):
+    """
+    Splits the series into `buckets` runs of equal length (as lttb() does)
+    and returns (date, value) of the first, last, lowest and highest sample
+    of each, sorted by date. These keep the extremes and turning points LTTB
+    favours, so the downsampled shape survives.
+    """
+    order = (LabTest.date_conducted, LabTest.id)
+    numbered = _series_filter(
+        db.session.query(
+            LabTest.id,
+            LabTest.date_conducted,
+            LabTest.value_numeric,
+            func.ntile(buckets).over(order_by=order).label("bucket"),
+        ),
+        patient_id, parameter, date_from, date_to,
+    ).subquery()
+    c = numbered.c
+    ranked = db.session.query(
+        c.id,
+        c.date_conducted,
+        c.value_numeric,
+        func.row_number().over(partition_by=c.bucket, order_by=(c.date_conducted, c.id)).label("first"),
+        func.row_number().over(partition_by=c.bucket, order_by=(c.date_conducted.desc(), c.id.desc())).label("last"),
+        func.row_number().over(partition_by=c.bucket, order_by=(c.value_numeric, c.id)).label("low"),
+        func.row_number().over(partition_by=c.bucket, order_by=(c.value_numeric.desc(), c.id)).label("high"),
+    ).subquery()
+    return db.session.query(ranked.c.date_conducted, ranked.c.value_numeric).filter(
+        or_(ranked.c.first == 1, ranked.c.last == 1, ranked.c.low == 1, ranked.c.high == 1),
+    ).order_by(ranked.c.date_conducted, ranked.c.id).all()
+
+def lttb_series(patient_id, parameter, points, date_from=None, date_to=None):
+    """
+    Returns up to `points` raw samples chosen with LTTB. Long series are
+    first reduced in the database by _prebucketed(), so at most
+    4 * points * PREBUCKET_FACTOR rows are read.
+    """
+    total = _extent(patient_id, parameter, date_from, date_to)[2]
+    if not total:
+        return [], 0
+
+    if total > 4 * points * PREBUCKET_FACTOR:
+        rows = _prebucketed(patient_id, parameter, points * PREBUCKET_FACTOR, date_from, date_to)
+    else:
+        rows = _series_filter(
+            db.session.query(LabTest.date_conducted, LabTest.value_numeric),
+            patient_id, parameter, date_from, date_to,
+        ).order_by(LabTest.date_conducted).all()
+    pairs = [(_naive_epoch(t), v, t) for t, v in rows]
+    sampled = lttb(pairs, points)
+    return [{"t": t.isoformat(), "value": v} for _, v, t in sampled], total
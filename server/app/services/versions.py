@@ -0,0 +1,70 @@
+from datetime import datetime
+from sqlalchemy import event, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..extensions import db
+from ..models.table_version import TableVersion
+
+PENDING_KEY = "pending_version_bumps"
+
+def bump_version(table_name):
+    """
+    Increments the change version of a table inside the current transaction.
+    The caller is responsible for committing.
+    """
+    now = datetime.utcnow()
+    updated = TableVersion.query.filter_by(table_name=table_name).update(
+        {"version": TableVersion.version + 1, "updated_at": now},
+        synchronize_session=False,
+    )
+    if not updated:
+        db.session.add(TableVersion(table_name=table_name, version=1, updated_at=now))
+
+def bump_after_commit(table_name):
+    """
+    Increments the change version of a table once the current transaction
+    commits, in a statement of its own.
+
+    For hot write paths: bump_version holds the table_versions row lock until
+    the writer commits, so every concurrent writer of the table queues behind
+    it. Here the lock lasts one UPDATE. A reader between the two sees the new
+    rows with the old version, which only makes a cached response miss once.
+    """
+    db.session.info.setdefault(PENDING_KEY, set()).add(table_name)
+
+def _bump_now(connection, table_name):
+    now = datetime.utcnow()
+    table = TableVersion.__table__
+    updated = connection.execute(
+        update(table).where(table.c.table_name == table_name).values(version=table.c.version + 1, updated_at=now)
+    ).rowcount
+    if not updated:
+        connection.execute(insert(table).values(table_name=table_name, version=1, updated_at=now))
+
+@event.listens_for(Session, "after_commit")
+def _bump_pending(session):
+    tables = session.info.pop(PENDING_KEY, None)
+    if not tables:
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            for table_name in sorted(tables):
+                _bump_now(connection, table_name)
+    except IntegrityError:
+        # Another worker created the row first; it is there to bump now
+        with session.get_bind().begin() as connection:
+            for table_name in sorted(tables):
+                _bump_now(connection, table_name)
+    except Exception as e:
+        print(f"Version bump error for {', '.join(sorted(tables))}: {str(e)}")
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+def get_version(table_name):
+    """
+    Returns the current change version of a table (0 if it was never bumped).
+    """
+    version = db.session.query(TableVersion.version).filter_by(table_name=table_name).scalar()
+    return version or 0
@@ -0,0 +1,91 @@
+"""
+Per-result cost of flag classification: the scalar comparison that
+`flag_abnormal` used to do per call versus the vectorized RangeTable path,
+at 1, 1k and 1M results, plus the same workload resolved against 40
+sex/age bands per parameter. Needs no database.
+
+    python -m benchmarks.bench_flagging
+"""
+import random
+import time
+
+import numpy as np
+
+from app.services.flagging import STATUS_LABELS, RangeEntry, RangeTable, _to_floats
+
+PARAMETERS = ["hemoglobin", "wbc", "platelets", "ldl", "hdl", "creatinine", "glucose", "sodium"]
+
+def scalar_status(ref, value):
+    if not ref:
+        return "Unknown"
+    try:
+        val = float(value)
+        if val < ref.normal_min:
+            return "Low"
+        elif val > ref.normal_max:
+            return "High"
+        else:
+            return "Normal"
+    except Exception:
+        return "Unknown"
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    rng = random.Random(7)
+    ranges = {
+        p: RangeEntry(i, "bench", p, 1.0, 10.0, "u") for i, p in enumerate(PARAMETERS)
+    }
+    table = RangeTable(list(ranges.values()))
+    bands = [
+        RangeEntry(len(PARAMETERS) + i, "bench", p, 1.0, 10.0, "u", sex, age, age + 5)
+        for i, (p, sex, age) in enumerate(
+            (p, sex, age) for p in PARAMETERS for sex in ("male", "female") for age in range(0, 100, 5)
+        )
+    ]
+    banded_table = RangeTable(list(ranges.values()) + bands)
+
+    for n in (1, 1000, 1000000):
+        parameters = [rng.choice(PARAMETERS + ["unconfigured"]) for _ in range(n)]
+        values = [round(rng.uniform(0, 12), 2) for _ in range(n)]
+        numeric = np.array(values, dtype=np.float64)
+        sexes = [rng.choice(["male", "female", None]) for _ in range(n)]
+        ages = [rng.uniform(0, 99) for _ in range(n)]
+        repeat = 3 if n >= 1000000 else 200
+
+        def scalar():
+            return [scalar_status(ranges.get(p), v) for p, v in zip(parameters, values)]
+
+        def vectorized():
+            floats, parsed = _to_floats(values)
+            return STATUS_LABELS[table.classify(table.lookup(parameters), floats, parsed)].tolist()
+
+        def vectorized_numeric():
+            floats, parsed = _to_floats(numeric)
+            return table.classify(table.lookup(parameters), floats, parsed)
+
+        def vectorized_banded():
+            floats, parsed = _to_floats(numeric)
+            return banded_table.classify(banded_table.resolve(parameters, sexes, ages), floats, parsed)
+
+        def scalar_banded():
+            return [banded_table.resolve_one(p, s, a) for p, s, a in zip(parameters, sexes, ages)]
+
+        assert scalar() == vectorized()
+        assert scalar_banded() == banded_table.resolve(parameters, sexes, ages).tolist()
+        print(f"\n{n} results")
+        for name, fn in (("scalar loop", scalar), ("vectorized (lists)", vectorized),
+                         ("vectorized (float array)", vectorized_numeric),
+                         ("scalar, 40 bands/param", scalar_banded),
+                         ("vectorized, 40 bands/param", vectorized_banded)):
+            seconds = best_of(fn, repeat)
+            print(f"  {name:26s} {seconds * 1e9 / n:12.1f} ns/result")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Latency of an unrelated endpoint (GET /api/dashboard/summary) while a
+burst of logins hits the same threaded server, with password hashing
+inline on the request threads versus on the bounded process pool.
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file:
+
+    python -m benchmarks.bench_login --logins 64 --pool-workers 2
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_login.db"
+os.environ.setdefault("JWT_SECRET_KEY", "bench-login-secret-key-of-sufficient-length")
+
+from werkzeug.serving import make_server
+
+from app import create_app
+from app.extensions import db
+from app.models import User
+from app.services.passwords import hasher
+
+EMAIL = "bench-login@example.com"
+PASSWORD = "correct horse battery staple"
+
+def request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            status = response.status
+            response.read()
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+def probe(base, stop, latencies):
+    while not stop.is_set():
+        latencies.append(request(f"{base}/api/dashboard/summary")[1])
+
+def run(app, base, workers, logins, probe_threads):
+    app.config["PASSWORD_HASH_WORKERS"] = workers
+    # Warm up the pool (and the canonical-method cache) outside the measurement
+    request(f"{base}/api/auth/login", {"email": EMAIL, "password": PASSWORD})
+
+    idle = []
+    stop = threading.Event()
+    probes = [threading.Thread(target=probe, args=(base, stop, idle)) for _ in range(probe_threads)]
+    [t.start() for t in probes]
+    time.sleep(1.0)
+    stop.set()
+    [t.join() for t in probes]
+
+    busy, statuses = [], []
+    stop = threading.Event()
+    probes = [threading.Thread(target=probe, args=(base, stop, busy)) for _ in range(probe_threads)]
+
+    def login():
+        statuses.append(request(f"{base}/api/auth/login", {"email": EMAIL, "password": PASSWORD})[0])
+
+    burst = [threading.Thread(target=login) for _ in range(logins)]
+    [t.start() for t in probes]
+    started = time.perf_counter()
+    [t.start() for t in burst]
+    [t.join() for t in burst]
+    elapsed = time.perf_counter() - started
+    stop.set()
+    [t.join() for t in probes]
+
+    label = "inline" if workers == 0 else f"pool ({workers} workers)"
+    print(f"\n{label}")
+    print(f"  logins: {statuses.count(200)} ok, {statuses.count(503)} shed (503) in {elapsed:.2f}s")
+    for name, samples in (("idle", idle), ("during burst", busy)):
+        print(f"  summary {name:13s} p50 {statistics.median(samples) * 1000:8.1f} ms"
+              f"   p99 {percentile(samples, 0.99) * 1000:8.1f} ms   ({len(samples)} requests)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--pool-workers", type=int, default=2)
+    parser.add_argument("--probe-threads", type=int, default=2)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        User.query.filter_by(email=EMAIL).delete()
+        db.session.add(User(name="bench", email=EMAIL, password=hasher.hash(PASSWORD), role="user"))
+        db.session.commit()
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    print(f"{args.logins} concurrent logins, method {app.config['PASSWORD_HASH_METHOD']}")
+    try:
+        for workers in (0, args.pool_workers):
+            run(app, base, workers, args.logins, args.probe_threads)
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
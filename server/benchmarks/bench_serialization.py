@@ -0,0 +1,90 @@
+"""
+Response build time for a 10k-row lab test listing: the old hand-written
+dict literals with isoformat() and Flask's stdlib json provider, versus
+the shared serializers with the stdlib and orjson providers. Needs no
+database.
+
+    python -m benchmarks.bench_serialization --rows 10000
+"""
+import argparse
+import os
+import random
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+os.environ.setdefault("JWT_SECRET_KEY", "bench-serialization-secret-key")
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from app import serializers
+from app.json_provider import IsoJSONProvider, OrjsonProvider, orjson
+
+Row = namedtuple("Row", serializers.lab_test_listing.fields)
+
+def make_rows(n):
+    rng = random.Random(3)
+    start = datetime(2025, 1, 1)
+    return [Row(
+        id=i,
+        parameter=rng.choice(["hemoglobin", "wbc", "platelets", "glucose"]),
+        result_values={"value": round(rng.uniform(1, 20), 2), "unit": "g/dL"},
+        flagged=rng.random() < 0.2,
+        status=rng.choice(["Low", "High", "Normal"]),
+        date_conducted=start + timedelta(minutes=i),
+        patient_id=rng.randrange(1, 500),
+        patient_name=f"patient {i % 500}",
+    ) for i in range(n)]
+
+def hand_written(rows):
+    return [{
+        "id": t.id,
+        "parameter": t.parameter,
+        "result_values": t.result_values,
+        "flagged": t.flagged,
+        "status": t.status,
+        "date_conducted": t.date_conducted.isoformat() if t.date_conducted else None,
+        "patient_id": t.patient_id,
+        "patient_name": t.patient_name or "",
+    } for t in rows]
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    rows = make_rows(args.rows)
+
+    cases = [
+        ("dict literals + stdlib json", DefaultJSONProvider, hand_written),
+        ("serializers + stdlib json", IsoJSONProvider, serializers.lab_test_listing.many),
+    ]
+    if orjson is not None:
+        cases.append(("serializers + orjson", OrjsonProvider, serializers.lab_test_listing.many))
+    else:
+        print("orjson is not installed; skipping the orjson case")
+
+    print(f"{args.rows} rows, best of {args.repeat}")
+    for name, provider, to_dicts in cases:
+        app = Flask(__name__)
+        app.json = provider(app)
+        with app.test_request_context():
+            def build():
+                return app.json.response({"data": to_dicts(rows)}).get_data()
+            to_dicts_seconds = best_of(lambda: to_dicts(rows), args.repeat)
+            total_seconds = best_of(build, args.repeat)
+            size = len(build())
+        print(f"  {name:30s} rows->dicts {to_dicts_seconds * 1000:7.2f} ms"
+              f"   full response {total_seconds * 1000:7.2f} ms   ({size / 1024:.0f} KiB)")
+
+if __name__ == "__main__":
+    main()
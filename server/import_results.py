@@ -0,0 +1,38 @@
+"""
+Imports an analyzer export or HL7 file into lab_tests, streaming it in chunks.
+
+    python import_results.py results.hl7 --user-id 1
+    python import_results.py run-0412.astm --user-id 1 --no-create-patients
+    python import_results.py export.csv --user-id 1 --format csv --chunk-size 5000
+"""
+import argparse
+
+from app import create_app
+from app.services.importer import DEFAULT_CHUNK_SIZE, FORMATS, ImportJob, detect_format, open_text
+
+parser = argparse.ArgumentParser(description="Import HL7 v2 ORU, ASTM E1394 or CSV results")
+parser.add_argument("path")
+parser.add_argument("--user-id", type=int, required=True, help="user that owns matched and created patients")
+parser.add_argument("--format", choices=FORMATS, help="detected from the extension or first line if omitted")
+parser.add_argument("--no-create-patients", action="store_true", help="skip results for unknown patients")
+parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+args = parser.parse_args()
+
+app = create_app()
+with app.app_context():
+    with open_text(args.path) as lines:
+        fmt = args.format or detect_format(args.path, next(lines, ""))
+    job = ImportJob(args.path, fmt, args.user_id, create_patients=not args.no_create_patients,
+                    chunk_size=args.chunk_size)
+    with open_text(args.path) as lines:
+        summary = job.run(lines).progress()
+
+    for error in summary["errors"]:
+        print(f"  skipped {error}")
+    if summary["state"] != "done":
+        print(f"❌ Import failed after {summary['records_read']} records: {summary['error']}")
+        raise SystemExit(1)
+    print(f"✅ Imported {summary['imported']} of {summary['records_read']} {fmt} records "
+          f"({summary['flagged']} flagged, {summary['skipped']} skipped, "
+          f"{summary['patients_created']} new patients) in {summary['elapsed_seconds']}s "
+          f"({summary['records_per_second'] or 0:.0f} records/s)")
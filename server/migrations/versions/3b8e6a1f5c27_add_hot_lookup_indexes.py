@@ -0,0 +1,70 @@
+"""Add indexes for hot lookup columns
+
+Revision ID: 3b8e6a1f5c27
+Revises: e27b5f0c8d14
+Create Date: 2025-07-24 10:41:19.930264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e6a1f5c27'
+down_revision = 'e27b5f0c8d14'
+branch_labels = None
+depends_on = None
+
+
+def _check_duplicates():
+    # Reference ranges are clinical data: rather than pick which copy to
+    # keep, stop and let an operator merge or delete them
+    rows = op.get_bind().execute(sa.text("""
+        SELECT id, test_type, parameter FROM test_reference_ranges
+        WHERE test_type IS NOT NULL ORDER BY id
+    """)).fetchall()
+    groups = {}
+    for range_id, test_type, parameter in rows:
+        groups.setdefault((test_type, parameter), []).append(range_id)
+    duplicates = [(key, ids) for key, ids in groups.items() if len(ids) > 1]
+    if duplicates:
+        raise RuntimeError(
+            "test_reference_ranges has several rows for these (test_type, parameter) pairs; "
+            "keep one of each and run the upgrade again:\n" + "\n".join(
+                f"  test_type={test_type!r} parameter={parameter!r}: ids {ids}"
+                for (test_type, parameter), ids in duplicates
+            )
+        )
+
+
+def upgrade():
+    _check_duplicates()
+    with op.batch_alter_table('test_reference_ranges', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_test_reference_ranges_test_type_parameter', ['test_type', 'parameter'])
+        batch_op.create_index('ix_test_reference_ranges_parameter', ['parameter'], unique=False)
+
+    # lab_tests is large; build its indexes without blocking writes
+    with op.get_context().autocommit_block():
+        op.create_index('ix_patients_created_by', 'patients', ['created_by'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_lab_tests_patient_id_date_conducted', 'lab_tests', ['patient_id', 'date_conducted'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_lab_tests_date_conducted', 'lab_tests', ['date_conducted'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_lab_tests_parameter_id', 'lab_tests', ['parameter', 'id'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_lab_tests_flagged_id', 'lab_tests', ['id'], unique=False,
+                        postgresql_where=sa.text('flagged IS TRUE'),
+                        sqlite_where=sa.text('flagged IS TRUE'),
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_lab_tests_flagged_id', table_name='lab_tests')
+    op.drop_index('ix_lab_tests_parameter_id', table_name='lab_tests')
+    op.drop_index('ix_lab_tests_date_conducted', table_name='lab_tests')
+    op.drop_index('ix_lab_tests_patient_id_date_conducted', table_name='lab_tests')
+    op.drop_index('ix_patients_created_by', table_name='patients')
+    with op.batch_alter_table('test_reference_ranges', schema=None) as batch_op:
+        batch_op.drop_index('ix_test_reference_ranges_parameter')
+        batch_op.drop_constraint('uq_test_reference_ranges_test_type_parameter', type_='unique')
@@ -0,0 +1,27 @@
+"""Add covering index for per-patient trends
+
+Revision ID: 4f9b2e7c1a58
+Revises: c5a0f83d9e61
+Create Date: 2025-08-05 09:54:30.671402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f9b2e7c1a58'
+down_revision = 'c5a0f83d9e61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_lab_tests_patient_parameter_date', 'lab_tests',
+                        ['patient_id', 'parameter', 'date_conducted'], unique=False,
+                        postgresql_include=['value_numeric'], postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_lab_tests_patient_parameter_date', table_name='lab_tests')
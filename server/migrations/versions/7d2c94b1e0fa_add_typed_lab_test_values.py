@@ -0,0 +1,57 @@
+"""Add typed value_numeric/unit columns to lab_tests
+
+Revision ID: 7d2c94b1e0fa
+Revises: 3b8e6a1f5c27
+Create Date: 2025-07-28 16:22:07.441893
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2c94b1e0fa'
+down_revision = '3b8e6a1f5c27'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 50000
+
+# Only cast values that look like numbers; anything else stays NULL
+NUMERIC_PATTERN = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+
+
+def upgrade():
+    with op.batch_alter_table('lab_tests', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('value_numeric', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('unit', sa.String(length=50), nullable=True))
+
+    # Backfill in id-ranged batches, each committed on its own, so the table
+    # is never locked for the whole run.
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        max_id = bind.execute(sa.text('SELECT MAX(id) FROM lab_tests')).scalar() or 0
+        for lo in range(0, max_id + 1, BACKFILL_BATCH_SIZE):
+            bind.execute(sa.text("""
+                UPDATE lab_tests
+                SET value_numeric = CASE
+                        WHEN (result_values->>'value') ~ :pattern
+                        THEN CAST(result_values->>'value' AS DOUBLE PRECISION)
+                    END,
+                    unit = LEFT(result_values->>'unit', 50)
+                WHERE id >= :lo AND id < :hi
+            """), {'pattern': NUMERIC_PATTERN, 'lo': lo, 'hi': lo + BACKFILL_BATCH_SIZE})
+
+        op.create_index('ix_lab_tests_parameter_value_numeric', 'lab_tests', ['parameter', 'value_numeric'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_lab_tests_parameter_date_value', 'lab_tests',
+                        ['parameter', 'date_conducted', 'value_numeric'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_lab_tests_parameter_date_value', table_name='lab_tests')
+    op.drop_index('ix_lab_tests_parameter_value_numeric', table_name='lab_tests')
+    with op.batch_alter_table('lab_tests', schema=None) as batch_op:
+        batch_op.drop_column('unit')
+        batch_op.drop_column('value_numeric')
@@ -0,0 +1,33 @@
+"""Add table_versions for cross-worker cache invalidation
+
+Revision ID: 9c41d7e2a6b3
+Revises: 5808603aa33d
+Create Date: 2025-07-20 09:12:04.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c41d7e2a6b3'
+down_revision = '5808603aa33d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('table_versions',
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    op.execute(
+        "INSERT INTO table_versions (table_name, version, updated_at) "
+        "VALUES ('test_reference_ranges', 1, CURRENT_TIMESTAMP)"
+    )
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -0,0 +1,58 @@
+"""Drop the all-creators dashboard_counters rows; totals are summed per creator
+
+Revision ID: a4f7c3e9b218
+Revises: e8b4d2a6f913
+Create Date: 2025-09-12 16:20:08.114562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f7c3e9b218'
+down_revision = 'e8b4d2a6f913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # created_by NULL now means "no creator" rather than "all creators"
+    op.execute("DELETE FROM dashboard_counters WHERE created_by IS NULL")
+    op.execute("""
+        INSERT INTO dashboard_counters (created_by, day, patient_count, test_count, abnormal_count)
+        SELECT NULL, NULL, COUNT(DISTINCT p.id), COUNT(t.id),
+               SUM(CASE WHEN t.flagged IS TRUE THEN 1 ELSE 0 END)
+        FROM patients p LEFT JOIN lab_tests t ON t.patient_id = p.id
+        WHERE p.created_by IS NULL
+        HAVING COUNT(DISTINCT p.id) > 0
+    """)
+    op.execute("""
+        INSERT INTO dashboard_counters (created_by, day, patient_count, test_count, abnormal_count)
+        SELECT NULL, CAST(t.date_conducted AS DATE), 0, COUNT(*),
+               SUM(CASE WHEN t.flagged IS TRUE THEN 1 ELSE 0 END)
+        FROM lab_tests t JOIN patients p ON p.id = t.patient_id
+        WHERE t.date_conducted IS NOT NULL AND p.created_by IS NULL
+        GROUP BY CAST(t.date_conducted AS DATE)
+    """)
+    # Patients have no creation date; per-day patient counts only drifted
+    op.execute("UPDATE dashboard_counters SET patient_count = 0 WHERE day IS NOT NULL AND patient_count <> 0")
+
+
+def downgrade():
+    op.execute("DELETE FROM dashboard_counters WHERE created_by IS NULL")
+    op.execute("""
+        INSERT INTO dashboard_counters (created_by, day, patient_count, test_count, abnormal_count)
+        SELECT NULL, NULL,
+               (SELECT COUNT(*) FROM patients),
+               (SELECT COUNT(*) FROM lab_tests),
+               (SELECT COUNT(*) FROM lab_tests WHERE flagged IS TRUE)
+    """)
+    op.execute("""
+        INSERT INTO dashboard_counters (created_by, day, patient_count, test_count, abnormal_count)
+        SELECT NULL, CAST(t.date_conducted AS DATE), 0, COUNT(*),
+               SUM(CASE WHEN t.flagged IS TRUE THEN 1 ELSE 0 END)
+        FROM lab_tests t
+        WHERE t.date_conducted IS NOT NULL
+        GROUP BY CAST(t.date_conducted AS DATE)
+    """)
@@ -0,0 +1,40 @@
+"""Add trigram and date-of-birth indexes for search
+
+Revision ID: a7d31c9e4b26
+Revises: f3c82a5d7e14
+Create Date: 2025-08-26 09:47:13.502218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d31c9e4b26'
+down_revision = 'f3c82a5d7e14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_patients_dob', 'patients', ['dob'], unique=False, postgresql_concurrently=True)
+
+    # Trigram indexes only exist on Postgres; other databases search through per-worker tries
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        op.create_index('ix_patients_name_trgm', 'patients', ['name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+        op.create_index('ix_test_reference_ranges_parameter_trgm', 'test_reference_ranges', ['parameter'],
+                        unique=False, postgresql_using='gin', postgresql_ops={'parameter': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_test_reference_ranges_parameter_trgm', table_name='test_reference_ranges')
+        op.drop_index('ix_patients_name_trgm', table_name='patients')
+    op.drop_index('ix_patients_dob', table_name='patients')
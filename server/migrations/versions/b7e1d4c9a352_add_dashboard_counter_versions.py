@@ -0,0 +1,37 @@
+"""Add per-row versions to dashboard_counters for dashboard ETags
+
+Revision ID: b7e1d4c9a352
+Revises: d5b9e2c7a413
+Create Date: 2025-09-20 11:42:51.306718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1d4c9a352'
+down_revision = 'd5b9e2c7a413'
+branch_labels = None
+depends_on = None
+
+
+def _utc_now():
+    # updated_at holds naive UTC (datetime.utcnow)
+    if op.get_bind().dialect.name == 'postgresql':
+        return sa.text("timezone('utc', now())")
+    return sa.text('CURRENT_TIMESTAMP')
+
+
+def upgrade():
+    # The dashboard no longer reads a global table_versions row for these counters
+    with op.batch_alter_table('dashboard_counters', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=_utc_now()))
+    op.execute("DELETE FROM table_versions WHERE table_name = 'dashboard_counters'")
+
+
+def downgrade():
+    with op.batch_alter_table('dashboard_counters', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('version')
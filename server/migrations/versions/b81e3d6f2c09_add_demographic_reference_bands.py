@@ -0,0 +1,36 @@
+"""Add sex and age bands to test_reference_ranges
+
+Revision ID: b81e3d6f2c09
+Revises: 4f9b2e7c1a58
+Create Date: 2025-08-08 13:18:45.027731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81e3d6f2c09'
+down_revision = '4f9b2e7c1a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('test_reference_ranges', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sex', sa.String(length=10), nullable=True))
+        batch_op.add_column(sa.Column('age_min', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('age_max', sa.Float(), nullable=True))
+        batch_op.drop_constraint('uq_test_reference_ranges_test_type_parameter', type_='unique')
+        batch_op.create_unique_constraint('uq_test_reference_ranges_test_type_parameter_band',
+                                          ['test_type', 'parameter', 'sex', 'age_min'])
+
+
+def downgrade():
+    with op.batch_alter_table('test_reference_ranges', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_test_reference_ranges_test_type_parameter_band', type_='unique')
+        batch_op.create_unique_constraint('uq_test_reference_ranges_test_type_parameter',
+                                          ['test_type', 'parameter'])
+        batch_op.drop_column('age_max')
+        batch_op.drop_column('age_min')
+        batch_op.drop_column('sex')
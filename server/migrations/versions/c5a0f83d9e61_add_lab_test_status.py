@@ -0,0 +1,27 @@
+"""Add stored status to lab_tests
+
+Revision ID: c5a0f83d9e61
+Revises: 7d2c94b1e0fa
+Create Date: 2025-08-01 11:37:52.208716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a0f83d9e61'
+down_revision = '7d2c94b1e0fa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are filled in by a full re-flag (POST /api/reference_ranges/reflag)
+    with op.batch_alter_table('lab_tests', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=10), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('lab_tests', schema=None) as batch_op:
+        batch_op.drop_column('status')
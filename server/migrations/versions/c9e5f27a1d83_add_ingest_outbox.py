@@ -0,0 +1,47 @@
+"""Add ingest_outbox for asynchronous lab result ingestion
+
+Revision ID: c9e5f27a1d83
+Revises: a7d31c9e4b26
+Create Date: 2025-09-02 16:12:48.207315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e5f27a1d83'
+down_revision = 'a7d31c9e4b26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ingest_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('submitted_by', sa.Integer(), nullable=True),
+    sa.Column('idempotency_key', sa.String(length=128), nullable=True),
+    sa.Column('payload', postgresql.JSON(astext_type=sa.Text()), nullable=False),
+    sa.Column('state', sa.String(length=10), nullable=False),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('lab_test_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['submitted_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('submitted_by', 'idempotency_key', name='uq_ingest_outbox_submitted_by_key')
+    )
+    with op.batch_alter_table('ingest_outbox', schema=None) as batch_op:
+        batch_op.create_index('ix_ingest_outbox_pending_id', ['id'], unique=False,
+                              postgresql_where=sa.text("state = 'pending'"),
+                              sqlite_where=sa.text("state = 'pending'"))
+        batch_op.create_index('ix_ingest_outbox_processed_at', ['processed_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ingest_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_ingest_outbox_processed_at')
+        batch_op.drop_index('ix_ingest_outbox_pending_id')
+
+    op.drop_table('ingest_outbox')
@@ -0,0 +1,50 @@
+"""Add lab_panels and lab_tests.panel_id
+
+Revision ID: d46a1e9b3c70
+Revises: b81e3d6f2c09
+Create Date: 2025-08-12 10:21:06.418352
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd46a1e9b3c70'
+down_revision = 'b81e3d6f2c09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('lab_panels',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('accession', sa.String(length=64), nullable=False),
+    sa.Column('test_type', sa.String(length=100), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('submitted_by', sa.Integer(), nullable=True),
+    sa.Column('date_conducted', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], ),
+    sa.ForeignKeyConstraint(['submitted_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('accession')
+    )
+    with op.batch_alter_table('lab_panels', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_lab_panels_patient_id'), ['patient_id'], unique=False)
+
+    with op.batch_alter_table('lab_tests', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('panel_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_lab_tests_panel_id_lab_panels', 'lab_panels', ['panel_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_lab_tests_panel_id'), ['panel_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('lab_tests', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_lab_tests_panel_id'))
+        batch_op.drop_constraint('fk_lab_tests_panel_id_lab_panels', type_='foreignkey')
+        batch_op.drop_column('panel_id')
+
+    with op.batch_alter_table('lab_panels', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_lab_panels_patient_id'))
+
+    op.drop_table('lab_panels')
@@ -0,0 +1,58 @@
+"""Enforce unique reference range bands when test_type, sex or age_min are NULL
+
+Revision ID: d5b9e2c7a413
+Revises: a4f7c3e9b218
+Create Date: 2025-09-12 17:02:51.638410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b9e2c7a413'
+down_revision = 'a4f7c3e9b218'
+branch_labels = None
+depends_on = None
+
+
+def _check_duplicates():
+    # The old constraint let duplicates through wherever a column was NULL.
+    # Reference ranges are clinical data: rather than pick which copy to
+    # keep, stop and let an operator merge or delete them
+    rows = op.get_bind().execute(sa.text("""
+        SELECT id, test_type, parameter, sex, age_min FROM test_reference_ranges ORDER BY id
+    """)).fetchall()
+    groups = {}
+    for range_id, *band in rows:
+        groups.setdefault(tuple(band), []).append(range_id)
+    duplicates = [(band, ids) for band, ids in groups.items() if len(ids) > 1]
+    if duplicates:
+        raise RuntimeError(
+            "test_reference_ranges has several rows for these (test_type, parameter, sex, age_min) bands; "
+            "keep one of each and run the upgrade again:\n" + "\n".join(
+                f"  test_type={test_type!r} parameter={parameter!r} sex={sex!r} age_min={age_min!r}: ids {ids}"
+                for (test_type, parameter, sex, age_min), ids in duplicates
+            )
+        )
+
+
+def upgrade():
+    _check_duplicates()
+    with op.batch_alter_table('test_reference_ranges', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_test_reference_ranges_test_type_parameter_band', type_='unique')
+    # NULLs are distinct in unique indexes, so fold them to sentinels
+    op.create_index(
+        'uq_test_reference_ranges_band',
+        'test_reference_ranges',
+        [sa.text("COALESCE(test_type, '')"), 'parameter', sa.text("COALESCE(sex, '')"),
+         sa.text('COALESCE(age_min, -1)')],
+        unique=True,
+    )
+
+
+def downgrade():
+    op.drop_index('uq_test_reference_ranges_band', table_name='test_reference_ranges')
+    with op.batch_alter_table('test_reference_ranges', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_test_reference_ranges_test_type_parameter_band',
+                                          ['test_type', 'parameter', 'sex', 'age_min'])
@@ -0,0 +1,74 @@
+"""Add dashboard_counters and backfill from existing rows
+
+Revision ID: e27b5f0c8d14
+Revises: 9c41d7e2a6b3
+Create Date: 2025-07-22 14:03:41.502177
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e27b5f0c8d14'
+down_revision = '9c41d7e2a6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dashboard_counters',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('day', sa.Date(), nullable=True),
+    sa.Column('patient_count', sa.Integer(), nullable=False),
+    sa.Column('test_count', sa.Integer(), nullable=False),
+    sa.Column('abnormal_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # NULLs are distinct in unique indexes, so fold them to sentinels
+    op.create_index(
+        'uq_dashboard_counters_scope',
+        'dashboard_counters',
+        [sa.text('COALESCE(created_by, 0)'), sa.text("COALESCE(day, DATE '1970-01-01')")],
+        unique=True,
+    )
+
+    # Backfill: global totals, per creator, per day, per creator per day
+    op.execute("""
+        INSERT INTO dashboard_counters (created_by, day, patient_count, test_count, abnormal_count)
+        SELECT NULL, NULL,
+               (SELECT COUNT(*) FROM patients),
+               (SELECT COUNT(*) FROM lab_tests),
+               (SELECT COUNT(*) FROM lab_tests WHERE flagged IS TRUE)
+    """)
+    op.execute("""
+        INSERT INTO dashboard_counters (created_by, day, patient_count, test_count, abnormal_count)
+        SELECT p.created_by, NULL, COUNT(DISTINCT p.id), COUNT(t.id),
+               SUM(CASE WHEN t.flagged IS TRUE THEN 1 ELSE 0 END)
+        FROM patients p LEFT JOIN lab_tests t ON t.patient_id = p.id
+        WHERE p.created_by IS NOT NULL
+        GROUP BY p.created_by
+    """)
+    op.execute("""
+        INSERT INTO dashboard_counters (created_by, day, patient_count, test_count, abnormal_count)
+        SELECT NULL, CAST(t.date_conducted AS DATE), 0, COUNT(*),
+               SUM(CASE WHEN t.flagged IS TRUE THEN 1 ELSE 0 END)
+        FROM lab_tests t
+        WHERE t.date_conducted IS NOT NULL
+        GROUP BY CAST(t.date_conducted AS DATE)
+    """)
+    op.execute("""
+        INSERT INTO dashboard_counters (created_by, day, patient_count, test_count, abnormal_count)
+        SELECT p.created_by, CAST(t.date_conducted AS DATE), 0, COUNT(*),
+               SUM(CASE WHEN t.flagged IS TRUE THEN 1 ELSE 0 END)
+        FROM lab_tests t JOIN patients p ON p.id = t.patient_id
+        WHERE t.date_conducted IS NOT NULL AND p.created_by IS NOT NULL
+        GROUP BY p.created_by, CAST(t.date_conducted AS DATE)
+    """)
+
+
+def downgrade():
+    op.drop_index('uq_dashboard_counters_scope', table_name='dashboard_counters')
+    op.drop_table('dashboard_counters')
@@ -0,0 +1,56 @@
+"""Add lab_test_rollups and lab_test_rollup_windows for parameter analytics
+
+Revision ID: e8b4d2a6f913
+Revises: c9e5f27a1d83
+Create Date: 2025-09-05 10:41:27.530918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b4d2a6f913'
+down_revision = 'c9e5f27a1d83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('lab_test_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=10), nullable=False),
+    sa.Column('bucket_start', sa.Date(), nullable=False),
+    sa.Column('parameter', sa.String(length=100), nullable=False),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('test_count', sa.Integer(), nullable=False),
+    sa.Column('numeric_count', sa.Integer(), nullable=False),
+    sa.Column('abnormal_count', sa.Integer(), nullable=False),
+    sa.Column('value_sum', sa.Float(), nullable=True),
+    sa.Column('value_min', sa.Float(), nullable=True),
+    sa.Column('value_max', sa.Float(), nullable=True),
+    sa.Column('p50', sa.Float(), nullable=True),
+    sa.Column('p90', sa.Float(), nullable=True),
+    sa.Column('p95', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('lab_test_rollups', schema=None) as batch_op:
+        batch_op.create_index('ix_lab_test_rollups_bucket', ['granularity', 'bucket_start', 'parameter'], unique=False)
+
+    op.create_table('lab_test_rollup_windows',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=10), nullable=False),
+    sa.Column('bucket_start', sa.Date(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('granularity', 'bucket_start', name='uq_lab_test_rollup_windows_bucket')
+    )
+
+
+def downgrade():
+    op.drop_table('lab_test_rollup_windows')
+    with op.batch_alter_table('lab_test_rollups', schema=None) as batch_op:
+        batch_op.drop_index('ix_lab_test_rollups_bucket')
+
+    op.drop_table('lab_test_rollups')
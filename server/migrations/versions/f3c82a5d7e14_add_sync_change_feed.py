@@ -0,0 +1,63 @@
+"""Add updated_at change columns and tombstones for /api/sync
+
+Revision ID: f3c82a5d7e14
+Revises: d46a1e9b3c70
+Create Date: 2025-08-19 14:02:37.615024
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c82a5d7e14'
+down_revision = 'd46a1e9b3c70'
+branch_labels = None
+depends_on = None
+
+TABLES = ['patients', 'lab_tests', 'test_reference_ranges']
+
+
+def _utc_now():
+    # updated_at holds naive UTC (datetime.utcnow); CURRENT_TIMESTAMP is the
+    # session's local time on Postgres
+    if op.get_bind().dialect.name == 'postgresql':
+        return sa.text("timezone('utc', now())")
+    return sa.text('CURRENT_TIMESTAMP')
+
+
+def upgrade():
+    # Existing rows start out as changed "now", so the first sync after the upgrade is a full one
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                          server_default=_utc_now()))
+
+    # lab_tests is large; build the change feed indexes without blocking writes
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.create_index(f'ix_{table}_updated_at_id', table, ['updated_at', 'id'], unique=False,
+                            postgresql_concurrently=True)
+
+    op.create_table('tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tombstones', schema=None) as batch_op:
+        batch_op.create_index('ix_tombstones_deleted_at_id', ['deleted_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tombstones', schema=None) as batch_op:
+        batch_op.drop_index('ix_tombstones_deleted_at_id')
+
+    op.drop_table('tombstones')
+
+    for table in reversed(TABLES):
+        op.drop_index(f'ix_{table}_updated_at_id', table_name=table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,51 @@
+"""
+Renders a day's (or date range's) lab reports into the report cache.
+Reports whose results have not changed are served from the cache, not re-rendered.
+
+    python render_reports.py                                   # today's patient reports, HTML
+    python render_reports.py --date 2025-03-14 --kind accession --format pdf
+    python render_reports.py --prune-days 30                   # also drop reports unused for 30 days
+"""
+import argparse
+from datetime import date
+
+from app import create_app
+from app.services import reports
+
+def main():
+    parser = argparse.ArgumentParser(description="Render lab reports")
+    parser.add_argument("--date", type=date.fromisoformat, help="day to render (default: today)")
+    parser.add_argument("--date-from", type=date.fromisoformat)
+    parser.add_argument("--date-to", type=date.fromisoformat)
+    parser.add_argument("--kind", choices=reports.KINDS, default="patient")
+    parser.add_argument("--format", choices=reports.FORMATS, default="html")
+    parser.add_argument("--user-id", type=int, help="only this user's patients")
+    parser.add_argument("--workers", type=int, help="render processes (default: REPORT_WORKERS)")
+    parser.add_argument("--prune-days", type=int, help="delete cached reports not used in this many days")
+    args = parser.parse_args()
+
+    date_from, date_to = args.date_from, args.date_to
+    if args.date or not (date_from or date_to):
+        date_from = date_to = args.date or date.today()
+
+    app = create_app()
+    if args.workers is not None:
+        app.config["REPORT_WORKERS"] = args.workers
+    with app.app_context():
+        if args.prune_days is not None:
+            removed = reports.renderer.prune(args.prune_days)
+            print(f"🧹 Pruned {removed} cached reports older than {args.prune_days} days")
+
+        summary = reports.ReportJob(args.kind, args.format, args.user_id, date_from, date_to).run().progress()
+        if summary["state"] != "done":
+            print(f"❌ Report run failed: {summary['error']}")
+            raise SystemExit(1)
+        print(f"✅ {summary['total']} {args.kind} reports ({summary['rendered']} rendered, {summary['cached']} cached, "
+              f"{summary['failed']} failed) in {summary['elapsed_seconds']}s "
+              f"({summary['reports_per_second'] or 0:.0f} reports/s) -> {reports.renderer.cache_dir()}")
+        for error in summary["errors"]:
+            print(f"   {error}")
+
+# Guarded: the render pool spawns processes that re-import this module
+if __name__ == "__main__":
+    main()
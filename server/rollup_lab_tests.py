@@ -0,0 +1,30 @@
+"""
+Precomputes the closed day/week rollups behind GET /api/analytics/parameters,
+so the first request after a quiet night does not pay for them. Buckets
+already stored and unchanged are skipped.
+
+    python rollup_lab_tests.py                       # last 366 days, daily and weekly
+    python rollup_lab_tests.py --days 730 --granularity week
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from app import create_app
+from app.services import analytics
+
+parser = argparse.ArgumentParser(description="Precompute lab test rollups")
+parser.add_argument("--days", type=int, default=366, help="how far back to cover")
+parser.add_argument("--granularity", choices=analytics.GRANULARITIES, action="append",
+                    help="repeatable (default: day and week)")
+args = parser.parse_args()
+
+app = create_app()
+with app.app_context():
+    now = datetime.utcnow()
+    for granularity in args.granularity or analytics.GRANULARITIES:
+        started = time.perf_counter()
+        start = analytics.bucket_start(now - timedelta(days=args.days - 1), granularity)
+        computed = analytics.refresh_rollups(granularity, start, analytics.bucket_start(now, granularity))
+        print(f"✅ {granularity}: {computed} closed buckets computed since {start} "
+              f"in {time.perf_counter() - started:.2f}s")